@@ -1,9 +1,14 @@
-from flask import Flask, request, jsonify, send_file, send_from_directory, render_template, session
+from flask import Flask, request, jsonify, send_file, send_from_directory, render_template, session, g, has_request_context
 from flask_cors import CORS
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from functools import wraps
 import database as db
+import jobs
+import session_store
+import hashlib
+import json
 import os
+import shutil
 import smtplib
 from email.message import EmailMessage
 from werkzeug.utils import secure_filename
@@ -17,6 +22,8 @@ app = Flask(__name__, static_folder='www', template_folder='www')
 app.secret_key = os.environ.get('SECRET_KEY', 'church-attendance-secret-key-2024')
 app.permanent_session_lifetime = timedelta(days=30)
 app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024
+if os.environ.get('SESSION_BACKEND', 'cookie').strip().lower() == 'sqlite':
+    app.session_interface = session_store.SQLiteSessionInterface()
 CORS(app, supports_credentials=True)
 
 ROLE_LEVELS = {
@@ -25,19 +32,38 @@ ROLE_LEVELS = {
     'sub_admin': 2,
     'admin': 3,
 }
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+EXPORT_SPOOL_BYTES = 8 * 1024 * 1024
+# Datasets the servant reports workbook reads; a write to any of them re-renders it.
+REPORT_DATA_VERSIONS = ('servant_reports', 'attendance', 'points', 'eftikad', 'students')
+REPORT_CACHE_FORMAT = 1  # bump when the workbook layout changes
+REPORT_CACHE_FILES = 32
+ETAG_FORMAT = 1  # bump when the JSON of a versioned_get view changes shape
 ALLOWED_ANNOUNCEMENT_EXTENSIONS = {
     '.pdf', '.png', '.jpg', '.jpeg', '.gif', '.webp',
     '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx',
 }
 
 
+@app.teardown_appcontext
+def release_db(exc):
+    """Hand the thread's connection back clean, rolling back anything a failed request left open."""
+    db.release_connection()
+
+
 def current_user():
-    """Return the logged-in user, refreshed from the database."""
+    """Return the logged-in user, resolved once per request through db.get_cached_user."""
+    if 'current_user' not in g:
+        g.current_user = _resolve_current_user()
+    return g.current_user
+
+
+def _resolve_current_user():
     username = session.get('username')
     if not username:
         return None
 
-    user = db.get_user_by_username(username)
+    user = db.get_cached_user(username)
     if not user:
         session.clear()
         return None
@@ -48,87 +74,35 @@ def current_user():
         user['assigned_grades'] = ''
         user['assigned_sections'] = ''
 
-    session['username'] = user['username']
-    session['role'] = user.get('role', 'user')
-    session['class_name'] = user.get('class_name', 'all')
-    session['assigned_grades'] = user.get('assigned_grades', '')
-    session['assigned_sections'] = user.get('assigned_sections', '')
-    return {
+    resolved = {
         'username': user['username'],
         'role': user.get('role', 'user'),
         'class_name': user.get('class_name', 'all'),
         'assigned_grades': user.get('assigned_grades', ''),
         'assigned_sections': user.get('assigned_sections', ''),
     }
+    # Only touch keys that changed, so the session cookie is not re-sent on every request.
+    for key, value in resolved.items():
+        if session.get(key) != value:
+            session[key] = value
+    return resolved
 
 
-def _norm_grade(grade):
-    value = db.normalize_grade_value(grade)
-    return str(value).strip().lower() if value is not None else ''
-
-
-def _assigned_grade_set(user):
-    text = db.normalize_assigned_grades(user.get('assigned_grades', ''))
-    return {_norm_grade(g) for g in text.split(',') if _norm_grade(g)}
-
-
-def _norm_gender(gender):
-    return db.normalize_gender_value(gender).strip().lower()
-
-
-def _assigned_section_set(user):
-    text = db.normalize_assigned_sections(user.get('assigned_sections', ''))
-    return {_norm_gender(s) for s in text.split(',') if _norm_gender(s)}
-
-
-def _student_class(student):
-    return (student.get('class_name') or db.grade_to_class_name(student.get('grade')) or '').strip()
-
-
-def _user_section_allows(user, student):
-    allowed_sections = _assigned_section_set(user)
-    if not allowed_sections:
-        return True
-    return _norm_gender(student.get('gender')) in allowed_sections
+def user_student_scope(user):
+    """The user's StudentScope, compiled once per request."""
+    if not has_request_context():
+        return db.StudentScope(user)
+    key = tuple((user or {}).get(field) for field in
+                ('username', 'role', 'class_name', 'assigned_grades', 'assigned_sections'))
+    scopes = g.setdefault('student_scopes', {})
+    if key not in scopes:
+        scopes[key] = db.StudentScope(user)
+    return scopes[key]
 
 
 def can_user_access_student(user, student):
     """Apply admin/sub-admin/servant visibility rules to one student dict."""
-    if not user:
-        return False
-    role = user.get('role')
-    if role == 'admin':
-        return True
-
-    student_grade = _norm_grade(student.get('grade'))
-    student_class = _student_class(student).lower()
-    user_class = (user.get('class_name') or 'all').strip()
-
-    if role == 'sub_admin':
-        if user_class == 'all':
-            return True
-        allowed = {_norm_grade(g) for g in db.class_grade_values(user_class)}
-        return student_class == user_class.lower() or student_grade in allowed
-
-    assigned_grades = _assigned_grade_set(user)
-    if role == 'rewards':
-        if assigned_grades:
-            return student_grade in assigned_grades and _user_section_allows(user, student)
-        return _user_section_allows(user, student)
-
-    if assigned_grades:
-        return student_grade in assigned_grades and _user_section_allows(user, student)
-
-    if user_class and user_class != 'all':
-        allowed = {_norm_grade(g) for g in db.class_grade_values(user_class)}
-        return (student_class == user_class.lower() or student_grade in allowed) and _user_section_allows(user, student)
-
-    return False
-
-
-def filter_students_for_user(students, user=None):
-    user = user or current_user()
-    return [student for student in students if can_user_access_student(user, student)]
+    return user_student_scope(user).allows(student)
 
 
 def get_student_if_allowed(student_id, user=None):
@@ -168,8 +142,8 @@ def resolve_student_id_from_record(user, record):
     if existing and can_user_access_student(user, existing):
         payload_name = (visible_student.get('name') or '').strip().lower()
         same_name = not payload_name or (existing.get('name') or '').strip().lower() == payload_name
-        same_grade = not visible_student.get('grade') or _norm_grade(existing.get('grade')) == _norm_grade(visible_student.get('grade'))
-        same_gender = not visible_student.get('gender') or _norm_gender(existing.get('gender')) == _norm_gender(visible_student.get('gender'))
+        same_grade = not visible_student.get('grade') or db.grade_match_key(existing.get('grade')) == db.grade_match_key(visible_student.get('grade'))
+        same_gender = not visible_student.get('gender') or db.gender_match_key(existing.get('gender')) == db.gender_match_key(visible_student.get('gender'))
         if same_name and same_grade and same_gender:
             return student_id
 
@@ -217,21 +191,64 @@ def min_role_required(role):
         return wrapper
     return decorator
 
+
+def versioned_get(*datasets, daily=False):
+    """Give a GET view an ETag and Last-Modified from the data versions of `datasets`.
+
+    The tag also covers the URL and the current user's role and assignments, so every
+    user's view of the data is tagged separately. A matching If-None-Match is answered
+    with 304 before the view runs. daily=True also changes the tag each day, for views
+    that depend on today's date. Stack it under login_required.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            # Versions are read before the view runs, so a racing write can only leave
+            # a body newer than its tag (re-sent next time), never a stale body.
+            versions, modified = db.get_data_version_stamp(*datasets)
+            key = json.dumps([ETAG_FORMAT, request.full_path, versions, current_user(),
+                              datetime.now().strftime('%Y-%m-%d') if daily else None])
+            etag = hashlib.sha1(key.encode()).hexdigest()
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+            else:
+                response = app.make_response(fn(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            if modified:
+                response.last_modified = modified.replace(tzinfo=timezone.utc)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
 # Email Configuration (Loaded from .env file)
 SMTP_SERVER = "smtp.gmail.com"
 SMTP_PORT = 465
 SENDER_EMAIL = os.environ.get("SENDER_EMAIL", "") 
 SENDER_PASSWORD = os.environ.get("SENDER_PASSWORD", "") # e.g. Gmail App Password
 
-# Always run init_db to ensure all tables exist
-db.init_db()
+# Apply any pending schema migrations before serving requests
+applied_migrations = db.init_db()
+if applied_migrations:
+    print(f"[SUCCESS] Applied schema migrations: {', '.join(str(v) for v in applied_migrations)}")
+unparsed_dobs = db.get_unparsed_dobs()
+if unparsed_dobs:
+    print(f"[WARNING] {len(unparsed_dobs)} students have a DOB that is not a date and are left out of birthdays: "
+          + ', '.join(f"#{s['id']} {s['name']} ({s['dob']!r})" for s in unparsed_dobs[:20])
+          + (' ...' if len(unparsed_dobs) > 20 else ''))
+db.prune_student_changes()
 
 # Import from Excel if DB was newly created and Excel file exists
 excel_path = os.environ.get("INITIAL_EXCEL_IMPORT_PATH", "")
 if not os.path.exists(db.DB_FILE) or os.path.getsize(db.DB_FILE) < 1000:
     if os.path.exists(excel_path):
         db.import_from_excel(excel_path)
+        history = db.import_attendance_history(excel_path)
         print("[SUCCESS] Database initialized and data imported from Excel")
+        if history['records']:
+            print(f"[SUCCESS] Imported {history['records']} attendance records for {history['dates']} dates")
     else:
         print("[WARNING] Excel file not found, starting with empty database")
 else:
@@ -288,6 +305,7 @@ def send_email():
 
 @app.route('/api/servants', methods=['GET'])
 @login_required
+@versioned_get('students', 'servants')
 def get_servants():
     """Get list of all servants."""
     try:
@@ -312,6 +330,7 @@ def get_filters():
 
 @app.route('/api/students', methods=['GET'])
 @login_required
+@versioned_get('students', 'attendance', 'points')
 def get_students():
     """Get students with optional filters."""
     servant = request.args.get('servant')
@@ -319,13 +338,43 @@ def get_students():
     gender = request.args.get('gender')
     
     try:
-        user = current_user()
-        students = db.get_students(servant, grade, gender)
-        students = filter_students_for_user(students, user)
+        students = db.get_students(servant, grade, gender, scope=user_student_scope(current_user()))
         return jsonify({'students': students})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+
+@app.route('/api/sync/students', methods=['GET'])
+@login_required
+@versioned_get('students', 'attendance', 'points')
+def sync_students():
+    """Students changed since the client's cursor, for the offline roster.
+
+    Returns the changed rows the user can see, the ids to drop (deleted or no longer
+    visible) and the next cursor. Without a usable cursor (first sync, journal pruned,
+    or the user's assignments changed) it returns every student with full=True.
+    Tagged like /api/students, so a repeat request with nothing new gets a 304.
+    """
+    user = current_user()
+    # The cursor carries a tag of the user's assignments, so a change of scope forces a full sync.
+    scope_tag = hashlib.sha1(json.dumps(user).encode()).hexdigest()[:12]
+    seq, _, tag = (request.args.get('since') or '').partition('.')
+    since = int(seq) if seq.isdigit() and tag == scope_tag else None
+    try:
+        # The cursor is read before the rows, so a racing write is sent again next time, never lost.
+        cursor, changed = db.get_student_changes(since)
+        scope = user_student_scope(user)
+        if changed is None:
+            students, deleted = db.get_students(scope=scope), []
+        else:
+            students = db.get_students(scope=scope, student_ids=changed) if changed else []
+            returned = {student['id'] for student in students}
+            deleted = [student_id for student_id in changed if student_id not in returned]
+        return jsonify({'cursor': f'{cursor}.{scope_tag}', 'full': changed is None,
+                        'students': students, 'deleted': deleted})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/attendance', methods=['POST'])
 @login_required
 def save_attendance():
@@ -424,15 +473,36 @@ def get_analytics():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def export_options(values):
+    """export_to_excel() keyword arguments from ?from=, ?to=, ?class= and ?columns=a,b (or a JSON list)."""
+    columns = values.get('columns') or []
+    if isinstance(columns, str):
+        columns = columns.split(',')
+    return {
+        'date_from': values.get('from') or None,
+        'date_to': values.get('to') or None,
+        'class_name': values.get('class') or None,
+        'columns': [column.strip() for column in columns if column.strip()] or None,
+    }
+
+
 @app.route('/api/export', methods=['GET'])
 @min_role_required('sub_admin')
 def export_excel():
-    """Export data to Excel file."""
+    """Export data to Excel file. Optional ?from=, ?to=, ?class= and ?columns= filters."""
+    import tempfile
+    # Each request writes its own workbook; small ones never touch the disk.
+    output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES)
     try:
-        output_path = 'export_attendance_data.xlsx'
-        db.export_to_excel(output_path)
-        return send_file(output_path, as_attachment=True, download_name=f'attendance_export_{datetime.now().strftime("%Y%m%d")}.xlsx')
+        db.export_to_excel(output, **export_options(request.args))
+        output.seek(0)
+        return send_file(output, as_attachment=True, mimetype=XLSX_MIMETYPE,
+                         download_name=f'attendance_export_{datetime.now().strftime("%Y%m%d")}.xlsx')
+    except ValueError as e:
+        output.close()
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
+        output.close()
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/servant', methods=['POST'])
@@ -462,9 +532,7 @@ def get_students_by_servant():
         return jsonify({'error': 'Servant parameter required'}), 400
     
     try:
-        user = current_user()
-        students = db.get_students_by_servant(servant)
-        students = filter_students_for_user(students, user)
+        students = db.get_students_by_servant(servant, scope=user_student_scope(current_user()))
         return jsonify({'students': students})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -520,7 +588,7 @@ def get_notes(student_id):
 def get_filters_all():
     """Get all available grades and genders (no servant filter)."""
     try:
-        students = filter_students_for_user(db.get_students())
+        students = db.get_students(scope=user_student_scope(current_user()))
         grades = sorted(
             {s.get('grade') for s in students if s.get('grade') not in (None, '')},
             key=lambda g: str(g)
@@ -556,52 +624,78 @@ def upload_excel():
             return jsonify({
                 'success': True, 
                 'message': f"Imported {result['added']} new kids, updated {result['updated']} existing kids"
+                           + (f", skipped {result['skipped']} rows" if result['skipped'] else ''),
+                'added': result['added'],
+                'updated': result['updated'],
+                'skipped': result['skipped'],
             })
         else:
             return jsonify({'error': result.get('error', 'Import failed')}), 500
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/upload-attendance-history', methods=['POST'])
+@min_role_required('sub_admin')
+def upload_attendance_history():
+    """Import past attendance from the workbook's wide '... Attendance' sheets."""
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file provided'}), 400
+
+    file = request.files['file']
+    if not file.filename.endswith('.xlsx'):
+        return jsonify({'error': 'Invalid file type. Please upload an .xlsx file.'}), 400
+
+    import tempfile
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp:
+        file.save(tmp.name)
+    try:
+        sheets = request.form.getlist('sheet') or None
+        result = db.import_attendance_history(tmp.name, sheets)
+        return jsonify({
+            'success': True,
+            'message': f"Imported {result['records']} attendance records across {result['dates']} dates",
+            **result,
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        os.unlink(tmp.name)
+
+
 @app.route('/api/batch-attendance', methods=['POST'])
 @login_required
 def batch_attendance():
-    """Save multiple attendance records at once and award points."""
+    """Save multiple attendance records at once and award points in a single commit."""
     data = request.json
     records = data.get('records', [])
     date = data.get('date', datetime.now().strftime('%Y-%m-%d'))
 
     try:
         user = current_user()
-        saved_count = 0
-        for record in records:
-            status = record.get('status')
-            student_id = resolve_student_id_from_record(user, record)
-            if student_id and status:
-                liturgy   = int(record.get('liturgy', 0))
-                tonia     = int(record.get('tonia', 0))
-                confession= int(record.get('confession', 0))
-                bible_p   = int(record.get('bible_prayer', 0))
-                questions = int(record.get('questions', 0))
-                is_present = 1 if status == 'present' else 0
-
-                # Save attendance with extra fields
-                conn = __import__('sqlite3').connect(db.DB_FILE)
-                conn.execute('''
-                    INSERT OR REPLACE INTO attendance
-                    (student_id, date, status, liturgy, tonia, confession, bible_prayer, questions)
-                    VALUES (?,?,?,?,?,?,?,?)
-                ''', (student_id, date, status, liturgy, tonia, confession, bible_p, questions))
-                conn.commit()
-                conn.close()
-
-                # Award points
-                db.calculate_and_award_points(student_id, date, is_present,
-                                              liturgy, tonia, confession, bible_p, questions)
-                saved_count += 1
-            elif status:
-                return jsonify({'error': 'Permission denied for one or more students'}), 403
-
-        return jsonify({'success': True, 'count': saved_count})
+        # Students resolved (or created) here join the batch transaction, so a
+        # denied record leaves nothing behind.
+        with db.db_connection():
+            rows = []
+            for record in records:
+                status = record.get('status')
+                student_id = resolve_student_id_from_record(user, record)
+                if student_id and status:
+                    rows.append({
+                        'student_id': student_id,
+                        'status': status,
+                        'liturgy': int(record.get('liturgy', 0)),
+                        'tonia': int(record.get('tonia', 0)),
+                        'confession': int(record.get('confession', 0)),
+                        'bible_prayer': int(record.get('bible_prayer', 0)),
+                        'questions': int(record.get('questions', 0)),
+                    })
+                elif status:
+                    raise PermissionError('Permission denied for one or more students')
+            results = db.save_attendance_batch(date, rows)
+
+        return jsonify({'success': True, 'count': len(results), 'results': results})
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -610,26 +704,45 @@ def batch_attendance():
 
 @app.route('/api/points/all', methods=['GET'])
 @login_required
+@versioned_get('students', 'points')
 def get_all_points():
     """Get points leaderboard for all students."""
     try:
         user = current_user()
         servant = request.args.get('servant')
-        students = db.get_all_students_points()
+        students = db.get_all_students_points(scope=user_student_scope(user))
         if servant and servant != 'all':
-            class_grades = {_norm_grade(g) for g in db.class_grade_values(servant)}
+            class_grades = {db.grade_match_key(grade) for grade in db.class_grade_values(servant)}
             students = [
                 s for s in students
                 if s.get('servant') == servant
                 or s.get('class_name') == servant
-                or _norm_grade(s.get('grade')) in class_grades
+                or db.grade_match_key(s.get('grade')) in class_grades
             ]
-        students = filter_students_for_user(students, user)
         return jsonify({'students': students})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/points/leaderboard', methods=['GET'])
+@login_required
+def points_leaderboard():
+    """Ranked leaderboard page: ?limit, ?offset, ?servant, ?class_name, ?per_class=1 for top-K per class."""
+    try:
+        user = current_user()
+        servant = request.args.get('servant')
+        servant = servant if servant and servant != 'all' else None
+        class_name = request.args.get('class_name') or None
+        limit = request.args.get('limit', type=int)
+        limit = limit if limit is not None and limit >= 0 else None
+        offset = max(request.args.get('offset', 0, type=int) or 0, 0)
+        per_class = request.args.get('per_class') in ('1', 'true')
+        return jsonify(db.get_points_leaderboard(servant, class_name, limit, offset, per_class,
+                                                 scope=user_student_scope(user)))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/api/points/<int:student_id>', methods=['GET'])
 @login_required
 def get_student_points_route(student_id):
@@ -669,8 +782,20 @@ def clear_points():
     data = request.json or {}
     servant = data.get('servant')
     try:
-        count = db.clear_points_for_redemption(servant if servant and servant != 'all' else None)
-        return jsonify({'success': True, 'cleared_count': count})
+        result = db.clear_points_for_redemption(servant if servant and servant != 'all' else None)
+        return jsonify({'success': True, **result})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/points/replay', methods=['POST'])
+@role_required('admin')
+def replay_points():
+    """Recompute awards from attendance; report the diff, or apply it with {"apply": true}."""
+    data = request.json or {}
+    try:
+        result = db.replay_points(apply=bool(data.get('apply')))
+        return jsonify({'success': True, **result})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -708,8 +833,7 @@ def get_eftikad():
     date_to = request.args.get('to')
     try:
         user = current_user()
-        rows = db.get_eftikad(servant, date_from, date_to)
-        rows = [row for row in rows if can_user_access_student(user, row)]
+        rows = db.get_eftikad(servant, date_from, date_to, scope=user_student_scope(user))
         return jsonify({'eftikad': rows})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -719,6 +843,7 @@ def get_eftikad():
 
 @app.route('/api/announcements', methods=['GET'])
 @login_required
+@versioned_get('announcements')
 def get_announcements():
     try:
         rows = db.get_announcements()
@@ -778,11 +903,11 @@ def serve_upload(filename):
 
 @app.route('/api/birthdays', methods=['GET'])
 @login_required
+@versioned_get('students', daily=True)
 def get_birthdays():
     days = int(request.args.get('days', 30))
     try:
-        birthdays = db.get_upcoming_birthdays(days)
-        birthdays = filter_students_for_user(birthdays)
+        birthdays = db.get_upcoming_birthdays(days, scope=user_student_scope(current_user()))
         return jsonify({'birthdays': birthdays})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -818,6 +943,7 @@ def update_bible():
 
 @app.route('/api/bible/all', methods=['GET'])
 @login_required
+@versioned_get('students', 'bible_tracking')
 def get_bible_all():
     servant = request.args.get('servant')
     try:
@@ -869,6 +995,7 @@ def login():
     try:
         user = db.check_user(username, password)
         if user:
+            g.pop('current_user', None)
             session.clear()
             session.permanent = True
             session['username'] = user['username']
@@ -902,6 +1029,7 @@ def get_session():
 @app.route('/api/logout', methods=['POST'])
 def logout():
     """Clear the current login session."""
+    g.pop('current_user', None)
     session.clear()
     return jsonify({'success': True})
 
@@ -1126,6 +1254,136 @@ def unread_count():
         return jsonify({'error': str(e)}), 500
 
 
+def write_servant_reports_workbook(path, date_filter=None, type_filter=None, date_from=None, date_to=None,
+                                   grade_filter=None):
+    """Write the servant reports and grade summary workbook to path (write-only, so rows stream to disk)."""
+    import openpyxl
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, PatternFill, Alignment
+
+    reports = db.get_servant_reports(date_filter, type_filter, date_from, date_to)
+    grade_summary = db.get_grade_report_summary(date_from or date_filter, date_to or date_filter, grade_filter)
+
+    wb = openpyxl.Workbook(write_only=True)
+    header_fill = PatternFill(start_color='1F2535', end_color='1F2535', fill_type='solid')
+    header_font = Font(bold=True, color='5B8EF0')
+
+    def add_sheet(title, headers, widths):
+        # Write-only sheets take column widths and styles before any row is written.
+        sheet = wb.create_sheet(title)
+        for i, w in enumerate(widths, start=1):
+            sheet.column_dimensions[openpyxl.utils.get_column_letter(i)].width = w
+        cells = []
+        for header in headers:
+            cell = WriteOnlyCell(sheet, value=header)
+            cell.fill = header_fill
+            cell.font = header_font
+            cell.alignment = Alignment(horizontal='center')
+            cells.append(cell)
+        sheet.append(cells)
+        return sheet
+
+    ws = add_sheet('Servant Reports',
+                   ['#', 'Servant', 'Type', 'Date', 'Total', 'Present', 'Absent', 'Notes', 'Submitted At'],
+                   [5, 20, 18, 14, 8, 10, 10, 30, 22])
+    for i, r in enumerate(reports, start=1):
+        rtype = '📋 Attendance' if r.get('report_type') == 'attendance' else '🏠 Eftikad Visit'
+        ws.append([
+            i,
+            r.get('servant_username', ''),
+            rtype,
+            r.get('date', ''),
+            r.get('total_count', 0),
+            r.get('present_count', 0),
+            r.get('absent_count', 0),
+            r.get('notes', ''),
+            r.get('submitted_at', '')
+        ])
+
+    summary_ws = add_sheet('Grade Summary', [
+        'Grade', 'Total Students', 'Present Students', 'Absent Students', 'Attendance Records',
+        'Present Records', 'Absent Records', 'Rewarded Students', 'Reward Events',
+        'Reward Points', 'Eftikad Students', 'Eftikad Visits'
+    ], [16, 16, 18, 18, 18, 16, 16, 18, 14, 14, 16, 14])
+    for row in grade_summary:
+        summary_ws.append([
+            row.get('grade_label', ''),
+            row.get('total_students', 0),
+            row.get('present_students', 0),
+            row.get('absent_students', 0),
+            row.get('attendance_records', 0),
+            row.get('present_count', 0),
+            row.get('absent_count', 0),
+            row.get('rewarded_students', 0),
+            row.get('reward_events', 0),
+            row.get('reward_points', 0),
+            row.get('eftikad_students', 0),
+            row.get('eftikad_visits', 0),
+        ])
+
+    wb.save(path)
+
+
+def report_cache_dir():
+    """Directory of rendered report workbooks (safe to delete at any time)."""
+    return os.environ.get('REPORT_CACHE_DIR') or os.path.join(os.path.dirname(os.path.abspath(db.DB_FILE)), 'report_cache')
+
+
+def cached_servant_reports_workbook(date_filter=None, type_filter=None, date_from=None, date_to=None,
+                                   grade_filter=None):
+    """Path of the servant reports workbook for these filters, rendered only when its data changed.
+
+    Files are keyed by the filters plus the data versions the report reads. The versions
+    are read before rendering, so a write racing the render can only make a file newer
+    than its key, never older. The least recently used files beyond
+    REPORT_CACHE_FILES are removed.
+    """
+    import tempfile
+
+    versions = db.get_data_versions(*REPORT_DATA_VERSIONS)
+    key = json.dumps([REPORT_CACHE_FORMAT, date_filter, type_filter, date_from, date_to, grade_filter, versions])
+    cache_dir = report_cache_dir()
+    path = os.path.join(cache_dir, f'servant_reports_{hashlib.sha1(key.encode()).hexdigest()}.xlsx')
+    if os.path.exists(path):
+        os.utime(path)
+        return path
+
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix='.xlsx.tmp', dir=cache_dir)
+    os.close(fd)
+    try:
+        write_servant_reports_workbook(tmp_path, date_filter, type_filter, date_from, date_to, grade_filter)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+    cached = []
+    for entry in os.scandir(cache_dir):
+        try:
+            if entry.name.startswith('servant_reports_'):
+                cached.append((entry.stat().st_mtime, entry.path))
+        except FileNotFoundError:  # evicted by a concurrent request
+            pass
+    for _, stale in sorted(cached, reverse=True)[REPORT_CACHE_FILES:]:
+        try:
+            os.remove(stale)
+        except FileNotFoundError:
+            pass
+    return path
+
+
+def servant_reports_filename(date_filter=None, date_from=None, date_to=None):
+    """Download name for a servant reports workbook."""
+    if date_filter:
+        date_str = date_filter
+    elif date_from or date_to:
+        date_str = f"{date_from or 'start'}_to_{date_to or 'end'}"
+    else:
+        date_str = datetime.now().strftime('%Y%m%d')
+    return f'servant_reports_{date_str}.xlsx'
+
+
 @app.route('/api/admin/servant-reports/download', methods=['GET'])
 @min_role_required('sub_admin')
 def download_servant_reports():
@@ -1137,98 +1395,131 @@ def download_servant_reports():
     grade_filter = request.args.get('grade')
 
     try:
-        import openpyxl
-        from openpyxl.styles import Font, PatternFill, Alignment
-        import tempfile
+        path = cached_servant_reports_workbook(date_filter, type_filter, date_from, date_to, grade_filter)
+        fname = servant_reports_filename(date_filter, date_from, date_to)
+        return send_file(path, as_attachment=True, download_name=fname)
 
-        reports = db.get_servant_reports(date_filter, type_filter, date_from, date_to)
-        grade_summary = db.get_grade_report_summary(date_from or date_filter, date_to or date_filter, grade_filter)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = 'Servant Reports'
 
-        # Header row
-        headers = ['#', 'Servant', 'Type', 'Date', 'Total', 'Present', 'Absent', 'Notes', 'Submitted At']
-        ws.append(headers)
+# ==================== BACKGROUND JOBS ====================
 
-        # Style headers
-        header_fill = PatternFill(start_color='1F2535', end_color='1F2535', fill_type='solid')
-        header_font = Font(bold=True, color='5B8EF0')
-        for cell in ws[1]:
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal='center')
+@jobs.handler('import_students', files=('file',))
+def import_students_job(job):
+    result = db.import_students_excel(job.params['file'],
+                                      progress=lambda rows: job.progress(rows, message='Reading students'))
+    return {**result, 'message': f"Imported {result['added']} new kids, updated {result['updated']} existing kids"
+                                 + (f", skipped {result['skipped']} rows" if result['skipped'] else '')}
 
-        # Data rows
-        for i, r in enumerate(reports, start=1):
-            rtype = '📋 Attendance' if r.get('report_type') == 'attendance' else '🏠 Eftikad Visit'
-            ws.append([
-                i,
-                r.get('servant_username', ''),
-                rtype,
-                r.get('date', ''),
-                r.get('total_count', 0),
-                r.get('present_count', 0),
-                r.get('absent_count', 0),
-                r.get('notes', ''),
-                r.get('submitted_at', '')
-            ])
-
-        summary_ws = wb.create_sheet('Grade Summary')
-        summary_headers = [
-            'Grade', 'Total Students', 'Present Students', 'Absent Students', 'Attendance Records',
-            'Present Records', 'Absent Records', 'Rewarded Students', 'Reward Events',
-            'Reward Points', 'Eftikad Students', 'Eftikad Visits'
-        ]
-        summary_ws.append(summary_headers)
-        for cell in summary_ws[1]:
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal='center')
 
-        for row in grade_summary:
-            summary_ws.append([
-                row.get('grade_label', ''),
-                row.get('total_students', 0),
-                row.get('present_students', 0),
-                row.get('absent_students', 0),
-                row.get('attendance_records', 0),
-                row.get('present_count', 0),
-                row.get('absent_count', 0),
-                row.get('rewarded_students', 0),
-                row.get('reward_events', 0),
-                row.get('reward_points', 0),
-                row.get('eftikad_students', 0),
-                row.get('eftikad_visits', 0),
-            ])
-
-        for i, w in enumerate([16, 16, 18, 18, 18, 16, 16, 18, 14, 14, 16, 14], start=1):
-            summary_ws.column_dimensions[openpyxl.utils.get_column_letter(i)].width = w
-
-        # Column widths
-        col_widths = [5, 20, 18, 14, 8, 10, 10, 30, 22]
-        for i, w in enumerate(col_widths, start=1):
-            ws.column_dimensions[openpyxl.utils.get_column_letter(i)].width = w
-
-        # Save temp
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp:
-            wb.save(tmp.name)
-            tmp_path = tmp.name
+@jobs.handler('import_attendance_history', files=('file',))
+def import_attendance_history_job(job):
+    sheets = job.params.get('sheet')
+    if isinstance(sheets, str):
+        sheets = [sheets]
+    result = db.import_attendance_history(job.params['file'], sheets or None,
+                                          progress=lambda rows: job.progress(rows, message='Reading attendance sheets'))
+    return {**result, 'message': f"Imported {result['records']} attendance records across {result['dates']} dates"}
 
-        if date_filter:
-            date_str = date_filter
-        elif date_from or date_to:
-            date_str = f"{date_from or 'start'}_to_{date_to or 'end'}"
-        else:
-            date_str = datetime.now().strftime('%Y%m%d')
-        fname = f'servant_reports_{date_str}.xlsx'
-        return send_file(tmp_path, as_attachment=True, download_name=fname)
 
+@jobs.handler('export')
+def export_job(job):
+    filename = f'attendance_export_{datetime.now().strftime("%Y%m%d")}.xlsx'
+    result = db.export_to_excel(job.path(filename), **export_options(job.params),
+                                progress=lambda rows: job.progress(rows, message='Writing rows'))
+    return {**result, 'filename': filename}
+
+
+@jobs.handler('servant_reports')
+def servant_reports_job(job):
+    params = job.params
+    filename = servant_reports_filename(params.get('date'), params.get('from'), params.get('to'))
+    shutil.copyfile(cached_servant_reports_workbook(params.get('date'), params.get('type'), params.get('from'),
+                                                    params.get('to'), params.get('grade')),
+                    job.path(filename))
+    return {'filename': filename}
+
+
+def job_for_user(job_id, user):
+    """The job if it exists and the user submitted it (admins see every job)."""
+    job = db.get_job(job_id)
+    if job and (job['created_by'] == user['username'] or user['role'] == 'admin'):
+        return job
+    return None
+
+
+def job_json(job):
+    """Client view of a job: no server paths, plus a download URL once there is a file."""
+    view = {key: value for key, value in job.items() if key not in ('params', 'result_path', 'worker')}
+    view['download_url'] = f"/api/jobs/{job['id']}/download" if job['status'] == 'done' and job['result_path'] else None
+    return view
+
+
+@app.route('/api/jobs/<kind>', methods=['POST'])
+@login_required
+def submit_job(kind):
+    """Queue an import, export or report job. Returns 202 with the job to poll."""
+    spec = jobs.HANDLERS.get(kind)
+    if not spec:
+        return jsonify({'error': f'Unknown job type: {kind}'}), 404
+    user = current_user()
+    if ROLE_LEVELS.get(user['role'], 0) < ROLE_LEVELS.get(spec['min_role'], 0):
+        return jsonify({'error': 'Permission denied'}), 403
+
+    files = {}
+    for name in spec['files']:
+        upload = request.files.get(name)
+        if not upload or upload.filename == '':
+            return jsonify({'error': 'No file provided'}), 400
+        if not upload.filename.endswith(('.xlsx', '.xls')):
+            return jsonify({'error': 'Invalid file type. Please upload an Excel file.'}), 400
+        files[name] = upload
+    params = request.get_json(silent=True) or {
+        key: values if len(values) > 1 else values[0] for key, values in request.values.lists()
+    }
+
+    try:
+        job_id = jobs.submit(kind, params, user['username'], files)
+        return jsonify({'success': True, 'job': job_json(db.get_job(job_id))}), 202
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/jobs', methods=['GET'])
+@login_required
+def list_jobs():
+    """The current user's recent jobs (every user's for admins)."""
+    user = current_user()
+    created_by = None if user['role'] == 'admin' else user['username']
+    return jsonify({'jobs': [job_json(job) for job in db.list_jobs(created_by)]})
+
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def get_job_status(job_id):
+    """Status, progress and result of a job."""
+    job = job_for_user(job_id, current_user())
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_json(job))
+
+
+@app.route('/api/jobs/<int:job_id>/download', methods=['GET'])
+@login_required
+def download_job_result(job_id):
+    """Download the file a finished job produced."""
+    job = job_for_user(job_id, current_user())
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] != 'done' or not job['result_path'] or not os.path.exists(job['result_path']):
+        return jsonify({'error': 'No file for this job'}), 409
+    return send_file(job['result_path'], as_attachment=True, download_name=job['result']['filename'])
+
+
+# Handlers are registered above, so jobs interrupted by a restart can resume now.
+jobs.start()
+
 if __name__ == '__main__':
     print("[INFO] Starting Church Attendance App...")
     print("[INFO] Access the app at: http://localhost:5000")
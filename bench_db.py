@@ -0,0 +1,89 @@
+"""
+Compare read/write throughput of the database tuning profiles.
+
+Each profile gets a fresh temporary database seeded with students, then
+writer threads save attendance while reader threads load the roster, the
+same mix as Sunday-morning submissions during admin reporting.
+
+Usage:  python bench_db.py [seconds_per_profile] [students]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import sqlite3
+
+import database as db
+
+SECONDS = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+STUDENTS = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+WRITERS = 4
+READERS = 4
+
+
+def seed():
+    db.init_db()
+    with db.db_connection() as conn:
+        conn.executemany(
+            "INSERT INTO students (name, grade, gender, servant) VALUES (?, ?, ?, ?)",
+            [(f'Student {i}', 6 + i % 3, 'M' if i % 2 else 'F', 'Bench') for i in range(STUDENTS)]
+        )
+
+
+def run_profile(name):
+    os.environ['DB_PROFILE'] = name
+    tmp_dir = tempfile.mkdtemp(prefix='bench_db_')
+    db.DB_FILE = os.path.join(tmp_dir, 'attendance.db')
+    seed()
+
+    stop = threading.Event()
+    counts = {'writes': 0, 'reads': 0, 'locked': 0}
+    lock = threading.Lock()
+
+    def bump(key):
+        with lock:
+            counts[key] += 1
+
+    def writer(n):
+        i = 0
+        while not stop.is_set():
+            student_id = (n * 7919 + i) % STUDENTS + 1
+            date = f'2025-{1 + i % 12:02d}-{1 + (i // 12) % 28:02d}'
+            try:
+                db.save_attendance(student_id, date, 'present' if i % 3 else 'absent')
+                bump('writes')
+            except sqlite3.OperationalError:
+                bump('locked')
+            i += 1
+        db.close_connection()
+
+    def reader():
+        while not stop.is_set():
+            try:
+                db.get_students(servant='Bench')
+                bump('reads')
+            except sqlite3.OperationalError:
+                bump('locked')
+        db.close_connection()
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(WRITERS)]
+    threads += [threading.Thread(target=reader) for _ in range(READERS)]
+    for t in threads:
+        t.start()
+    time.sleep(SECONDS)
+    stop.set()
+    for t in threads:
+        t.join()
+    db.close_connection()
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    return counts
+
+
+if __name__ == '__main__':
+    print(f"{SECONDS:g}s per profile, {STUDENTS} students, {WRITERS} writers, {READERS} readers")
+    print(f"{'profile':<10} {'writes/s':>10} {'reads/s':>10} {'locked':>8}")
+    for profile in db.TUNING_PROFILES:
+        result = run_profile(profile)
+        print(f"{profile:<10} {result['writes'] / SECONDS:>10.1f} {result['reads'] / SECONDS:>10.1f} {result['locked']:>8}")
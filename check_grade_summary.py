@@ -0,0 +1,214 @@
+"""
+Confirm the SQL get_grade_report_summary matches the Python bucketing it replaced,
+and time both over growing date ranges.
+
+A temporary database is filled with students under messy grade spellings, years of
+weekly attendance, engine and manual points, eftikad visits and some records whose
+student was deleted. Every filter combination is compared field by field against
+reference_summary() (the previous implementation), then both are timed over 1 year
+up to the full history. Exits non-zero on any difference.
+
+Usage:  python check_grade_summary.py [students] [years] [seed]
+"""
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import database as db
+
+STUDENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+YEARS = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+SEED = int(sys.argv[3]) if len(sys.argv) > 3 else 11
+GRADES = [6, 7, 8, '6', ' 7th ', '8th Grade', 'KG', 'k', 'Pre-K3', 'pk4', '12', '13', 0, None, '', 'Youth', 'youth ']
+
+
+def reference_summary(date_from=None, date_to=None, grade_filter=None):
+    """get_grade_report_summary as it was before the SQL rewrite (Python buckets)."""
+    with db.db_connection(sqlite3.Row) as conn:
+        cursor = conn.cursor()
+
+        selected_grade = db.normalize_grade_value(grade_filter) if grade_filter and grade_filter != 'all' else None
+
+        cursor.execute("SELECT id, grade FROM students")
+        student_rows = [dict(r) for r in cursor.fetchall()]
+        student_grade = {}
+        summary = {}
+
+        def ensure(grade):
+            value = db.normalize_grade_value(grade)
+            if value is None:
+                value = str(grade or 'Unknown').strip() or 'Unknown'
+            if selected_grade is not None and value != selected_grade:
+                return None
+            key = str(value)
+            if key not in summary:
+                summary[key] = {
+                    'grade': value,
+                    'grade_label': db.grade_label_from_value(value),
+                    'total_students': 0,
+                    'present_count': 0,
+                    'absent_count': 0,
+                    'present_students': 0,
+                    'absent_students': 0,
+                    'attendance_records': 0,
+                    'rewarded_students': 0,
+                    'reward_events': 0,
+                    'reward_points': 0,
+                    'eftikad_visits': 0,
+                    'eftikad_students': 0,
+                    '_present_student_ids': set(),
+                    '_absent_student_ids': set(),
+                    '_rewarded_student_ids': set(),
+                    '_eftikad_student_ids': set(),
+                }
+            return summary[key]
+
+        for row in student_rows:
+            bucket = ensure(row.get('grade'))
+            if bucket is None:
+                continue
+            student_grade[row['id']] = bucket['grade']
+            bucket['total_students'] += 1
+
+        attendance_query = "SELECT student_id, status FROM attendance WHERE 1=1"
+        params = []
+        if date_from:
+            attendance_query += " AND date >= ?"
+            params.append(date_from)
+        if date_to:
+            attendance_query += " AND date <= ?"
+            params.append(date_to)
+        cursor.execute(attendance_query, params)
+        for row in cursor.fetchall():
+            bucket = ensure(student_grade.get(row['student_id']))
+            if bucket is None:
+                continue
+            bucket['attendance_records'] += 1
+            if row['status'] == 'present':
+                bucket['present_count'] += 1
+                bucket['_present_student_ids'].add(row['student_id'])
+            else:
+                bucket['absent_count'] += 1
+                bucket['_absent_student_ids'].add(row['student_id'])
+
+        # Engine awards are stored one row per rule; count each scored record once.
+        reward_query = "SELECT student_id, SUM(points_change) AS points_change FROM points_history WHERE points_change > 0"
+        params = []
+        if date_from:
+            reward_query += " AND date >= ?"
+            params.append(date_from)
+        if date_to:
+            reward_query += " AND date <= ?"
+            params.append(date_to)
+        reward_query += " GROUP BY student_id, date, CASE WHEN rule_code IS NULL THEN id END"
+        cursor.execute(reward_query, params)
+        rewarded_by_grade = {}
+        for row in cursor.fetchall():
+            bucket = ensure(student_grade.get(row['student_id']))
+            if bucket is None:
+                continue
+            bucket['reward_events'] += 1
+            bucket['reward_points'] += row['points_change'] or 0
+            bucket['_rewarded_student_ids'].add(row['student_id'])
+            rewarded_by_grade.setdefault(str(bucket['grade']), set()).add(row['student_id'])
+
+        for key, ids in rewarded_by_grade.items():
+            if key in summary:
+                summary[key]['rewarded_students'] = len(ids)
+
+        eft_query = "SELECT student_id FROM eftikad WHERE 1=1"
+        params = []
+        if date_from:
+            eft_query += " AND date >= ?"
+            params.append(date_from)
+        if date_to:
+            eft_query += " AND date <= ?"
+            params.append(date_to)
+        cursor.execute(eft_query, params)
+        for row in cursor.fetchall():
+            bucket = ensure(student_grade.get(row['student_id']))
+            if bucket is not None:
+                bucket['eftikad_visits'] += 1
+                bucket['_eftikad_student_ids'].add(row['student_id'])
+
+    rows = []
+    for bucket in summary.values():
+        bucket['present_students'] = len(bucket.pop('_present_student_ids', set()))
+        bucket['absent_students'] = len(bucket.pop('_absent_student_ids', set()))
+        bucket['rewarded_students'] = len(bucket.pop('_rewarded_student_ids', set()))
+        bucket['eftikad_students'] = len(bucket.pop('_eftikad_student_ids', set()))
+        rows.append(bucket)
+    return sorted(rows, key=lambda item: db.grade_sort_key(item['grade']))
+
+
+def seed():
+    rng = random.Random(SEED)
+    start = date(2026, 1, 4) - timedelta(weeks=52 * YEARS)
+    sundays = [(start + timedelta(weeks=w)).isoformat() for w in range(52 * YEARS)]
+    with db.db_connection() as conn:
+        conn.executemany("INSERT INTO students (id, name, grade, gender, servant) VALUES (?, ?, ?, 'M', 'Check')",
+                         [(i, f'Student {i}', rng.choice(GRADES)) for i in range(1, STUDENTS + 1)])
+        conn.executemany(
+            'INSERT INTO attendance (student_id, date, status) VALUES (?, ?, ?)',
+            [(i, day, rng.choice(['present', 'present', 'absent', 'late']))
+             for day in sundays for i in range(1, STUDENTS + 1) if rng.random() < 0.8])
+        conn.executemany(
+            'INSERT INTO points_history (student_id, points_change, reason, date, rule_code, period_key) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            [(i, rng.choice([5, 10, -5, 0]), 'check', day, rng.choice([None, 'TONIA', 'QUESTIONS']), f'{day}-{n}')
+             for n, day in enumerate(sundays) for i in range(1, STUDENTS + 1) if rng.random() < 0.3])
+        conn.executemany(
+            'INSERT INTO eftikad (servant_username, student_id, date, created_at) VALUES (?, ?, ?, ?)',
+            [('check', rng.randint(1, STUDENTS), day, day) for day in sundays for _ in range(rng.randint(0, 5))])
+        # Records left behind by deleted students land in the 'Unknown' bucket.
+        conn.execute('DELETE FROM students WHERE id % 97 = 0')
+    return sundays
+
+
+def ordered(rows):
+    return sorted(rows, key=lambda row: (db.grade_sort_key(row['grade']), str(row['grade'])))
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    fn(*args)
+    return (time.perf_counter() - started) * 1000
+
+
+if __name__ == '__main__':
+    tmp_dir = tempfile.mkdtemp(prefix='check_grade_summary_')
+    db.DB_FILE = os.path.join(tmp_dir, 'attendance.db')
+    db.init_db()
+    sundays = seed()
+    middle = sundays[len(sundays) // 2]
+    failed = False
+    cases = [(date_from, date_to, grade) for date_from, date_to in
+             [(None, None), (middle, None), (None, middle), (sundays[-52], sundays[-1]), (middle, middle)]
+             for grade in [None, 'all', '7', '7th Grade', 'KG', 'Pre K3', 'nonsense']]
+    for case in cases:
+        expected, actual = ordered(reference_summary(*case)), db.get_grade_report_summary(*case)
+        if expected != actual:
+            failed = True
+            print(f"FAIL {case}")
+            for want, got in zip(expected, actual):
+                if want != got:
+                    print(f"       expected {want}\n       got      {got}")
+            if len(expected) != len(actual):
+                print(f"       {len(expected)} grades expected, {len(actual)} returned")
+    print(f"{'FAIL' if failed else 'OK  '} {len(cases)} filter combinations match the reference")
+
+    print(f"\n{STUDENTS} students, {YEARS} years of weekly history")
+    print(f"{'range':<10} {'reference ms':>13} {'sql ms':>9}")
+    for years in range(1, YEARS + 1):
+        date_from = sundays[-52 * years]
+        print(f"{years:>2} year{'s' if years > 1 else ' '}   {timed(reference_summary, date_from):>13.1f} "
+              f"{timed(db.get_grade_report_summary, date_from):>9.1f}")
+
+    db.close_connection()
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,51 @@
+"""
+Confirm with EXPLAIN QUERY PLAN that the hot queries in database.py use their indexes.
+Exits non-zero if any query falls back to a table scan.
+
+The SQL comes from the same builders the endpoints call. Restricted user scopes expand
+to IN lists over the stored grade, gender and class values, so by default the check
+runs on a temporary database holding students under mixed spellings. Pass a database
+path to check that database instead; with no students in it, the scoped rosters scan.
+
+Usage:  python check_indexes.py [database]
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+import database as db
+
+GRADES = [6, 7, 8, 'KG', 'Pre-K3', None, '']
+GENDERS = ['M', 'F', 'Boy', 'girl', None, '']
+CLASSES = ['Middle School', '6th Grade', '', None]
+
+tmp_dir = None
+if len(sys.argv) > 1:
+    db.DB_FILE = sys.argv[1]
+    db.init_db()
+else:
+    tmp_dir = tempfile.mkdtemp(prefix='check_indexes_')
+    db.DB_FILE = os.path.join(tmp_dir, 'attendance.db')
+    db.init_db()
+    students = [(grade, gender, class_name) for grade in GRADES for gender in GENDERS for class_name in CLASSES]
+    with db.db_connection() as conn:
+        conn.executemany("INSERT INTO students (name, grade, gender, servant, class_name) VALUES ('Check', ?, ?, 'Check', ?)",
+                         students)
+        db.bump_data_version(conn, 'students')
+
+results = db.explain_hot_queries()
+db.close_connection()
+if tmp_dir:
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+for result in results:
+    print(f"{'OK  ' if result['ok'] else 'FAIL'} {result['name']}")
+    for detail in result['plan']:
+        print(f"       {detail}")
+    if result['missing']:
+        print(f"       missing: {', '.join(result['missing'])}")
+
+failed = [r for r in results if not r['ok']]
+print(f"\n{len(results) - len(failed)}/{len(results)} hot queries use their index")
+sys.exit(1 if failed else 0)
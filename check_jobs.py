@@ -0,0 +1,108 @@
+"""
+Show that a long import running as a background job does not block attendance.
+
+A temporary database gets a roster, then a large attendance-history workbook is
+submitted to /api/jobs/import_attendance_history while the same client keeps
+saving attendance through /api/attendance. Save latency is compared with an
+idle baseline. A job left 'running' by a dead process is then recovered and
+completed, as after a server restart. Exits non-zero if a save fails or waits
+longer than the busy timeout, or if either job does not finish.
+
+Usage:  python check_jobs.py [students] [weeks]
+"""
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+STUDENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+WEEKS = int(sys.argv[2]) if len(sys.argv) > 2 else 150
+
+tmp_dir = tempfile.mkdtemp(prefix='check_jobs_')
+os.chdir(tmp_dir)  # app.py opens attendance.db in the working directory
+
+import database as db  # noqa: E402
+import jobs  # noqa: E402
+from app import app  # noqa: E402
+
+
+def build_workbook(path):
+    from openpyxl import Workbook
+    rng = random.Random(1)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('All Attendance')
+    dates = [datetime(2023, 1, 1) + timedelta(weeks=w) for w in range(WEEKS)]
+    ws.append(['Name', 'Grade', 'Servant', 'Gen'] + dates)
+    for i in range(STUDENTS):
+        ws.append([f'Student {i}', 6 + i % 3, 'Check', 'MF'[i % 2]]
+                  + [rng.choice(['P', 'P', 'A', None]) for _ in dates])
+    wb.save(path)
+
+
+def save_latencies(client, count, day):
+    latencies, failures = [], 0
+    for i in range(count):
+        started = time.perf_counter()
+        response = client.post('/api/attendance', json={'student_id': i % 50 + 1, 'date': day, 'status': 'present'})
+        latencies.append(time.perf_counter() - started)
+        failures += response.status_code != 200
+    return latencies, failures
+
+
+def summary(latencies):
+    return f"p50 {statistics.median(latencies) * 1000:.1f} ms, max {max(latencies) * 1000:.1f} ms"
+
+
+if __name__ == '__main__':
+    failed = False
+    with db.db_connection() as conn:
+        conn.executemany("INSERT INTO students (name, grade, gender, servant) VALUES (?, 6, 'M', 'Check')",
+                         [(f'Student {i}',) for i in range(50)])
+    workbook = os.path.join(tmp_dir, 'history.xlsx')
+    build_workbook(workbook)
+    client = app.test_client()
+    client.post('/api/login', json={'username': 'STJOHN', 'password': 'Pray#1'})
+
+    baseline, _ = save_latencies(client, 50, '2030-01-06')
+    print(f"idle saves:            {summary(baseline)}")
+
+    started = time.perf_counter()
+    with open(workbook, 'rb') as f:
+        response = client.post('/api/jobs/import_attendance_history', data={'file': (f, 'history.xlsx')},
+                               content_type='multipart/form-data')
+    job_id = response.get_json()['job']['id']
+    print(f"submitted job {job_id} in {(time.perf_counter() - started) * 1000:.0f} ms ({response.status_code})")
+
+    during, failures, day = [], 0, datetime(2030, 1, 13)
+    while client.get(f'/api/jobs/{job_id}').get_json()['status'] in ('queued', 'running'):
+        latencies, failed_saves = save_latencies(client, 20, day.strftime('%Y-%m-%d'))
+        during += latencies
+        failures += failed_saves
+        day += timedelta(days=7)
+    job = client.get(f'/api/jobs/{job_id}').get_json()
+    print(f"job {job['status']} in {time.perf_counter() - started:.1f}s: {job['result'] and job['result']['message']}")
+    print(f"saves during import:   {summary(during)}, {len(during)} saves, {failures} failed")
+    busy_timeout = db.describe_tuning()['effective'].get('busy_timeout', 5000) / 1000
+    failed |= job['status'] != 'done' or failures > 0 or max(during) >= busy_timeout
+
+    # A job claimed by a process that no longer exists, as after a crash mid-import.
+    orphan = db.create_job('export', {}, 'STJOHN')
+    db.claim_job(orphan, 'gone-host:1')
+    jobs.recover()
+    jobs.wait(60)
+    job = db.get_job(orphan)
+    print(f"recovered job {orphan}: {job['status']} after {job['attempts']} attempts, file {job['result']['filename']}")
+    failed |= job['status'] != 'done'
+    download = client.get(f'/api/jobs/{orphan}/download')
+    failed |= download.status_code != 200
+    download.close()
+
+    db.close_connection()
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    print('FAIL' if failed else 'OK')
+    sys.exit(1 if failed else 0)
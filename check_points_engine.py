@@ -0,0 +1,304 @@
+"""
+Confirm the points engine awards what the original per-record rules did, and that
+scoring a whole service date at once awards exactly what scoring each record does.
+
+Temporary databases get the same randomly generated attendance history:
+
+- Scored record by record with reference_award_points() (the implementation the
+  engine replaced) and with calculate_and_award_points. The points earned per student
+  and date, students.points and bible_tracking must match. Manual rows the old LIKE
+  checks would mistake for awards are left out of this comparison, and so are repeat
+  submissions on one day. Those are where the engine departs from the old rules on
+  purpose, and INTENDED_DIFFERENCES asserts each of them case by case.
+- Scored record by record and date by date with award_points_for_dates. Here
+  points_history (including rule codes and periods), students.points and
+  bible_tracking must be identical, and both must agree with replay_points().
+
+Assumes the default POINT_VALUES. Exits non-zero on any difference.
+
+Usage:  python check_points_engine.py [students] [weeks] [seed]
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+
+import database as db
+
+STUDENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+WEEKS = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+SEED = int(sys.argv[3]) if len(sys.argv) > 3 else 7
+
+
+# Words the old rules matched with LIKE in points_history.reason.
+LEGACY_REASON_MATCHES = ('Music/Tonia', 'Questions', 'Confession', 'Sunday School 4-week', 'Sunday School 3-week',
+                         'Liturgy 4-week', 'Liturgy 3-week', 'Bible/Prayer weekly')
+
+# Where the engine departs from the old rules on purpose:
+# (case, manual rows, [(date, record)] scored in order, old points per record, engine points per record).
+# A record is (student_id, is_present, liturgy, tonia, confession, bible_prayer, questions).
+INTENDED_DIFFERENCES = [
+    ('tonia and questions award once per day, not per submission',
+     [], [('2025-03-02', (1, 0, 0, 1, 0, 0, 2)), ('2025-03-02', (1, 0, 0, 1, 0, 0, 2))],
+     [3, 3], [3, 0]),
+    ('a manual row mentioning Confession no longer blocks the monthly award',
+     [(1, 5, 'Confession bonus', '2025-03-01')], [('2025-03-09', (1, 0, 0, 0, 1, 0, 0))],
+     [0], [10]),
+    ('a manual row mentioning a streak no longer blocks the streak award',
+     [(1, 5, 'Liturgy 4-week streak fix', '2025-03-02')],
+     [(day, (1, 0, 1, 0, 0, 0, 0)) for day in ('2025-03-02', '2025-03-09', '2025-03-16', '2025-03-23')],
+     [0, 0, 10, 0], [0, 0, 10, 15]),
+]
+
+
+def reference_award_points(student_id, date, is_present, liturgy, tonia, confession, bible_prayer, questions):
+    """calculate_and_award_points as it was before the points engine (LIKE-deduplicated, one row per record)."""
+    with db.db_connection() as conn:
+        cursor = conn.cursor()
+        total_points = 0
+        reasons = []
+
+        if tonia:
+            total_points += 1
+            reasons.append('+1 Music/Tonia')
+
+        if questions and questions > 0:
+            total_points += int(questions)
+            reasons.append(f'+{questions} Questions')
+
+        if confession:
+            month_start = date[:7] + '-01'
+            cursor.execute('''SELECT SUM(points_change) FROM points_history
+                WHERE student_id=? AND reason LIKE '%Confession%' AND date >= ? AND date <= ?''',
+                (student_id, month_start, date))
+            already = cursor.fetchone()[0] or 0
+            if already == 0:
+                total_points += 10
+                reasons.append('+10 Confession')
+
+        if is_present:
+            cursor.execute('''SELECT date FROM attendance
+                WHERE student_id=? AND date < ? AND status='present'
+                ORDER BY date DESC LIMIT 3''', (student_id, date))
+            recent = cursor.fetchall()
+            streak = 1 + len(recent)
+            if streak >= 4:
+                cutoff = recent[-1][0] if recent else date
+                cursor.execute('''SELECT COUNT(*) FROM points_history
+                    WHERE student_id=? AND reason LIKE '%Sunday School 4-week%' AND date >= ?''', (student_id, cutoff))
+                if (cursor.fetchone()[0] or 0) == 0:
+                    total_points += 15
+                    reasons.append('+15 Sunday School 4-week streak')
+            elif streak == 3:
+                cutoff = recent[-1][0] if recent else date
+                cursor.execute('''SELECT COUNT(*) FROM points_history
+                    WHERE student_id=? AND reason LIKE '%Sunday School 3-week%' AND date >= ?''', (student_id, cutoff))
+                if (cursor.fetchone()[0] or 0) == 0:
+                    total_points += 10
+                    reasons.append('+10 Sunday School 3-week streak')
+
+        if liturgy:
+            cursor.execute('''SELECT date FROM attendance
+                WHERE student_id=? AND date < ? AND liturgy=1
+                ORDER BY date DESC LIMIT 3''', (student_id, date))
+            recent_l = cursor.fetchall()
+            l_streak = 1 + len(recent_l)
+            if l_streak >= 4:
+                cutoff = recent_l[-1][0] if recent_l else date
+                cursor.execute('''SELECT COUNT(*) FROM points_history
+                    WHERE student_id=? AND reason LIKE '%Liturgy 4-week%' AND date >= ?''', (student_id, cutoff))
+                if (cursor.fetchone()[0] or 0) == 0:
+                    total_points += 15
+                    reasons.append('+15 Liturgy 4-week streak')
+            elif l_streak == 3:
+                cutoff = recent_l[-1][0] if recent_l else date
+                cursor.execute('''SELECT COUNT(*) FROM points_history
+                    WHERE student_id=? AND reason LIKE '%Liturgy 3-week%' AND date >= ?''', (student_id, cutoff))
+                if (cursor.fetchone()[0] or 0) == 0:
+                    total_points += 10
+                    reasons.append('+10 Liturgy 3-week streak')
+
+        if bible_prayer:
+            d = datetime.strptime(date, '%Y-%m-%d')
+            week_start = (d - timedelta(days=d.weekday())).strftime('%Y-%m-%d')
+            cursor.execute('SELECT days_read FROM bible_tracking WHERE student_id=? AND week_start_date=?',
+                           (student_id, week_start))
+            row = cursor.fetchone()
+            days = (row[0] if row else 0) + 1
+            if row:
+                cursor.execute('UPDATE bible_tracking SET days_read=? WHERE student_id=? AND week_start_date=?',
+                               (days, student_id, week_start))
+            else:
+                cursor.execute('INSERT INTO bible_tracking (student_id, week_start_date, days_read) VALUES (?,?,?)',
+                               (student_id, week_start, days))
+            if days >= 7:
+                cursor.execute('''SELECT COUNT(*) FROM points_history
+                    WHERE student_id=? AND reason LIKE '%Bible/Prayer weekly%' AND date >= ?''',
+                    (student_id, week_start))
+                if (cursor.fetchone()[0] or 0) == 0:
+                    total_points += 15
+                    reasons.append('+15 Bible/Prayer weekly')
+
+        if total_points > 0:
+            reason_str = ', '.join(reasons)
+            cursor.execute('INSERT INTO points_history (student_id, points_change, reason, date) VALUES (?,?,?,?)',
+                           (student_id, total_points, reason_str, date))
+            cursor.execute('UPDATE students SET points = COALESCE(points,0) + ? WHERE id=?',
+                           (total_points, student_id))
+    return total_points
+
+
+def generate_history():
+    rng = random.Random(SEED)
+    start = date(2025, 1, 5)
+    days = [start + timedelta(days=7 * w + offset) for w in range(WEEKS) for offset in range(7)]
+    records = []
+    for day in days:
+        for student_id in range(1, STUDENTS + 1):
+            if rng.random() < 0.25:
+                continue
+            present = rng.random() < 0.75
+            records.append((day.isoformat(), student_id, 'present' if present else 'absent',
+                            int(rng.random() < 0.5), int(rng.random() < 0.3), int(rng.random() < 0.2),
+                            int(rng.random() < 0.9), rng.choice([0, 0, 0, 1, 2])))
+    manual = [(rng.randint(1, STUDENTS), rng.choice([5, -5, 10]),
+               rng.choice(['Confession bonus', 'Liturgy 4-week streak fix', 'Good behaviour']),
+               rng.choice(days).isoformat()) for _ in range(STUDENTS // 3)]
+    return records, manual
+
+
+def new_database(manual):
+    tmp_dir = tempfile.mkdtemp(prefix='check_points_')
+    db.DB_FILE = os.path.join(tmp_dir, 'attendance.db')
+    db.init_db()
+    with db.db_connection() as conn:
+        conn.executemany("INSERT INTO students (id, name, grade, gender, servant) VALUES (?, ?, 6, 'M', 'Check')",
+                         [(i, f'Student {i}') for i in range(1, STUDENTS + 1)])
+        for student_id, points, reason, day in manual:
+            db.add_manual_points(student_id, points, reason, day)
+    return tmp_dir
+
+
+def drop_database(tmp_dir):
+    db.close_connection()
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def score_record(score, day, record):
+    student_id, is_present, liturgy, tonia, confession, bible_prayer, questions = record
+    award = reference_award_points if score == 'reference' else db.calculate_and_award_points
+    return award(student_id, day, is_present, liturgy, tonia, confession, bible_prayer, questions)
+
+
+def build_reference_pair(records, manual):
+    """Score the history record by record with the old rules and with the engine."""
+    runs = {}
+    for score in ('reference', 'single'):
+        tmp_dir = new_database(manual)
+        for day in sorted({r[0] for r in records}):
+            todays = [r[1:] for r in records if r[0] == day]
+            with db.db_connection() as conn:
+                conn.executemany(db.ATTENDANCE_UPSERT, [(r[0], day) + r[1:] for r in todays])
+            for student_id, status, *flags in todays:
+                score_record(score, day, (student_id, 1 if status == 'present' else 0, *flags))
+        with db.db_connection() as conn:
+            runs[score] = {
+                'earned': conn.execute('SELECT student_id, date, SUM(points_change) FROM points_history '
+                                       'GROUP BY student_id, date ORDER BY student_id, date').fetchall(),
+                'points': conn.execute('SELECT id, points FROM students ORDER BY id').fetchall(),
+                'bible': sorted(conn.execute(
+                    'SELECT student_id, week_start_date, days_read FROM bible_tracking').fetchall()),
+            }
+        drop_database(tmp_dir)
+    return runs['reference'], runs['single']
+
+
+def check_intended_differences():
+    failed = False
+    for case, manual, scored, old_points, new_points in INTENDED_DIFFERENCES:
+        got = {}
+        for score in ('reference', 'single'):
+            tmp_dir = new_database(manual)
+            got[score] = []
+            for day, record in scored:
+                with db.db_connection() as conn:
+                    conn.execute(db.ATTENDANCE_UPSERT,
+                                 (record[0], day, 'present' if record[1] else 'absent') + record[2:])
+                got[score].append(score_record(score, day, record))
+            drop_database(tmp_dir)
+        ok = got['reference'] == old_points and got['single'] == new_points
+        failed |= not ok
+        print(f"{'OK  ' if ok else 'FAIL'} intended: {case}")
+        if not ok:
+            print(f"       old rules {got['reference']} (expected {old_points}), "
+                  f"engine {got['single']} (expected {new_points})")
+    return failed
+
+
+def build(records, manual, score):
+    tmp_dir = new_database(manual)
+    for day in sorted({r[0] for r in records}):
+        todays = [r[1:] for r in records if r[0] == day]
+        with db.db_connection() as conn:
+            conn.executemany(db.ATTENDANCE_UPSERT, [(r[0], day) + r[1:] for r in todays])
+        if score == 'batch':
+            db.award_points_for_dates(day)
+            continue
+        for student_id, status, *flags in todays:
+            score_record(score, day, (student_id, 1 if status == 'present' else 0, *flags))
+    replay = db.replay_points()
+    drift = [(kind, award['student_id'], award['rule_code'], award['period_key'])
+             for kind in ('added', 'removed', 'changed') for award in replay[kind]]
+    # A student submitted twice on one day must see their own first award.
+    duplicate_day = (date(2025, 1, 5) + timedelta(days=7 * WEEKS)).isoformat()
+    twice = [(1, 1, 1, 1, 1, 1, 2), (1, 1, 1, 1, 1, 1, 0), (2, 1, 0, 0, 1, 1, 0)]
+    if score == 'single':
+        for record in twice:
+            db.calculate_and_award_points(record[0], duplicate_day, *record[1:])
+    else:
+        db.evaluate_points(duplicate_day, twice)
+    with db.db_connection() as conn:
+        snapshot = {
+            'history': sorted(conn.execute(
+                'SELECT student_id, points_change, reason, date, rule_code, period_key FROM points_history').fetchall()),
+            'points': conn.execute('SELECT id, points FROM students ORDER BY id').fetchall(),
+            'bible': sorted(conn.execute(
+                'SELECT student_id, week_start_date, days_read FROM bible_tracking').fetchall()),
+        }
+    drop_database(tmp_dir)
+    return snapshot, drift
+
+
+if __name__ == '__main__':
+    records, manual = generate_history()
+    failed = False
+
+    unmatched = [row for row in manual if not any(word in row[2] for word in LEGACY_REASON_MATCHES)]
+    reference, engine = build_reference_pair(records, unmatched)
+    for key in reference:
+        same = reference[key] == engine[key]
+        failed |= not same
+        print(f"{'OK  ' if same else 'FAIL'} engine vs old rules, {key}: {len(reference[key])} rows")
+        if not same:
+            for row in sorted(set(reference[key]) ^ set(engine[key]), key=repr)[:10]:
+                print(f"       {'old rules' if row in reference[key] else 'engine'} only: {row}")
+    failed |= check_intended_differences()
+
+    single, single_drift = build(records, manual, 'single')
+    batch, batch_drift = build(records, manual, 'batch')
+    for key in single:
+        same = single[key] == batch[key]
+        failed |= not same
+        print(f"{'OK  ' if same else 'FAIL'} single vs batch, {key}: {len(single[key])} rows")
+        if not same:
+            for row in sorted(set(single[key]) ^ set(batch[key]), key=repr)[:10]:
+                print(f"       {'single' if row in single[key] else 'batch'} only: {row}")
+    for name, drift in (('single', single_drift), ('batch', batch_drift)):
+        failed |= bool(drift)
+        print(f"{'OK  ' if not drift else 'FAIL'} replay of {name}: {len(drift)} awards differ")
+        for row in drift[:10]:
+            print(f"       {row}")
+    print(f"\n{len(records)} attendance records, {sum(p for _, p in single['points'])} points awarded")
+    sys.exit(1 if failed else 0)
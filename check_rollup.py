@@ -0,0 +1,226 @@
+"""
+Confirm the attendance_daily rollup stays equal to the attendance it summarizes,
+and time the chart query against the live join it replaced.
+
+A temporary database is filled with students under mixed grade, gender, servant and
+class spellings and years of weekly attendance. Random edits then go through the
+normal write paths: single and batch saves (including status flips and repeats
+within a batch), grade/gender/servant changes, deletes and a students workbook
+import. A final round imports attendance history that stops after its batches
+commit and is then run again. After each round the rollup is compared row by row
+with a fresh aggregation, and get_class_attendance_stats / get_analytics with the
+reference queries, over every filter combination. Exits non-zero on any difference.
+
+Usage:  python check_rollup.py [students] [years] [seed]
+"""
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import database as db
+
+STUDENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+YEARS = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+SEED = int(sys.argv[3]) if len(sys.argv) > 3 else 7
+GRADES = [6, 7, 8, '6', 'KG', 'Pre-K3', None, '']
+GENDERS = ['M', 'F', 'Boy', 'girl', None, '']
+SERVANTS = ['Mina', 'Mark', '', None]
+STATUSES = ['present', 'present', 'absent', 'late']
+
+
+def reference_stats(servant_filter=None, year=None, grades=None, sections=None, date_from=None, date_to=None):
+    """get_class_attendance_stats as it was before the rollup (live join over attendance)."""
+    query = '''SELECT s.grade, strftime('%Y-%m', a.date) as month,
+        COUNT(*) as total,
+        SUM(CASE WHEN a.status='present' THEN 1 ELSE 0 END) as present_count
+        FROM attendance a JOIN students s ON a.student_id = s.id
+        WHERE 1=1'''
+    params = []
+    if servant_filter:
+        class_grades = db.class_grade_values(servant_filter)
+        query += ' AND (s.servant=? OR s.class_name=?' + (
+            f" OR s.grade IN ({','.join('?' for _ in class_grades)})" if class_grades else '') + ')'
+        params += [servant_filter, servant_filter] + list(class_grades)
+    normalized = []
+    for grade in (grades.split(',') if grades else []):
+        value = db.normalize_grade_value(grade)
+        if value is not None and value not in normalized:
+            normalized.append(value)
+    if normalized:
+        query += f" AND s.grade IN ({','.join('?' for _ in normalized)})"
+        params += normalized
+    variants = []
+    for section in (db.normalize_assigned_sections(sections).split(',') if sections else []):
+        if section == 'Boy':
+            variants += ['M', 'Boy', 'Boys', 'Male', 'male', 'boy']
+        elif section == 'Girl':
+            variants += ['F', 'Girl', 'Girls', 'Female', 'female', 'girl']
+    variants = list(dict.fromkeys(variants))
+    if variants:
+        query += f" AND s.gender IN ({','.join('?' for _ in variants)})"
+        params += variants
+    for clause, value in ((" AND strftime('%Y', a.date)=?", year), (' AND a.date >= ?', date_from),
+                          (' AND a.date <= ?', date_to)):
+        if value:
+            query += clause
+            params.append(value)
+    query += ' GROUP BY s.grade, month ORDER BY month DESC, s.grade LIMIT 120'
+    with db.db_connection(sqlite3.Row) as conn:
+        return [dict(r) for r in conn.execute(query, params).fetchall()]
+
+
+def reference_rate():
+    since = (datetime.now() - timedelta(days=28)).strftime('%Y-%m-%d')
+    with db.db_connection() as conn:
+        present, total = conn.execute("SELECT SUM(status = 'present'), COUNT(*) FROM attendance WHERE date >= ?",
+                                      (since,)).fetchone()
+    return round(present / total * 100, 1) if total else 0
+
+
+def rollup_snapshot():
+    with db.db_connection() as conn:
+        return sorted(conn.execute('SELECT * FROM attendance_daily').fetchall())
+
+
+def seed(rng):
+    start = date.today() - timedelta(weeks=52 * YEARS)
+    sundays = [(start + timedelta(weeks=w)).isoformat() for w in range(52 * YEARS + 1)]
+    with db.db_connection() as conn:
+        conn.executemany(
+            'INSERT INTO students (id, name, grade, gender, servant, class_name) VALUES (?, ?, ?, ?, ?, ?)',
+            [(i, f'Student {i}', grade, rng.choice(GENDERS), rng.choice(SERVANTS),
+              rng.choice([db.grade_to_class_name(db.normalize_grade_value(grade)), 'Mina', None]))
+             for i, grade in ((i, rng.choice(GRADES)) for i in range(1, STUDENTS + 1))])
+        conn.executemany('INSERT INTO attendance (student_id, date, status) VALUES (?, ?, ?)',
+                         [(i, day, rng.choice(STATUSES))
+                          for day in sundays for i in range(1, STUDENTS + 1) if rng.random() < 0.8])
+    # Seeded behind the write paths, so build the rollup once like the migration does.
+    db.rebuild_attendance_rollup()
+    return sundays
+
+
+def students_workbook(path, rng, ids):
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('All Kids')
+    ws.append(['Name', 'Grade', 'Gender', 'Servant'])
+    for i in ids:
+        ws.append([f'Student {i}', rng.choice([6, 7, 8, 'KG']), rng.choice(['M', 'F']), rng.choice(SERVANTS[:2])])
+    wb.save(path)
+
+
+def edit_round(rng, sundays, tmp_dir):
+    with db.db_connection() as conn:
+        ids = [row[0] for row in conn.execute('SELECT id FROM students')]
+    for _ in range(40):
+        db.save_attendance(rng.choice(ids), rng.choice(sundays), rng.choice(STATUSES))
+    for _ in range(5):
+        batch = [{'student_id': rng.choice(ids), 'status': rng.choice(STATUSES)} for _ in range(30)]
+        db.save_attendance_batch(rng.choice(sundays + [date.today().isoformat()]), batch)
+    for _ in range(10):
+        field = rng.choice(['grade', 'gender', 'servant', 'phone'])
+        value = {'grade': GRADES, 'gender': GENDERS, 'servant': SERVANTS, 'phone': ['123']}[field]
+        db.update_student(rng.choice(ids), **{field: rng.choice(value)})
+    for _ in range(3):
+        db.delete_student(rng.choice(ids))
+    workbook = os.path.join(tmp_dir, 'students.xlsx')
+    students_workbook(workbook, rng, rng.sample(ids, 20))
+    db.import_students_excel(workbook)
+
+
+def history_workbook(path, rng, ids, days):
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('History Attendance')
+    ws.append(['Name'] + [datetime.combine(day, datetime.min.time()) for day in days])
+    for i in ids:
+        ws.append([f'Student {i}'] + [rng.choice(['P', 'P', 'A', None]) for _ in days])
+    wb.save(path)
+
+
+def interrupted_import(rng, sundays, tmp_dir):
+    """Import history that stops after its batches commit (a worker crash), then run it again."""
+    with db.db_connection() as conn:
+        ids = [row[0] for row in conn.execute('SELECT id FROM students')]
+    workbook = os.path.join(tmp_dir, 'history.xlsx')
+    days = sorted(date.fromisoformat(day) - timedelta(days=1) for day in rng.sample(sundays, 8))
+    history_workbook(workbook, rng, rng.sample(ids, 40), days)
+
+    rebuild = db.rebuild_attendance_rollup
+    def crash(dates=None):
+        raise RuntimeError('worker stopped')
+    db.rebuild_attendance_rollup = crash
+    try:
+        db.import_attendance_history(workbook, create_missing=False)
+    except RuntimeError:
+        pass
+    finally:
+        db.rebuild_attendance_rollup = rebuild
+    db.import_attendance_history(workbook, create_missing=False)
+
+
+def compare(label, expected, actual):
+    if expected == actual:
+        return False
+    print(f"FAIL {label}")
+    if isinstance(expected, list):
+        for want, got in zip(expected, actual):
+            if want != got:
+                print(f"       expected {want}\n       got      {got}")
+                break
+        if len(expected) != len(actual):
+            print(f"       {len(expected)} rows expected, {len(actual)} returned")
+    else:
+        print(f"       expected {expected}, got {actual}")
+    return True
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    fn(*args)
+    return (time.perf_counter() - started) * 1000
+
+
+if __name__ == '__main__':
+    tmp_dir = tempfile.mkdtemp(prefix='check_rollup_')
+    db.DB_FILE = os.path.join(tmp_dir, 'attendance.db')
+    db.init_db()
+    rng = random.Random(SEED)
+    sundays = seed(rng)
+    middle = sundays[len(sundays) // 2]
+    cases = [(servant, year, grades, sections, date_from, date_to)
+             for servant in [None, 'Mina', 'Middle School']
+             for grades, sections in [(None, None), ('7,KG', None), (None, 'Boy'), ('6', 'Girl,Boy')]
+             for year, date_from, date_to in [(None, None, None), (middle[:4], None, None), (None, middle, None),
+                                              (None, sundays[-30], sundays[-5])]]
+    failed = False
+    for n in range(5):
+        if n == 4:
+            interrupted_import(rng, sundays, tmp_dir)
+        elif n:
+            edit_round(rng, sundays, tmp_dir)
+        live = rollup_snapshot()
+        db.rebuild_attendance_rollup()
+        failed |= compare(f'round {n}: incremental rollup vs rebuild', rollup_snapshot(), live)
+        for case in cases:
+            failed |= compare(f'round {n}: chart {case}', reference_stats(*case), db.get_class_attendance_stats(*case))
+        failed |= compare(f'round {n}: dashboard rate', reference_rate(), db.get_analytics()['attendance_rate'])
+    print(f"{'FAIL' if failed else 'OK  '} rollup matches attendance after 3 rounds of edits and an "
+          f"interrupted import, {len(cases)} chart filters each")
+
+    print(f"\n{STUDENTS} students, {YEARS} years of weekly history")
+    print(f"{'range':<10} {'live join ms':>13} {'rollup ms':>10}")
+    for years in range(1, YEARS + 1):
+        date_from = sundays[-52 * years]
+        print(f"{years:>2} year{'s' if years > 1 else ' '}   "
+              f"{timed(reference_stats, None, None, None, None, date_from):>13.1f} "
+              f"{timed(db.get_class_attendance_stats, None, None, None, None, date_from):>10.1f}")
+
+    db.close_connection()
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    sys.exit(1 if failed else 0)
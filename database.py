@@ -1,9 +1,13 @@
 import sqlite3
 import pandas as pd
 import hashlib
-import secrets
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date as _date, datetime, timedelta
+from typing import Callable, List, Dict, Iterable, Optional, Tuple
 from werkzeug.security import check_password_hash, generate_password_hash
 
 DB_FILE = "attendance.db"
@@ -28,6 +32,135 @@ CLASS_GRADE_MAP = {
     'Middle School': [6, 7, 8],
 }
 
+# ==================== CONNECTIONS ====================
+
+STATEMENT_CACHE_SIZE = int(os.environ.get('DB_STATEMENT_CACHE_SIZE', 256))
+_local = threading.local()
+
+# PRAGMA settings applied to every connection. 'sqlite' keeps SQLite's
+# built-in behaviour and exists so the benchmark has a baseline.
+TUNING_PROFILES = {
+    'sqlite': {},
+    'balanced': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -16000,
+        'mmap_size': 64 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    },
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'busy_timeout': 10000,
+        'cache_size': -8000,
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+    },
+}
+TUNING_CHOICES = {
+    'journal_mode': ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'),
+    'synchronous': ('OFF', 'NORMAL', 'FULL', 'EXTRA'),
+    'temp_store': ('DEFAULT', 'FILE', 'MEMORY'),
+}
+
+
+def get_tuning_profile() -> Dict:
+    """Resolve DB_PROFILE plus per-setting DB_* overrides (e.g. DB_BUSY_TIMEOUT)."""
+    name = os.environ.get('DB_PROFILE', 'balanced').strip().lower()
+    if name not in TUNING_PROFILES:
+        raise ValueError(f'Unknown DB_PROFILE "{name}". Choose one of: {", ".join(TUNING_PROFILES)}')
+    settings = dict(TUNING_PROFILES[name])
+    for key in ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'mmap_size', 'temp_store'):
+        value = os.environ.get(f'DB_{key.upper()}')
+        if value not in (None, ''):
+            settings[key] = value
+    return {'name': name, 'settings': _validate_tuning(settings)}
+
+
+def _validate_tuning(settings: Dict) -> Dict:
+    """PRAGMA values cannot be bound as parameters, so only accept known shapes."""
+    clean = {}
+    for key, value in settings.items():
+        if key in TUNING_CHOICES:
+            text = str(value).strip().upper()
+            if text not in TUNING_CHOICES[key]:
+                raise ValueError(f'Invalid {key} "{value}"')
+            clean[key] = text
+        else:
+            clean[key] = int(value)
+    return clean
+
+
+def apply_tuning(conn: sqlite3.Connection, settings: Dict):
+    """Run the profile's PRAGMAs on a freshly opened connection."""
+    for key, value in settings.items():
+        conn.execute(f'PRAGMA {key} = {value}')
+
+
+def describe_tuning() -> Dict:
+    """Report the active profile and what SQLite actually applied, for startup logs."""
+    conn = get_connection()
+    effective = {key: conn.execute(f'PRAGMA {key}').fetchone()[0] for key in
+                 ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'mmap_size', 'temp_store')}
+    return {'profile': _local.profile['name'], 'requested': _local.profile['settings'], 'effective': effective}
+
+
+def get_connection() -> sqlite3.Connection:
+    """Return this thread's shared connection, reopening it after a fork or a DB_FILE change."""
+    key = (os.getpid(), DB_FILE)
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.key != key:
+        # A connection inherited across a gunicorn fork must not be reused.
+        conn = sqlite3.connect(DB_FILE, cached_statements=STATEMENT_CACHE_SIZE)
+        _local.profile = get_tuning_profile()
+        apply_tuning(conn, _local.profile['settings'])
+        conn.create_function('grade_class_name', 1, grade_to_class_name, deterministic=True)
+        conn.create_function('grade_key', 1, grade_report_key, deterministic=True)
+        _local.conn = conn
+        _local.key = key
+        _local.depth = 0
+    return conn
+
+
+@contextmanager
+def db_connection(row_factory=None):
+    """Hand out the thread's connection; the outermost block commits or rolls back."""
+    conn = get_connection()
+    previous_factory = conn.row_factory
+    conn.row_factory = row_factory
+    _local.depth += 1
+    try:
+        yield conn
+        if _local.depth == 1:
+            conn.commit()
+    except BaseException:
+        if _local.depth == 1:
+            conn.rollback()
+        raise
+    finally:
+        _local.depth -= 1
+        conn.row_factory = previous_factory
+
+
+def release_connection():
+    """Roll back anything a request left open so the next request starts clean."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.key != (os.getpid(), DB_FILE):
+        return
+    if conn.in_transaction:
+        conn.rollback()
+    _local.depth = 0
+
+
+def close_connection():
+    """Close this thread's connection (scripts and worker shutdown)."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.key[0] == os.getpid():
+        conn.close()
+    _local.conn = None
+
+
 def class_grade_values(class_name: str) -> List:
     """Return grade numbers commonly represented by a class name."""
     if not class_name or class_name == 'all':
@@ -146,12 +279,16 @@ def normalize_assigned_sections(sections) -> str:
     return ','.join(clean)
 
 
-def init_db():
-    """Initialize the database with required tables. Always ensures tables exist."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+# ==================== MIGRATIONS ====================
+
+def _add_column(cursor, table: str, column: str, definition: str):
+    """ALTER TABLE ADD COLUMN unless the column is already there (pre-migration databases)."""
+    cursor.execute(f'PRAGMA table_info({table})')
+    if column not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
 
-    # Students table
+
+def _migration_base_tables(cursor):
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS students (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -168,8 +305,6 @@ def init_db():
             last_call TEXT
         )
     ''')
-
-    # Attendance table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS attendance (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -180,8 +315,6 @@ def init_db():
             FOREIGN KEY (student_id) REFERENCES students(id)
         )
     ''')
-
-    # Servants table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS servants (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -189,8 +322,6 @@ def init_db():
             phone TEXT
         )
     ''')
-
-    # Notes table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS notes (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -201,65 +332,16 @@ def init_db():
             FOREIGN KEY (student_id) REFERENCES students(id)
         )
     ''')
-
-    # Users table for authentication
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             username TEXT NOT NULL UNIQUE,
             password TEXT NOT NULL,
-            role TEXT NOT NULL DEFAULT \'user\',
-            class_name TEXT DEFAULT \'all\',
-            created_at TEXT NOT NULL DEFAULT (datetime(\'now\'))
+            role TEXT NOT NULL DEFAULT 'user',
+            class_name TEXT DEFAULT 'all',
+            created_at TEXT NOT NULL DEFAULT (datetime('now'))
         )
     ''')
-
-    # Add created_at column to users table if it doesn't exist (migration)
-    try:
-        cursor.execute("ALTER TABLE users ADD COLUMN created_at TEXT NOT NULL DEFAULT (datetime('now'))")
-    except:
-        pass  # Column already exists
-
-    try:
-        cursor.execute("ALTER TABLE users ADD COLUMN class_name TEXT DEFAULT 'all'")
-    except:
-        pass  # Column already exists
-
-    try:
-        cursor.execute("ALTER TABLE users ADD COLUMN assigned_grades TEXT DEFAULT ''")
-    except:
-        pass  # Column already exists
-
-    try:
-        cursor.execute("ALTER TABLE users ADD COLUMN assigned_sections TEXT DEFAULT ''")
-    except:
-        pass  # Column already exists
-
-    # Migrate students table
-    try:
-        cursor.execute("ALTER TABLE students ADD COLUMN points INTEGER DEFAULT 0")
-        cursor.execute("ALTER TABLE students ADD COLUMN class_name TEXT")
-    except:
-        pass
-        
-    # Migrate servants table
-    try:
-        cursor.execute("ALTER TABLE servants ADD COLUMN class_name TEXT")
-    except:
-        pass
-
-    # Migrate attendance table
-    try:
-        cursor.execute("ALTER TABLE attendance ADD COLUMN liturgy INTEGER DEFAULT 0")
-        cursor.execute("ALTER TABLE attendance ADD COLUMN tonia INTEGER DEFAULT 0")
-        cursor.execute("ALTER TABLE attendance ADD COLUMN confession INTEGER DEFAULT 0")
-        cursor.execute("ALTER TABLE attendance ADD COLUMN bible_prayer INTEGER DEFAULT 0")
-        cursor.execute("ALTER TABLE attendance ADD COLUMN questions INTEGER DEFAULT 0")
-        cursor.execute("ALTER TABLE attendance ADD COLUMN points_earned INTEGER DEFAULT 0")
-    except:
-        pass
-
-    # Points History table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS points_history (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -270,8 +352,6 @@ def init_db():
             FOREIGN KEY (student_id) REFERENCES students(id)
         )
     ''')
-
-    # Announcements table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS announcements (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -282,8 +362,6 @@ def init_db():
             created_by TEXT
         )
     ''')
-
-    # Bible tracking table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS bible_tracking (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -293,8 +371,53 @@ def init_db():
             FOREIGN KEY (student_id) REFERENCES students(id)
         )
     ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS servant_reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            servant_username TEXT NOT NULL,
+            report_type TEXT NOT NULL DEFAULT 'attendance',
+            date TEXT NOT NULL,
+            total_count INTEGER DEFAULT 0,
+            present_count INTEGER DEFAULT 0,
+            absent_count INTEGER DEFAULT 0,
+            notes TEXT DEFAULT '',
+            submitted_at TEXT NOT NULL,
+            is_read INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS eftikad (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            servant_username TEXT NOT NULL,
+            student_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            whatsapp_sent INTEGER DEFAULT 0,
+            called INTEGER DEFAULT 0,
+            visited INTEGER DEFAULT 0,
+            notes TEXT DEFAULT '',
+            created_at TEXT NOT NULL
+        )
+    ''')
+
+
+def _migration_user_assignments(cursor):
+    # SQLite refuses ADD COLUMN with a datetime('now') default, so backfill instead.
+    _add_column(cursor, 'users', 'created_at', 'TEXT')
+    cursor.execute("UPDATE users SET created_at = datetime('now') WHERE created_at IS NULL")
+    _add_column(cursor, 'users', 'class_name', "TEXT DEFAULT 'all'")
+    _add_column(cursor, 'users', 'assigned_grades', "TEXT DEFAULT ''")
+    _add_column(cursor, 'users', 'assigned_sections', "TEXT DEFAULT ''")
+
+
+def _migration_points_columns(cursor):
+    _add_column(cursor, 'students', 'points', 'INTEGER DEFAULT 0')
+    _add_column(cursor, 'students', 'class_name', 'TEXT')
+    _add_column(cursor, 'servants', 'class_name', 'TEXT')
+    for column in ('liturgy', 'tonia', 'confession', 'bible_prayer', 'questions', 'points_earned'):
+        _add_column(cursor, 'attendance', column, 'INTEGER DEFAULT 0')
 
-    # Seed default admin if no users exist
+
+def _migration_seed_users(cursor):
     cursor.execute("SELECT COUNT(*) FROM users")
     if cursor.fetchone()[0] == 0:
         cursor.execute(
@@ -306,73 +429,636 @@ def init_db():
             ('user', hash_password('user123'), 'user')
         )
 
-    cursor.execute(
-        "UPDATE users SET role = 'admin', class_name = 'all', assigned_grades = '', assigned_sections = '' WHERE username = 'STJOHN'"
-    )
-    if cursor.rowcount == 0:
-        cursor.execute(
-            "INSERT INTO users (username, password, role, class_name, assigned_grades, assigned_sections) VALUES (?, ?, ?, ?, ?, ?)",
-            ('STJOHN', hash_password('Pray#1'), 'admin', 'all', '', '')
-        )
 
-    conn.commit()
-    conn.close()
+def _migration_student_streaks(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS student_streaks (
+            student_id INTEGER PRIMARY KEY,
+            absence_streak INTEGER NOT NULL DEFAULT 0,
+            presence_streak INTEGER NOT NULL DEFAULT 0,
+            liturgy_streak INTEGER NOT NULL DEFAULT 0,
+            last_seen_date TEXT,
+            last_date TEXT NOT NULL,
+            FOREIGN KEY (student_id) REFERENCES students(id)
+        )
+    ''')
+    rebuild_student_streaks()
+
+
+def _migration_points_rule_codes(cursor):
+    _add_column(cursor, 'points_history', 'rule_code', 'TEXT')
+    _add_column(cursor, 'points_history', 'period_key', 'TEXT')
+    # Split engine-written history rows into one row per rule. A repeat of an award already
+    # seen (from a re-saved record) keeps its points but no rule code, so totals still add up.
+    cursor.execute('''SELECT id, student_id, points_change, reason, date FROM points_history
+                      WHERE rule_code IS NULL ORDER BY date, id''')
+    seen = set()
+    for row_id, student_id, points_change, reason, date in cursor.fetchall():
+        parts = parse_award_reason(reason, date)
+        if not parts or sum(points for _, points, _ in parts) != points_change:
+            continue
+        cursor.execute('DELETE FROM points_history WHERE id = ?', (row_id,))
+        for code, points, period_key in parts:
+            key = (student_id, code, period_key)
+            cursor.execute(
+                'INSERT INTO points_history (student_id, points_change, reason, date, rule_code, period_key) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (student_id, points, f'+{points} {AWARD_LABELS[code]}', date,
+                 *((code, period_key) if key not in seen else (None, None)))
+            )
+            seen.add(key)
+    # A constraint rather than a tuning index, so it lives here and not in MANAGED_INDEXES.
+    cursor.execute('''CREATE UNIQUE INDEX IF NOT EXISTS uq_points_history_rule
+                      ON points_history(student_id, rule_code, period_key)''')
+
+
+def _migration_data_versions(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
 
-# ==================== SERVANT REPORTS ====================
 
-def submit_servant_report(servant_username: str, report_type: str, date: str,
-                           total: int, present: int, absent: int, notes: str = '') -> int:
-    """Log a servant attendance or eftikad submission."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    # Ensure table exists
+def _migration_jobs(cursor):
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS servant_reports (
+        CREATE TABLE IF NOT EXISTS jobs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            servant_username TEXT NOT NULL,
-            report_type TEXT NOT NULL DEFAULT 'attendance',
+            kind TEXT NOT NULL,
+            params TEXT NOT NULL DEFAULT '{}',
+            status TEXT NOT NULL DEFAULT 'queued',
+            progress_done INTEGER NOT NULL DEFAULT 0,
+            progress_total INTEGER,
+            message TEXT,
+            result TEXT,
+            result_path TEXT,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            worker TEXT,
+            created_by TEXT,
+            created_at TEXT NOT NULL,
+            started_at TEXT,
+            finished_at TEXT
+        )
+    ''')
+
+
+def _migration_attendance_rollup(cursor):
+    # Column types match students so grade/gender filters compare exactly as on the live join.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attendance_daily (
             date TEXT NOT NULL,
-            total_count INTEGER DEFAULT 0,
-            present_count INTEGER DEFAULT 0,
-            absent_count INTEGER DEFAULT 0,
-            notes TEXT DEFAULT '',
-            submitted_at TEXT NOT NULL,
-            is_read INTEGER NOT NULL DEFAULT 0
+            bucket TEXT NOT NULL,
+            grade INTEGER,
+            gender TEXT,
+            servant TEXT,
+            class_name TEXT,
+            present INTEGER NOT NULL DEFAULT 0,
+            absent INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (date, bucket)
         )
     ''')
-    submitted_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    rebuild_attendance_rollup()
+
+
+def _migration_birthdays(cursor):
+    _add_column(cursor, 'students', 'birth_month_day', 'TEXT')
+    # Values that do not parse are left as entered; get_unparsed_dobs() lists them.
+    cursor.execute("SELECT id, dob FROM students WHERE dob IS NOT NULL AND dob != ''")
+    updates = []
+    for student_id, dob in cursor.fetchall():
+        iso, month_day = normalize_dob(dob)
+        if month_day:
+            updates.append((iso, month_day, student_id))
+    cursor.executemany('UPDATE students SET dob = ?, birth_month_day = ? WHERE id = ?', updates)
+
+
+def _migration_sessions(cursor):
     cursor.execute('''
-        INSERT INTO servant_reports
-            (servant_username, report_type, date, total_count, present_count, absent_count, notes, submitted_at, is_read)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)
-    ''', (servant_username, report_type, date, total, present, absent, notes, submitted_at))
-    report_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return report_id
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            username TEXT,
+            data TEXT NOT NULL,
+            expires_at TEXT NOT NULL
+        )
+    ''')
 
 
-def get_servant_reports(date_filter: str = None, type_filter: str = None,
-                        date_from: str = None, date_to: str = None) -> List[Dict]:
-    """Get all servant reports, optionally filtered by exact date, date range, or type."""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    # Ensure table exists
+def _migration_data_version_stamps(cursor):
+    _add_column(cursor, 'data_versions', 'updated_at', 'TEXT')
+
+
+def _migration_student_changes(cursor):
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS servant_reports (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            servant_username TEXT NOT NULL,
-            report_type TEXT NOT NULL DEFAULT 'attendance',
-            date TEXT NOT NULL,
-            total_count INTEGER DEFAULT 0,
-            present_count INTEGER DEFAULT 0,
-            absent_count INTEGER DEFAULT 0,
-            notes TEXT DEFAULT '',
-            submitted_at TEXT NOT NULL,
-            is_read INTEGER NOT NULL DEFAULT 0
+        CREATE TABLE IF NOT EXISTS student_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER NOT NULL,
+            changed_at TEXT NOT NULL DEFAULT (datetime('now'))
         )
     ''')
+    # Triggers rather than calls in each writer: points awards, streak rebuilds and
+    # imports all change what /api/students returns for a student.
+    for name, event, row in [('students_insert', 'INSERT ON students', 'NEW.id'),
+                             ('students_update', 'UPDATE ON students', 'NEW.id'),
+                             ('students_delete', 'DELETE ON students', 'OLD.id'),
+                             ('streaks_insert', 'INSERT ON student_streaks', 'NEW.student_id'),
+                             ('streaks_update', 'UPDATE OF absence_streak ON student_streaks '
+                                                'WHEN OLD.absence_streak IS NOT NEW.absence_streak', 'NEW.student_id'),
+                             ('streaks_delete', 'DELETE ON student_streaks', 'OLD.student_id')]:
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS journal_{name} AFTER {event}
+            BEGIN
+                INSERT INTO student_changes (student_id) VALUES ({row});
+            END
+        ''')
+
+
+# Ordered, numbered schema changes. Each runs exactly once, in its own
+# transaction, and is recorded in schema_version. Append new entries only;
+# never renumber or edit a migration that has shipped.
+MIGRATIONS = [
+    (1, 'base tables', _migration_base_tables),
+    (2, 'user assignment columns', _migration_user_assignments),
+    (3, 'points and class columns', _migration_points_columns),
+    (4, 'seed default users', _migration_seed_users),
+    (5, 'student streaks', _migration_student_streaks),
+    (6, 'points history rule codes', _migration_points_rule_codes),
+    (7, 'data versions', _migration_data_versions),
+    (8, 'background jobs', _migration_jobs),
+    (9, 'daily attendance rollup', _migration_attendance_rollup),
+    (10, 'student birthday keys', _migration_birthdays),
+    (11, 'server-side sessions', _migration_sessions),
+    (12, 'data version timestamps', _migration_data_version_stamps),
+    (13, 'student change journal', _migration_student_changes),
+]
+
+
+def get_schema_version() -> int:
+    """Highest migration applied to the database (0 for a new or legacy database)."""
+    with db_connection() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TEXT NOT NULL
+            )
+        ''')
+        return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+
+def run_migrations() -> List[int]:
+    """Apply pending migrations in order. Returns the versions applied by this call."""
+    applied = []
+    if get_schema_version() >= MIGRATIONS[-1][0]:
+        return applied
+    with db_connection() as conn:
+        for version, name, migrate in MIGRATIONS:
+            if conn.in_transaction:
+                conn.commit()
+            # IMMEDIATE takes the write lock up front, so gunicorn workers booting
+            # together apply each migration once; re-check after acquiring it.
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                done = conn.execute('SELECT 1 FROM schema_version WHERE version = ?', (version,)).fetchone()
+                if not done:
+                    migrate(conn.cursor())
+                    conn.execute(
+                        'INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)',
+                        (version, name, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+                    )
+                    applied.append(version)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    return applied
+
+
+def init_db() -> List[int]:
+    """Migrate the schema, reconcile indexes and make sure the STJOHN admin exists.
+
+    Returns the migration versions applied during this call.
+    """
+    applied = run_migrations()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        ensure_indexes(cursor)
+
+        cursor.execute(
+            "UPDATE users SET role = 'admin', class_name = 'all', assigned_grades = '', assigned_sections = '' WHERE username = 'STJOHN'"
+        )
+        if cursor.rowcount == 0:
+            cursor.execute(
+                "INSERT INTO users (username, password, role, class_name, assigned_grades, assigned_sections) VALUES (?, ?, ?, ?, ?, ?)",
+                ('STJOHN', hash_password('Pray#1'), 'admin', 'all', '', '')
+            )
+    return applied
+
+
+# ==================== INDEXES ====================
+
+# Indexes owned by the schema layer. init_db() creates missing ones, rebuilds
+# any whose definition changed and drops other idx_* indexes, so this dict is
+# the single source of truth for secondary indexes.
+MANAGED_INDEXES = {
+    'idx_attendance_date': 'attendance(date, status)',
+    'idx_points_history_student_date': 'points_history(student_id, date, reason, points_change)',
+    'idx_bible_tracking_student_week': 'bible_tracking(student_id, week_start_date, days_read)',
+    'idx_eftikad_date': 'eftikad(date)',
+    'idx_eftikad_servant_date': 'eftikad(servant_username, date)',
+    'idx_servant_reports_date': 'servant_reports(date, submitted_at)',
+    'idx_servant_reports_submitted': 'servant_reports(submitted_at)',
+    'idx_servant_reports_unread': 'servant_reports(is_read) WHERE is_read = 0',
+    'idx_notes_student_created': 'notes(student_id, created_at)',
+    'idx_students_servant_grade': 'students(servant, grade)',
+    'idx_students_class_name': 'students(class_name)',
+    'idx_students_grade': 'students(grade)',
+    'idx_students_birth_month_day': 'students(birth_month_day)',
+    'idx_jobs_status': 'jobs(status, id)',
+    'idx_jobs_created_by': 'jobs(created_by, id)',
+    'idx_sessions_username': 'sessions(username)',
+    'idx_sessions_expires': 'sessions(expires_at)',
+}
+
+# Hot queries from this module with the index each one must use. Each entry builds its
+# SQL with the same builder or constant the real function runs, when it is checked, so
+# user scopes expand to the IN lists of the current students table.
+# Checked by explain_hot_queries() / check_indexes.py.
+SAMPLE_GRADES_USER = {'role': 'servant', 'assigned_grades': '6,7', 'assigned_sections': 'Boy'}
+SAMPLE_CLASS_USER = {'role': 'sub_admin', 'class_name': 'Middle School'}
+
+HOT_QUERIES = [
+    ('award lookup (evaluate_points)',
+     lambda: (AWARD_LOOKUP, ('[1, 2]', '[1, 2]', '2025-01', '2025-01', '2025-01', '2025-01-06')),
+     ('uq_points_history_rule',)),
+    ('points history (get_student_points)',
+     lambda: (STUDENT_POINTS_HISTORY, (1,)), ('idx_points_history_student_date',)),
+    ('streak lookup (evaluate_points)',
+     lambda: (RECENT_STREAK_DATES, ('[1, 2]', '2025-01-05', '[1, 2]', '2025-01-05')),
+     ('sqlite_autoindex_attendance_1',)),
+    ('recent attendance rate (get_analytics)',
+     lambda: (RECENT_ATTENDANCE_RATE, ('2025-01-01',)), ('sqlite_autoindex_attendance_daily_1',)),
+    ('bible week (evaluate_points)',
+     lambda: (BIBLE_WEEK_DAYS, ('2025-01-06', '[1, 2]')), ('idx_bible_tracking_student_week',)),
+    ('eftikad by servant (get_eftikad)',
+     lambda: _eftikad_query('servant', '2025-01-01'), ('idx_eftikad_servant_date',)),
+    ('eftikad by date (get_grade_report_summary)',
+     lambda: _grade_summary_query('2025-01-01', '2025-12-31'), ('idx_eftikad_date',)),
+    ('reports by date (get_servant_reports)',
+     lambda: _servant_reports_query('2025-01-05'), ('idx_servant_reports_date',)),
+    ('reports newest first (get_servant_reports)',
+     lambda: _servant_reports_query(), ('idx_servant_reports_submitted',)),
+    ('unread reports (get_unread_report_count)',
+     lambda: (UNREAD_REPORT_COUNT, ()), ('idx_servant_reports_unread',)),
+    ('notes (get_notes)',
+     lambda: (STUDENT_NOTES, (1,)), ('idx_notes_student_created',)),
+    ('servant filters (get_filters)',
+     lambda: (SERVANT_GRADES, ('servant',)), ('idx_students_servant_grade',)),
+    ('class roster (get_students)',
+     lambda: _students_query('Middle School'),
+     ('idx_students_servant_grade', 'idx_students_class_name', 'idx_students_grade')),
+    ('assigned grades roster (get_students)',
+     lambda: _students_query(scope=StudentScope(SAMPLE_GRADES_USER)), ('idx_students_grade',)),
+    ('sub_admin roster (get_students)',
+     lambda: _students_query(scope=StudentScope(SAMPLE_CLASS_USER)),
+     ('idx_students_class_name', 'idx_students_grade')),
+    ('class leaderboard (get_points_leaderboard)',
+     lambda: _leaderboard_queries('Middle School', limit=50)[:2],
+     ('idx_students_servant_grade', 'idx_students_class_name', 'idx_students_grade')),
+    ('birthday window (get_upcoming_birthdays)',
+     lambda: _birthdays_query(30, datetime(2025, 3, 1).date()), ('idx_students_birth_month_day',)),
+]
+
+
+def ensure_indexes(cursor):
+    """Bring the database's idx_* indexes in line with MANAGED_INDEXES."""
+    cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx\\_%' ESCAPE '\\'")
+    existing = dict(cursor.fetchall())
+    for name, sql in existing.items():
+        if sql != f'CREATE INDEX {name} ON {MANAGED_INDEXES.get(name)}':
+            cursor.execute(f'DROP INDEX {name}')
+            existing[name] = None
+    for name, definition in MANAGED_INDEXES.items():
+        if not existing.get(name):
+            cursor.execute(f'CREATE INDEX {name} ON {definition}')
+
+
+def explain_hot_queries() -> List[Dict]:
+    """Run EXPLAIN QUERY PLAN on HOT_QUERIES and report whether each uses its index."""
+    results = []
+    with db_connection() as conn:
+        for name, build, expected in HOT_QUERIES:
+            sql, params = build()
+            plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()]
+            used = {detail.split(' INDEX ', 1)[1].split(' ')[0] for detail in plan if ' INDEX ' in detail}
+            missing = [index for index in expected if index not in used]
+            results.append({'name': name, 'ok': not missing, 'missing': missing, 'plan': plan})
+    return results
+
+
+# ==================== DATA VERSIONS ====================
+
+# Counters bumped in the same transaction as the writes they describe, so any
+# worker can tell whether a cached result is stale with one primary-key lookup.
+
+def bump_data_version(conn, *names: str):
+    """Advance the version of each named dataset inside the caller's transaction."""
+    conn.executemany('''INSERT INTO data_versions (name, version, updated_at) VALUES (?, 1, datetime('now'))
+                        ON CONFLICT(name) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at''',
+                     [(name,) for name in names])
+
+
+def get_data_versions(*names: str) -> Tuple[int, ...]:
+    """Current version of each named dataset (0 if never written)."""
+    with db_connection() as conn:
+        found = dict(conn.execute('SELECT name, version FROM data_versions WHERE name IN (SELECT value FROM json_each(?))',
+                                  (json.dumps(names),)))
+    return tuple(found.get(name, 0) for name in names)
+
+
+def get_data_version_stamp(*names: str) -> Tuple[Tuple[int, ...], Optional[datetime]]:
+    """(versions, last change) of the named datasets; the time is UTC, None if never stamped."""
+    with db_connection() as conn:
+        rows = conn.execute('SELECT name, version, updated_at FROM data_versions '
+                            'WHERE name IN (SELECT value FROM json_each(?))', (json.dumps(names),)).fetchall()
+    found = {name: version for name, version, _ in rows}
+    stamps = [updated_at for _, _, updated_at in rows if updated_at]
+    modified = datetime.strptime(max(stamps), '%Y-%m-%d %H:%M:%S') if stamps else None
+    return tuple(found.get(name, 0) for name in names), modified
+
+
+# ==================== VISIBILITY ====================
+
+def grade_match_key(grade) -> str:
+    """Grade as compared by visibility rules: normalized, lower-case text ('' if unknown)."""
+    value = normalize_grade_value(grade)
+    return str(value).strip().lower() if value is not None else ''
+
+
+def gender_match_key(gender) -> str:
+    """Gender as compared by visibility rules: 'boy', 'girl' or the lower-cased text."""
+    return normalize_gender_value(gender).strip().lower()
+
+
+def student_class_key(student: Dict) -> str:
+    """A student's class as compared by visibility rules: class name, else the class of their grade."""
+    return (student.get('class_name') or grade_to_class_name(student.get('grade')) or '').strip().lower()
+
+
+_student_values_cache = {}
+_student_values_lock = threading.Lock()
+
+
+def _distinct_student_values(column: str) -> List:
+    """Distinct raw values of a students column, cached until the students data version changes."""
+    key = (DB_FILE, column)
+    version = get_data_versions('students')
+    with _student_values_lock:
+        cached = _student_values_cache.get(key)
+    if cached and cached[0] == version:
+        return cached[1]
+    with db_connection() as conn:
+        values = [row[0] for row in conn.execute(f'SELECT DISTINCT {column} FROM students')]
+    with _student_values_lock:
+        _student_values_cache[key] = (version, values)
+    return values
+
+
+class StudentScope:
+    """The students one user may see, compiled once from their role and assignments.
+
+    allows(student) applies the rule to a student dict in memory; sql(alias) gives the
+    same rule as a WHERE predicate over students columns, so list queries can filter
+    inside SQLite. Rules:
+
+    - admin, and sub_admin of class 'all': everyone
+    - sub_admin: students of their class (by class name or the class's grades)
+    - rewards: their assigned grades if any, limited to their assigned sections
+    - other roles: their assigned grades, else their class; limited to their sections
+    """
+
+    def __init__(self, user: Optional[Dict]):
+        user = user or {}
+        role = user.get('role')
+        user_class = (user.get('class_name') or 'all').strip()
+        grades = {grade_match_key(g) for g in normalize_assigned_grades(user.get('assigned_grades', '')).split(',')}
+        sections = {gender_match_key(s) for s in normalize_assigned_sections(user.get('assigned_sections', '')).split(',')}
+        grades.discard('')
+        sections.discard('')
+
+        self.sees_all = False
+        self.sees_none = False
+        self.grades = None          # allowed grade keys, None for any
+        self.class_name = None      # allowed class key, None for any
+        self.class_grades = set()   # grade keys that also count as that class
+        self.sections = set()       # allowed gender keys, empty for both
+        if not user:
+            self.sees_none = True
+        elif role == 'admin' or (role == 'sub_admin' and user_class == 'all'):
+            self.sees_all = True
+        elif role == 'sub_admin':
+            self._set_class(user_class)
+        elif role == 'rewards':
+            self.grades = grades or None
+            self.sections = sections
+            self.sees_all = not grades and not sections
+        elif grades:
+            self.grades = grades
+            self.sections = sections
+        elif user_class and user_class != 'all':
+            self._set_class(user_class)
+            self.sections = sections
+        else:
+            self.sees_none = True
+        self.key = (self.sees_all, self.sees_none, frozenset(self.grades) if self.grades is not None else None,
+                    self.class_name, frozenset(self.class_grades), frozenset(self.sections))
+
+    def _set_class(self, class_name: str):
+        self.class_name = class_name.lower()
+        self.class_grades = {grade_match_key(g) for g in class_grade_values(class_name)}
+
+    def allows(self, student: Dict) -> bool:
+        """True when the user may see this student (any dict with grade, gender and class_name)."""
+        if self.sees_all or self.sees_none:
+            return self.sees_all
+        grade = grade_match_key(student.get('grade'))
+        if self.grades is not None and grade not in self.grades:
+            return False
+        if (self.class_name is not None and grade not in self.class_grades
+                and student_class_key(student) != self.class_name):
+            return False
+        return not self.sections or gender_match_key(student.get('gender')) in self.sections
+
+    def sql(self, alias: str = '') -> Tuple[str, list]:
+        """WHERE predicate + params over students columns (prefixed with alias if given).
+
+        Allowed grades, sections and classes are expanded to the raw values stored in
+        the table, so the predicate is plain IN lists that can use the students indexes.
+        """
+        if self.sees_all or self.sees_none:
+            return ('1=1' if self.sees_all else '0=1'), []
+        column = f'{alias}.' if alias else ''
+        clauses, params = [], []
+
+        def raw_in(name, keep):
+            values = _distinct_student_values(name)
+            matched = [value for value in values if value is not None and keep(value)]
+            predicate = f"{column}{name} IN ({','.join('?' for _ in matched)})" if matched else '0=1'
+            if None in values and keep(None):
+                predicate = f'({predicate} OR {column}{name} IS NULL)'
+            params.extend(matched)
+            return predicate
+
+        if self.grades is not None:
+            clauses.append(raw_in('grade', lambda g: grade_match_key(g) in self.grades))
+        if self.class_name is not None:
+            named = raw_in('class_name', lambda c: bool(c) and str(c).strip().lower() == self.class_name)
+            derived = raw_in('grade', lambda g: (grade_to_class_name(g) or '').strip().lower() == self.class_name)
+            by_grade = raw_in('grade', lambda g: grade_match_key(g) in self.class_grades)
+            if derived != '0=1':
+                derived = f"(COALESCE({column}class_name, '') = '' AND {derived})"
+            # A term that never matches keeps SQLite from using the indexes for the whole OR.
+            terms = [term for term in (named, derived, by_grade) if term != '0=1']
+            clauses.append(f"({' OR '.join(terms)})" if terms else '0=1')
+        if self.sections:
+            clauses.append(raw_in('gender', lambda g: gender_match_key(g) in self.sections))
+        return ' AND '.join(clauses), params
+
+
+def _visibility(scope: Optional[StudentScope], alias: str = '') -> Tuple[str, list]:
+    """scope.sql(alias), or a predicate matching every student when there is no scope."""
+    return scope.sql(alias) if scope is not None else ('1=1', [])
+
+
+# ==================== JOBS ====================
+
+# Background work (imports, exports, report workbooks) queued by jobs.py. Rows
+# outlive the process, so anything queued or interrupted is picked up on restart.
+
+def _job_dict(row) -> Dict:
+    job = dict(row)
+    job['params'] = json.loads(job['params'] or '{}')
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+
+def create_job(kind: str, params: Dict, created_by: str = None) -> int:
+    """Queue a job and return its id."""
+    with db_connection() as conn:
+        cursor = conn.execute(
+            'INSERT INTO jobs (kind, params, created_by, created_at) VALUES (?, ?, ?, ?)',
+            (kind, json.dumps(params), created_by, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        )
+        return cursor.lastrowid
+
+
+def set_job_params(job_id: int, params: Dict):
+    """Replace a queued job's parameters (used to add the paths of uploaded inputs)."""
+    with db_connection() as conn:
+        conn.execute('UPDATE jobs SET params = ? WHERE id = ?', (json.dumps(params), job_id))
+
+
+def claim_job(job_id: int, worker: str) -> Optional[Dict]:
+    """Move a queued job to running under `worker`. Returns None if another worker got it first."""
+    with db_connection(sqlite3.Row) as conn:
+        row = conn.execute('''
+            UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, started_at = ?,
+                            progress_done = 0, progress_total = NULL, message = NULL
+            WHERE id = ? AND status = 'queued'
+            RETURNING *
+        ''', (worker, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), job_id)).fetchone()
+    return _job_dict(row) if row else None
+
+
+def update_job_progress(job_id: int, done: int, total: Optional[int] = None, message: Optional[str] = None):
+    """Record how far a running job has got."""
+    with db_connection() as conn:
+        conn.execute('UPDATE jobs SET progress_done = ?, progress_total = ?, message = COALESCE(?, message) WHERE id = ?',
+                     (done, total, message, job_id))
+
+
+def finish_job(job_id: int, result: Dict, result_path: Optional[str] = None):
+    """Mark a job done with its JSON result and optional downloadable file."""
+    with db_connection() as conn:
+        conn.execute('''UPDATE jobs SET status = 'done', result = ?, result_path = ?, error = NULL, finished_at = ?,
+                               progress_done = COALESCE(progress_total, progress_done)
+                        WHERE id = ?''',
+                     (json.dumps(result, default=str), result_path, datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                      job_id))
+
+
+def fail_job(job_id: int, error: str):
+    """Mark a job failed."""
+    with db_connection() as conn:
+        conn.execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                     (error, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), job_id))
+
+
+def get_job(job_id: int) -> Optional[Dict]:
+    """Get one job."""
+    with db_connection(sqlite3.Row) as conn:
+        row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    return _job_dict(row) if row else None
+
+
+def list_jobs(created_by: Optional[str] = None, limit: int = 20) -> List[Dict]:
+    """Most recent jobs first, optionally only one user's."""
+    with db_connection(sqlite3.Row) as conn:
+        if created_by is None:
+            rows = conn.execute('SELECT * FROM jobs ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+        else:
+            rows = conn.execute('SELECT * FROM jobs WHERE created_by = ? ORDER BY id DESC LIMIT ?',
+                                (created_by, limit)).fetchall()
+    return [_job_dict(row) for row in rows]
+
+
+def requeue_interrupted_jobs(max_attempts: int, is_orphaned: Callable[[str], bool]) -> List[int]:
+    """Put running jobs whose worker is_orphaned() back in the queue; return every queued id, oldest first.
+
+    Orphaned jobs that have already been started max_attempts times are failed instead,
+    so a job that takes the process down with it cannot crash-loop the server.
+    """
+    with db_connection() as conn:
+        running = conn.execute("SELECT id, worker, attempts FROM jobs WHERE status = 'running'").fetchall()
+        orphaned = [(job_id, attempts) for job_id, worker, attempts in running if is_orphaned(worker or '')]
+        conn.executemany("UPDATE jobs SET status = 'failed', error = 'Interrupted too many times', finished_at = ? "
+                         "WHERE id = ?",
+                         [(datetime.now().strftime('%Y-%m-%d %H:%M:%S'), job_id)
+                          for job_id, attempts in orphaned if attempts >= max_attempts])
+        conn.executemany("UPDATE jobs SET status = 'queued', message = 'Restarted after interruption' WHERE id = ?",
+                         [(job_id,) for job_id, attempts in orphaned if attempts < max_attempts])
+        return [row[0] for row in conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY id")]
+
+
+def delete_finished_jobs(before: str) -> List[int]:
+    """Delete done or failed jobs that finished before the given timestamp; returns their ids."""
+    with db_connection() as conn:
+        return [row[0] for row in conn.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ? RETURNING id", (before,))]
+
+
+# ==================== SERVANT REPORTS ====================
+
+def submit_servant_report(servant_username: str, report_type: str, date: str,
+                           total: int, present: int, absent: int, notes: str = '') -> int:
+    """Log a servant attendance or eftikad submission."""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        submitted_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        cursor.execute('''
+            INSERT INTO servant_reports
+                (servant_username, report_type, date, total_count, present_count, absent_count, notes, submitted_at, is_read)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)
+        ''', (servant_username, report_type, date, total, present, absent, notes, submitted_at))
+        report_id = cursor.lastrowid
+        bump_data_version(conn, 'servant_reports')
+    return report_id
+
+
+def _servant_reports_query(date_filter: str = None, type_filter: str = None,
+                           date_from: str = None, date_to: str = None) -> Tuple[str, list]:
+    """SQL + params of get_servant_reports."""
     query = "SELECT * FROM servant_reports WHERE 1=1"
     params = []
     if date_filter:
@@ -388,10 +1074,17 @@ def get_servant_reports(date_filter: str = None, type_filter: str = None,
     if type_filter:
         query += " AND report_type = ?"
         params.append(type_filter)
-    query += " ORDER BY submitted_at DESC"
-    cursor.execute(query, params)
-    reports = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    return query + " ORDER BY submitted_at DESC", params
+
+
+def get_servant_reports(date_filter: str = None, type_filter: str = None,
+                        date_from: str = None, date_to: str = None) -> List[Dict]:
+    """Get all servant reports, optionally filtered by exact date, date range, or type."""
+    query, params = _servant_reports_query(date_filter, type_filter, date_from, date_to)
+    with db_connection(sqlite3.Row) as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        reports = [dict(row) for row in cursor.fetchall()]
     return reports
 
 
@@ -409,27 +1102,89 @@ def grade_sort_key(grade):
         return 99
 
 
-def get_grade_report_summary(date_from: str = None, date_to: str = None, grade_filter: str = None) -> List[Dict]:
-    """Summarize attendance, absence, rewards, and eftikad by grade."""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+def grade_report_key(grade) -> str:
+    """Grade summary bucket: the normalized grade as text, else the raw text or 'Unknown'."""
+    value = normalize_grade_value(grade)
+    if value is None:
+        value = str(grade or 'Unknown').strip() or 'Unknown'
+    return str(value)
+
 
+def _grade_summary_query(date_from: str = None, date_to: str = None,
+                         grade_filter: str = None) -> Tuple[str, list]:
+    """SQL + params of get_grade_report_summary: one row per (source, grade) with up to four counts."""
     selected_grade = normalize_grade_value(grade_filter) if grade_filter and grade_filter != 'all' else None
+    dates, date_params = [], []
+    if date_from:
+        dates.append('date >= ?')
+        date_params.append(date_from)
+    if date_to:
+        dates.append('date <= ?')
+        date_params.append(date_to)
+    date_where = f"WHERE {' AND '.join(dates)}" if dates else ''
+    keys = 'WITH sg AS MATERIALIZED (SELECT id, grade_key(grade) AS grade_key FROM students)'
+    bucket = "COALESCE(sg.grade_key, 'Unknown')"
+    grade_where, grade_params = ('', [])
+    if selected_grade is not None:
+        grade_where, grade_params = f'WHERE {bucket} = ?', [str(selected_grade)]
+
+    # One statement, so the grade keys are materialized once for all four sources.
+    query = f'''
+        {keys}
+        SELECT 'students', {bucket}, COUNT(*), NULL, NULL, NULL
+        FROM sg {grade_where}
+        GROUP BY 2
+        UNION ALL
+        SELECT 'attendance', {bucket}, SUM(t.records), SUM(t.present), SUM(t.present > 0),
+               SUM(t.records > t.present)
+        FROM (
+            SELECT student_id, COUNT(*) AS records, SUM(status = 'present') AS present
+            FROM attendance {date_where}
+            GROUP BY student_id
+        ) t LEFT JOIN sg ON sg.id = t.student_id
+        {grade_where}
+        GROUP BY 2
+        UNION ALL
+        -- Engine awards are stored one row per rule; count each scored record once.
+        SELECT 'rewards', {bucket}, SUM(t.events), SUM(t.points), COUNT(*), NULL
+        FROM (
+            SELECT student_id, COUNT(*) AS events, SUM(points_change) AS points
+            FROM (
+                SELECT student_id, SUM(points_change) AS points_change
+                FROM points_history
+                WHERE {' AND '.join(['points_change > 0'] + dates)}
+                GROUP BY student_id, date, CASE WHEN rule_code IS NULL THEN id END
+            )
+            GROUP BY student_id
+        ) t LEFT JOIN sg ON sg.id = t.student_id
+        {grade_where}
+        GROUP BY 2
+        UNION ALL
+        SELECT 'eftikad', {bucket}, SUM(t.visits), COUNT(t.student_id), NULL, NULL
+        FROM (
+            SELECT student_id, COUNT(*) AS visits
+            FROM eftikad {date_where}
+            GROUP BY student_id
+        ) t LEFT JOIN sg ON sg.id = t.student_id
+        {grade_where}
+        GROUP BY 2
+    '''
+    return query, grade_params + (date_params + grade_params) * 3
+
+
+def get_grade_report_summary(date_from: str = None, date_to: str = None, grade_filter: str = None) -> List[Dict]:
+    """Summarize attendance, absence, rewards, and eftikad by grade.
 
-    cursor.execute("SELECT id, grade FROM students")
-    student_rows = [dict(r) for r in cursor.fetchall()]
-    student_grade = {}
+    Each source is reduced to one row per student, then rolled up by that student's
+    grade_key() (computed once in a materialized CTE), so only one row per grade and
+    source leaves SQLite. Records whose student no longer exists count under 'Unknown'.
+    """
     summary = {}
 
-    def ensure(grade):
-        value = normalize_grade_value(grade)
-        if value is None:
-            value = str(grade or 'Unknown').strip() or 'Unknown'
-        if selected_grade is not None and value != selected_grade:
-            return None
-        key = str(value)
+    def ensure(key):
         if key not in summary:
+            value = normalize_grade_value(key)
+            value = key if value is None else value
             summary[key] = {
                 'grade': value,
                 'grade_label': grade_label_from_value(value),
@@ -444,177 +1199,131 @@ def get_grade_report_summary(date_from: str = None, date_to: str = None, grade_f
                 'reward_points': 0,
                 'eftikad_visits': 0,
                 'eftikad_students': 0,
-                '_present_student_ids': set(),
-                '_absent_student_ids': set(),
-                '_rewarded_student_ids': set(),
-                '_eftikad_student_ids': set(),
             }
         return summary[key]
 
-    for row in student_rows:
-        bucket = ensure(row.get('grade'))
-        if bucket is None:
-            continue
-        student_grade[row['id']] = bucket['grade']
-        bucket['total_students'] += 1
-
-    attendance_query = "SELECT student_id, status FROM attendance WHERE 1=1"
-    params = []
-    if date_from:
-        attendance_query += " AND date >= ?"
-        params.append(date_from)
-    if date_to:
-        attendance_query += " AND date <= ?"
-        params.append(date_to)
-    cursor.execute(attendance_query, params)
-    for row in cursor.fetchall():
-        bucket = ensure(student_grade.get(row['student_id']))
-        if bucket is None:
-            continue
-        bucket['attendance_records'] += 1
-        if row['status'] == 'present':
-            bucket['present_count'] += 1
-            bucket['_present_student_ids'].add(row['student_id'])
+    with db_connection() as conn:
+        rows = conn.execute(*_grade_summary_query(date_from, date_to, grade_filter)).fetchall()
+
+    for source, key, a, b, c, d in rows:
+        row = ensure(key)
+        if source == 'students':
+            row['total_students'] = a
+        elif source == 'attendance':
+            row.update(attendance_records=a, present_count=b, absent_count=a - b, present_students=c, absent_students=d)
+        elif source == 'rewards':
+            row.update(reward_events=a, reward_points=b or 0, rewarded_students=c)
         else:
-            bucket['absent_count'] += 1
-            bucket['_absent_student_ids'].add(row['student_id'])
-
-    reward_query = "SELECT student_id, points_change FROM points_history WHERE points_change > 0"
-    params = []
-    if date_from:
-        reward_query += " AND date >= ?"
-        params.append(date_from)
-    if date_to:
-        reward_query += " AND date <= ?"
-        params.append(date_to)
-    cursor.execute(reward_query, params)
-    rewarded_by_grade = {}
-    for row in cursor.fetchall():
-        bucket = ensure(student_grade.get(row['student_id']))
-        if bucket is None:
-            continue
-        bucket['reward_events'] += 1
-        bucket['reward_points'] += row['points_change'] or 0
-        bucket['_rewarded_student_ids'].add(row['student_id'])
-        rewarded_by_grade.setdefault(str(bucket['grade']), set()).add(row['student_id'])
+            row.update(eftikad_visits=a, eftikad_students=b)
 
-    for key, ids in rewarded_by_grade.items():
-        if key in summary:
-            summary[key]['rewarded_students'] = len(ids)
-
-    try:
-        eft_query = "SELECT student_id FROM eftikad WHERE 1=1"
-        params = []
-        if date_from:
-            eft_query += " AND date >= ?"
-            params.append(date_from)
-        if date_to:
-            eft_query += " AND date <= ?"
-            params.append(date_to)
-        cursor.execute(eft_query, params)
-        for row in cursor.fetchall():
-            bucket = ensure(student_grade.get(row['student_id']))
-            if bucket is not None:
-                bucket['eftikad_visits'] += 1
-                bucket['_eftikad_student_ids'].add(row['student_id'])
-    except sqlite3.OperationalError:
-        pass
-
-    conn.close()
-    rows = []
-    for bucket in summary.values():
-        bucket['present_students'] = len(bucket.pop('_present_student_ids', set()))
-        bucket['absent_students'] = len(bucket.pop('_absent_student_ids', set()))
-        bucket['rewarded_students'] = len(bucket.pop('_rewarded_student_ids', set()))
-        bucket['eftikad_students'] = len(bucket.pop('_eftikad_student_ids', set()))
-        rows.append(bucket)
-    return sorted(rows, key=lambda item: grade_sort_key(item['grade']))
+    return sorted(summary.values(), key=lambda item: (grade_sort_key(item['grade']), str(item['grade'])))
 
 
 def delete_servant_report(report_id: int) -> bool:
     """Delete a servant report by ID."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM servant_reports WHERE id = ?", (report_id,))
-    deleted = cursor.rowcount > 0
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM servant_reports WHERE id = ?", (report_id,))
+        deleted = cursor.rowcount > 0
+        if deleted:
+            bump_data_version(conn, 'servant_reports')
     return deleted
 
 
 def mark_reports_read() -> None:
     """Mark all reports as read."""
-    conn = sqlite3.connect(DB_FILE)
-    conn.execute("UPDATE servant_reports SET is_read = 1 WHERE is_read = 0")
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        if conn.execute("UPDATE servant_reports SET is_read = 1 WHERE is_read = 0").rowcount:
+            bump_data_version(conn, 'servant_reports')
+
+
+UNREAD_REPORT_COUNT = "SELECT COUNT(*) FROM servant_reports WHERE is_read = 0"
 
 
 def get_unread_report_count() -> int:
     """Get count of unread servant reports."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    try:
-        cursor.execute("SELECT COUNT(*) FROM servant_reports WHERE is_read = 0")
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(UNREAD_REPORT_COUNT)
         count = cursor.fetchone()[0]
-    except:
-        count = 0
-    conn.close()
     return count
 
 
 
 def check_user(username: str, password: str) -> Optional[Dict]:
     """Check if user credentials are valid and upgrade legacy password hashes."""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-
-    cursor.execute(
-        "SELECT id, username, password, role, COALESCE(class_name, 'all') as class_name, COALESCE(assigned_grades, '') as assigned_grades, COALESCE(assigned_sections, '') as assigned_sections FROM users WHERE username = ?",
-        (username,)
-    )
-    user = cursor.fetchone()
+    with db_connection(sqlite3.Row) as conn:
+        cursor = conn.cursor()
 
-    if not user or not verify_password(user['password'], password):
-        conn.close()
-        return None
-
-    if not user['password'].startswith(('pbkdf2:', 'scrypt:')):
         cursor.execute(
-            "UPDATE users SET password = ? WHERE username = ?",
-            (hash_password(password), username)
+            "SELECT id, username, password, role, COALESCE(class_name, 'all') as class_name, COALESCE(assigned_grades, '') as assigned_grades, COALESCE(assigned_sections, '') as assigned_sections FROM users WHERE username = ?",
+            (username,)
         )
-        conn.commit()
+        user = cursor.fetchone()
+
+        if not user or not verify_password(user['password'], password):
+            return None
+
+        if not user['password'].startswith(('pbkdf2:', 'scrypt:')):
+            cursor.execute(
+                "UPDATE users SET password = ? WHERE username = ?",
+                (hash_password(password), username)
+            )
 
-    result = dict(user)
-    result.pop('password', None)
-    conn.close()
+        result = dict(user)
+        result.pop('password', None)
     return result
 
 
 def get_user_by_username(username: str) -> Optional[Dict]:
     """Get the current non-password user record by username."""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT id, username, role, COALESCE(class_name, 'all') as class_name, COALESCE(assigned_grades, '') as assigned_grades, COALESCE(assigned_sections, '') as assigned_sections FROM users WHERE username = ?",
-        (username,)
-    )
-    row = cursor.fetchone()
-    conn.close()
+    with db_connection(sqlite3.Row) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, username, role, COALESCE(class_name, 'all') as class_name, COALESCE(assigned_grades, '') as assigned_grades, COALESCE(assigned_sections, '') as assigned_sections FROM users WHERE username = ?",
+            (username,)
+        )
+        row = cursor.fetchone()
     return dict(row) if row else None
 
 
+# Process-wide cache in front of get_user_by_username for per-request lookups. The
+# user functions below invalidate it; other processes see changes within the TTL.
+USER_CACHE_TTL = 30  # seconds
+USER_CACHE_SIZE = 256
+_user_cache = {}
+_user_cache_lock = threading.Lock()
+
+
+def get_cached_user(username: str) -> Optional[Dict]:
+    """get_user_by_username served from a short-lived cache (unknown users are not cached)."""
+    key = (DB_FILE, username)
+    now = time.monotonic()
+    with _user_cache_lock:
+        cached = _user_cache.get(key)
+    if cached and cached[0] > now:
+        return dict(cached[1])
+    user = get_user_by_username(username)
+    if user:
+        with _user_cache_lock:
+            if len(_user_cache) >= USER_CACHE_SIZE:
+                _user_cache.clear()
+            _user_cache[key] = (now + USER_CACHE_TTL, user)
+    return dict(user) if user else None
+
+
+def invalidate_user_cache():
+    """Forget every cached user record, after any change to the users table."""
+    with _user_cache_lock:
+        _user_cache.clear()
+
+
 def get_all_users() -> List[Dict]:
     """Get all users (without passwords)."""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, username, role, COALESCE(class_name, 'all') as class_name, COALESCE(assigned_grades, '') as assigned_grades, COALESCE(assigned_sections, '') as assigned_sections, created_at FROM users ORDER BY role, username")
-    users = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    with db_connection(sqlite3.Row) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, username, role, COALESCE(class_name, 'all') as class_name, COALESCE(assigned_grades, '') as assigned_grades, COALESCE(assigned_sections, '') as assigned_sections, created_at FROM users ORDER BY role, username")
+        users = [dict(row) for row in cursor.fetchall()]
     return users
 
 
@@ -635,67 +1344,65 @@ def add_user(username: str, password: str, role: str, class_name: str = 'all', a
     if role == 'sub_admin' and class_name == 'all':
         return {'success': False, 'error': 'Sub-admin accounts must be assigned to a class.'}
 
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
     try:
-        cursor.execute(
-            "INSERT INTO users (username, password, role, class_name, assigned_grades, assigned_sections) VALUES (?, ?, ?, ?, ?, ?)",
-            (username.strip(), hash_password(password), role, class_name, assigned_grades_text, assigned_sections_text)
-        )
-        conn.commit()
-        user_id = cursor.lastrowid
-        conn.close()
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT INTO users (username, password, role, class_name, assigned_grades, assigned_sections) VALUES (?, ?, ?, ?, ?, ?)",
+                (username.strip(), hash_password(password), role, class_name, assigned_grades_text, assigned_sections_text)
+            )
+            user_id = cursor.lastrowid
+            bump_data_version(conn, 'users')
+        invalidate_user_cache()
         return {'success': True, 'user_id': user_id, 'class_name': class_name, 'assigned_grades': assigned_grades_text, 'assigned_sections': assigned_sections_text}
     except sqlite3.IntegrityError:
-        conn.close()
         return {'success': False, 'error': f'Username "{username}" already exists.'}
     except Exception as e:
-        conn.close()
         return {'success': False, 'error': str(e)}
 
 
 def delete_user(user_id: int) -> bool:
     """Delete a user by ID. Cannot delete if it's the last admin."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-
-    # Check the user being deleted
-    cursor.execute("SELECT role FROM users WHERE id = ?", (user_id,))
-    row = cursor.fetchone()
-    if not row:
-        conn.close()
-        return False
-
-    cursor.execute("SELECT username FROM users WHERE id = ?", (user_id,))
-    user_row = cursor.fetchone()
-    if user_row and str(user_row[0]).upper() == 'STJOHN':
-        conn.close()
-        return False
-
-    if row[0] == 'admin':
-        # Make sure there's at least one other admin
-        cursor.execute("SELECT COUNT(*) FROM users WHERE role = 'admin' AND id != ?", (user_id,))
-        if cursor.fetchone()[0] == 0:
-            conn.close()
-            return False  # Cannot delete the last admin
+    with db_connection() as conn:
+        cursor = conn.cursor()
 
-    cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-    conn.commit()
-    conn.close()
+        # Check the user being deleted
+        cursor.execute("SELECT role FROM users WHERE id = ?", (user_id,))
+        row = cursor.fetchone()
+        if not row:
+            return False
+
+        cursor.execute("SELECT username FROM users WHERE id = ?", (user_id,))
+        user_row = cursor.fetchone()
+        if user_row and str(user_row[0]).upper() == 'STJOHN':
+            return False
+
+        if row[0] == 'admin':
+            # Make sure there's at least one other admin
+            cursor.execute("SELECT COUNT(*) FROM users WHERE role = 'admin' AND id != ?", (user_id,))
+            if cursor.fetchone()[0] == 0:
+                return False  # Cannot delete the last admin
+
+        cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
+        cursor.execute("DELETE FROM sessions WHERE username = ?", (user_row[0],))
+        bump_data_version(conn, 'users')
+    invalidate_user_cache()
+    invalidate_session_cache()
     return True
 
 
 def update_user_password(user_id: int, new_password: str) -> bool:
     """Update a user's password."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE users SET password = ? WHERE id = ?",
-        (hash_password(new_password), user_id)
-    )
-    changed = cursor.rowcount > 0
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE users SET password = ? WHERE id = ?",
+            (hash_password(new_password), user_id)
+        )
+        changed = cursor.rowcount > 0
+        if changed:
+            bump_data_version(conn, 'users')
+    invalidate_user_cache()
     return changed
 
 
@@ -705,24 +1412,23 @@ def update_user_class(user_id: int, class_name: str) -> bool:
     if class_name not in allowed_classes:
         return False
 
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT role FROM users WHERE id = ?", (user_id,))
-    row = cursor.fetchone()
-    if not row:
-        conn.close()
-        return False
-    if row[0] == 'user' and class_name == 'all':
-        conn.close()
-        return False
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT role FROM users WHERE id = ?", (user_id,))
+        row = cursor.fetchone()
+        if not row:
+            return False
+        if row[0] == 'user' and class_name == 'all':
+            return False
 
-    cursor.execute(
-        "UPDATE users SET class_name = ? WHERE id = ?",
-        (class_name, user_id)
-    )
-    changed = cursor.rowcount > 0
-    conn.commit()
-    conn.close()
+        cursor.execute(
+            "UPDATE users SET class_name = ? WHERE id = ?",
+            (class_name, user_id)
+        )
+        changed = cursor.rowcount > 0
+        if changed:
+            bump_data_version(conn, 'users')
+    invalidate_user_cache()
     return changed
 
 
@@ -730,24 +1436,23 @@ def update_user_grades(user_id: int, assigned_grades) -> bool:
     """Update a user's assigned grade list."""
     grades_text = normalize_assigned_grades(assigned_grades)
 
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT role FROM users WHERE id = ?", (user_id,))
-    row = cursor.fetchone()
-    if not row:
-        conn.close()
-        return False
-    if row[0] == 'user' and not grades_text:
-        conn.close()
-        return False
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT role FROM users WHERE id = ?", (user_id,))
+        row = cursor.fetchone()
+        if not row:
+            return False
+        if row[0] == 'user' and not grades_text:
+            return False
 
-    cursor.execute(
-        "UPDATE users SET assigned_grades = ? WHERE id = ?",
-        (grades_text, user_id)
-    )
-    changed = cursor.rowcount > 0
-    conn.commit()
-    conn.close()
+        cursor.execute(
+            "UPDATE users SET assigned_grades = ? WHERE id = ?",
+            (grades_text, user_id)
+        )
+        changed = cursor.rowcount > 0
+        if changed:
+            bump_data_version(conn, 'users')
+    invalidate_user_cache()
     return changed
 
 
@@ -755,90 +1460,97 @@ def update_user_sections(user_id: int, assigned_sections) -> bool:
     """Update a user's assigned section list. Empty means both."""
     sections_text = normalize_assigned_sections(assigned_sections)
 
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT role FROM users WHERE id = ?", (user_id,))
-    row = cursor.fetchone()
-    if not row:
-        conn.close()
-        return False
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT role FROM users WHERE id = ?", (user_id,))
+        row = cursor.fetchone()
+        if not row:
+            return False
 
-    cursor.execute(
-        "UPDATE users SET assigned_sections = ? WHERE id = ?",
-        (sections_text, user_id)
-    )
-    changed = cursor.rowcount > 0
-    conn.commit()
-    conn.close()
+        cursor.execute(
+            "UPDATE users SET assigned_sections = ? WHERE id = ?",
+            (sections_text, user_id)
+        )
+        changed = cursor.rowcount > 0
+        if changed:
+            bump_data_version(conn, 'users')
+    invalidate_user_cache()
     return changed
 
-def import_from_excel(excel_path: str):
-    """Import student data from Excel file."""
-    conn = sqlite3.connect(DB_FILE)
-    
-    # Read the "All Kids" sheet
-    df = pd.read_excel(excel_path, sheet_name='All Kids')
-    
-    # Clean up the data
-    df = df.dropna(subset=['Name'])  # Remove rows without names
-    
-    # Prepare data for insertion
-    for _, row in df.iterrows():
-        grade_value = normalize_grade_value(row.get('Grade'))
-        class_name = str(row.get('Class', '')).strip() if pd.notna(row.get('Class')) else ''
-        if not class_name:
-            class_name = grade_to_class_name(grade_value)
-        conn.execute('''
-            INSERT OR IGNORE INTO students 
-            (name, grade, gender, servant, phone, parent_phone, dob, address, comments, pictures, last_call, class_name)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            str(row.get('Name', '')),
-            grade_value,
-            str(row.get('Gen', '')),
-            str(row.get('Servant', '')),
-            str(row.get('Phone number', '')) if pd.notna(row.get('Phone number')) else '',
-            str(row.get('Parent Phone', '')) if pd.notna(row.get('Parent Phone')) else '',
-            str(row.get('DOB', '')) if pd.notna(row.get('DOB')) else '',
-            str(row.get('Address ', '')) if pd.notna(row.get('Address ')) else '',
-            str(row.get('Comments', '')) if pd.notna(row.get('Comments')) else '',
-            str(row.get('Pictures', '')) if pd.notna(row.get('Pictures')) else '',
-            str(row.get('Last Call/Visitation ', '')) if pd.notna(row.get('Last Call/Visitation ')) else '',
-            class_name
-        ))
-    
-    conn.commit()
-    conn.close()
 
-def get_consecutive_absences(student_id: int) -> int:
-    """Calculate consecutive absences from most recent attendance records."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # Get all attendance records for this student, ordered by date descending
-    cursor.execute('''
-        SELECT status FROM attendance 
-        WHERE student_id = ? 
-        ORDER BY date DESC
-    ''', (student_id,))
-    
-    records = cursor.fetchall()
-    conn.close()
-    
-    # Count consecutive absences from the most recent record
-    consecutive = 0
-    for record in records:
-        if record[0] == 'absent':
-            consecutive += 1
-        else:
-            break
-    
-    return consecutive
+# ==================== SESSIONS ====================
 
-def get_alert_level(student_id: int) -> str:
-    """Get alert level based on consecutive absences."""
-    absences = get_consecutive_absences(student_id)
-    
+# Server-side login sessions for session_store.SQLiteSessionInterface. The cookie
+# carries only the row id; the session dict is stored here as JSON.
+
+SESSION_CACHE_TTL = 30  # seconds a loaded session is trusted before re-reading it
+SESSION_CACHE_SIZE = 1024
+_session_cache = {}
+_session_cache_lock = threading.Lock()
+
+
+def load_session(session_id: str) -> Optional[Tuple[Dict, datetime]]:
+    """(data, expires_at) of a live session, served from a short-lived cache, or None."""
+    key = (DB_FILE, session_id)
+    now = time.monotonic()
+    with _session_cache_lock:
+        cached = _session_cache.get(key)
+    if not cached or cached[0] <= now:
+        with db_connection() as conn:
+            row = conn.execute('SELECT data, expires_at FROM sessions WHERE id = ?', (session_id,)).fetchone()
+        if not row:
+            return None
+        cached = (now + SESSION_CACHE_TTL, json.loads(row[0]), datetime.strptime(row[1], '%Y-%m-%d %H:%M:%S'))
+        with _session_cache_lock:
+            if len(_session_cache) >= SESSION_CACHE_SIZE:
+                _session_cache.clear()
+            _session_cache[key] = cached
+    if cached[2] <= datetime.now():
+        return None
+    return dict(cached[1]), cached[2]
+
+
+def save_session(session_id: str, data: Dict, expires_at: datetime):
+    """Create or replace a session row."""
+    expires_text = expires_at.strftime('%Y-%m-%d %H:%M:%S')
+    with db_connection() as conn:
+        conn.execute('''INSERT INTO sessions (id, username, data, expires_at) VALUES (?, ?, ?, ?)
+                        ON CONFLICT(id) DO UPDATE SET username = excluded.username, data = excluded.data,
+                                                      expires_at = excluded.expires_at''',
+                     (session_id, data.get('username'), json.dumps(data), expires_text))
+    with _session_cache_lock:
+        _session_cache[(DB_FILE, session_id)] = (time.monotonic() + SESSION_CACHE_TTL, dict(data),
+                                                 datetime.strptime(expires_text, '%Y-%m-%d %H:%M:%S'))
+
+
+def delete_session(session_id: str):
+    """Remove one session (logout)."""
+    with db_connection() as conn:
+        conn.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+    with _session_cache_lock:
+        _session_cache.pop((DB_FILE, session_id), None)
+
+
+def delete_expired_sessions() -> int:
+    """Sweep sessions past their expiry; returns how many were removed."""
+    with db_connection() as conn:
+        removed = conn.execute('DELETE FROM sessions WHERE expires_at <= ?',
+                               (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),)).rowcount
+    now = datetime.now()
+    with _session_cache_lock:
+        for key in [key for key, cached in _session_cache.items() if cached[2] <= now]:
+            del _session_cache[key]
+    return removed
+
+
+def invalidate_session_cache():
+    """Forget every cached session, after sessions were removed behind load_session's back."""
+    with _session_cache_lock:
+        _session_cache.clear()
+
+
+def alert_level_for(absences: int) -> str:
+    """Map a consecutive-absence count to an alert level."""
     if absences >= 4:
         return 'red'
     elif absences >= 2:
@@ -846,15 +1558,200 @@ def get_alert_level(student_id: int) -> str:
     else:
         return 'none'
 
-def get_students(servant: Optional[str] = None, grade: Optional[int] = None, gender: Optional[str] = None) -> List[Dict]:
-    """Get students with optional filters."""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
+
+def _student_scope(student_ids: Optional[Iterable[int]]) -> Tuple[str, tuple]:
+    """Subquery + params selecting the given student ids (None means every student)."""
+    if student_ids is None:
+        return 'SELECT id FROM students', ()
+    return 'SELECT value FROM json_each(?)', (json.dumps([int(i) for i in student_ids]),)
+
+
+def _servant_scope(servant_filter: Optional[str]) -> Tuple[str, list]:
+    """WHERE predicate + params for students of a servant, class name or class's grades
+    (None or 'all' matches everyone)."""
+    if not servant_filter or servant_filter == 'all':
+        return '1=1', []
+    predicate = 'servant = ? OR class_name = ?'
+    params = [servant_filter, servant_filter]
+    class_grades = class_grade_values(servant_filter)
+    if class_grades:
+        predicate += f" OR grade IN ({','.join('?' for _ in class_grades)})"
+        params.extend(class_grades)
+    return f'({predicate})', params
+
+
+def get_absence_alerts(student_ids: Optional[Iterable[int]] = None) -> Dict[int, Tuple[int, str]]:
+    """Consecutive absences and alert level for many students in one lookup.
+
+    Returns {student_id: (consecutive_absences, alert_level)}. Pass None for every
+    student; students without attendance are omitted, callers treat them as (0, 'none').
+    """
+    scope, params = _student_scope(student_ids)
+    with db_connection() as conn:
+        rows = conn.execute(
+            f'SELECT student_id, absence_streak FROM student_streaks WHERE student_id IN ({scope})',
+            params
+        ).fetchall()
+    return {student_id: (absences, alert_level_for(absences)) for student_id, absences in rows}
+
+
+# ==================== STREAKS ====================
+
+def rebuild_student_streaks(student_ids: Optional[Iterable[int]] = None) -> int:
+    """Recompute student_streaks from attendance history. Returns rows written."""
+    scope, params = _student_scope(student_ids)
+    with db_connection() as conn:
+        conn.execute(f'DELETE FROM student_streaks WHERE student_id IN ({scope})', params)
+        # Rows are numbered newest-first; each streak ends at the first row that
+        # breaks it, or covers the whole history when nothing does.
+        cursor = conn.execute(f'''
+            INSERT INTO student_streaks
+                (student_id, absence_streak, presence_streak, liturgy_streak, last_seen_date, last_date)
+            SELECT student_id,
+                   COALESCE(MIN(CASE WHEN status != 'absent' THEN rn END) - 1, COUNT(*)),
+                   COALESCE(MIN(CASE WHEN status != 'present' THEN rn END) - 1, COUNT(*)),
+                   COALESCE(MIN(CASE WHEN liturgy != 1 THEN rn END) - 1, COUNT(*)),
+                   MAX(CASE WHEN status = 'present' THEN date END),
+                   MAX(date)
+            FROM (
+                SELECT student_id, date, status, COALESCE(liturgy, 0) AS liturgy,
+                       ROW_NUMBER() OVER (PARTITION BY student_id ORDER BY date DESC) AS rn
+                FROM attendance
+                WHERE student_id IN ({scope})
+            )
+            GROUP BY student_id
+        ''', params)
+        return cursor.rowcount
+
+
+def update_student_streak(student_id: int, date: str, status: str, liturgy: int = 0):
+    """Fold one attendance write into student_streaks, inside the caller's transaction.
+
+    A record newer than anything seen extends or resets the streaks in place;
+    back-dated or overwritten records recompute that one student from history.
+    liturgy counts only when it is 1, as in rebuild_student_streaks.
+    """
+    with db_connection() as conn:
+        row = conn.execute('SELECT last_date FROM student_streaks WHERE student_id = ?',
+                           (student_id,)).fetchone()
+        if not row or date <= row[0]:
+            rebuild_student_streaks([student_id])
+            return
+        present = 1 if status == 'present' else 0
+        conn.execute('''
+            UPDATE student_streaks SET
+                absence_streak = CASE WHEN ? = 'absent' THEN absence_streak + 1 ELSE 0 END,
+                presence_streak = CASE WHEN ? THEN presence_streak + 1 ELSE 0 END,
+                liturgy_streak = CASE WHEN ? = 1 THEN liturgy_streak + 1 ELSE 0 END,
+                last_seen_date = CASE WHEN ? THEN ? ELSE last_seen_date END,
+                last_date = ?
+            WHERE student_id = ?
+        ''', (status, present, liturgy, present, date, date, student_id))
+
+
+def get_student_streaks(student_id: int) -> Dict:
+    """Current absence/presence/liturgy streaks and last-seen date for one student."""
+    with db_connection(sqlite3.Row) as conn:
+        row = conn.execute('SELECT * FROM student_streaks WHERE student_id = ?', (student_id,)).fetchone()
+    if not row:
+        return {'student_id': student_id, 'absence_streak': 0, 'presence_streak': 0,
+                'liturgy_streak': 0, 'last_seen_date': None, 'last_date': None}
+    return dict(row)
+
+
+# ==================== ATTENDANCE ROLLUP ====================
+
+# attendance_daily holds present/absent counts per date and student bucket: the grade,
+# gender, servant and class name that charts filter on. `bucket` is those four values
+# as JSON, so it can be a primary key that keeps NULL, '' and 6 vs '6' apart.
+ROLLUP_BUCKET = 'json_array(s.grade, s.gender, s.servant, s.class_name)'
+ROLLUP_UPSERT = '''
+    INSERT INTO attendance_daily (date, bucket, grade, gender, servant, class_name, present, absent)
+    {select}
+    ON CONFLICT(date, bucket) DO UPDATE SET
+        present = present + excluded.present,
+        absent = absent + excluded.absent
+'''
+
+
+def rebuild_attendance_rollup(dates: Optional[Iterable[str]] = None) -> int:
+    """Recompute attendance_daily from attendance, for every date or just `dates`. Returns rows written."""
+    where, params = '', ()
+    if dates is not None:
+        where, params = 'WHERE date IN (SELECT value FROM json_each(?))', (json.dumps(sorted(set(dates))),)
+    with db_connection() as conn:
+        conn.execute(f'DELETE FROM attendance_daily {where}', params)
+        cursor = conn.execute(f'''
+            INSERT INTO attendance_daily (date, bucket, grade, gender, servant, class_name, present, absent)
+            SELECT a.date, {ROLLUP_BUCKET}, s.grade, s.gender, s.servant, s.class_name,
+                   SUM(a.status = 'present'), SUM(a.status != 'present')
+            FROM attendance a JOIN students s ON s.id = a.student_id
+            {where}
+            GROUP BY a.date, 2
+        ''', params)
+        return cursor.rowcount
+
+
+def update_attendance_rollup(date: str, changes: Iterable[Tuple[int, Optional[str], Optional[str]]]):
+    """Fold (student_id, old_status, new_status) changes on one date into attendance_daily,
+    inside the caller's transaction. A status of None means no record."""
+    deltas = []
+    for student_id, old, new in changes:
+        present = (new == 'present') - (old == 'present')
+        absent = (new not in (None, 'present')) - (old not in (None, 'present'))
+        if present or absent:
+            deltas.append((date, present, absent, student_id))
+    if not deltas:
+        return
+    with db_connection() as conn:
+        conn.executemany(ROLLUP_UPSERT.format(select=f'''
+            SELECT ?, {ROLLUP_BUCKET}, s.grade, s.gender, s.servant, s.class_name, ?, ?
+            FROM students s WHERE s.id = ?'''), deltas)
+        if any(present < 0 or absent < 0 for _, present, absent, _ in deltas):
+            conn.execute('DELETE FROM attendance_daily WHERE date = ? AND present = 0 AND absent = 0', (date,))
+
+
+def shift_attendance_rollup(student_ids: Iterable[int], sign: int):
+    """Add (sign=1) or remove (sign=-1) these students' whole history under their current
+    bucket, inside the caller's transaction. Bracket a change to grade, gender, servant
+    or class name with -1 before and +1 after."""
+    scope, params = _student_scope(student_ids)
+    with db_connection() as conn:
+        conn.execute(ROLLUP_UPSERT.format(select=f'''
+            SELECT a.date, {ROLLUP_BUCKET}, s.grade, s.gender, s.servant, s.class_name,
+                   ? * SUM(a.status = 'present'), ? * SUM(a.status != 'present')
+            FROM attendance a JOIN students s ON s.id = a.student_id
+            WHERE a.student_id IN ({scope})
+            GROUP BY a.date, 2'''), (sign, sign) + params)
+        if sign < 0:
+            conn.execute('DELETE FROM attendance_daily WHERE present = 0 AND absent = 0')
+
+
+def get_consecutive_absences(student_id: int) -> int:
+    """Calculate consecutive absences from most recent attendance records."""
+    return get_absence_alerts([student_id]).get(student_id, (0, 'none'))[0]
+
+
+def get_alert_level(student_id: int) -> str:
+    """Get alert level based on consecutive absences."""
+    return alert_level_for(get_consecutive_absences(student_id))
+
+
+def _attach_alerts(students: List[Dict]):
+    """Fill alert_level/consecutive_absences on student dicts with one query."""
+    alerts = get_absence_alerts([student['id'] for student in students])
+    for student in students:
+        absences, level = alerts.get(student['id'], (0, 'none'))
+        student['alert_level'] = level
+        student['consecutive_absences'] = absences
+
+def _students_query(servant: Optional[str] = None, grade: Optional[int] = None, gender: Optional[str] = None,
+                    scope: Optional[StudentScope] = None,
+                    student_ids: Optional[Iterable[int]] = None) -> Tuple[str, list]:
+    """SQL + params of get_students (also EXPLAINed by explain_hot_queries)."""
     query = "SELECT * FROM students WHERE 1=1"
     params = []
-    
+
     if servant:
         query += " AND (servant = ? OR class_name = ?"
         params.extend([servant, servant])
@@ -864,11 +1761,11 @@ def get_students(servant: Optional[str] = None, grade: Optional[int] = None, gen
             query += f" OR grade IN ({placeholders})"
             params.extend(class_grades)
         query += ")"
-    
+
     if grade is not None:
         query += " AND grade = ?"
         params.append(grade)
-    
+
     if gender:
         # Normalize gender: frontend sends M/F, DB may store Boy/Girl or M/F
         gender_variants = [gender]
@@ -880,135 +1777,187 @@ def get_students(servant: Optional[str] = None, grade: Optional[int] = None, gen
         placeholders = ','.join(['?' for _ in gender_variants])
         query += f" AND gender IN ({placeholders})"
         params.extend(gender_variants)
-    
-    cursor.execute(query, params)
-    
-    students = []
-    for row in cursor.fetchall():
-        student = dict(row)
-        # Normalize gender to M/F for frontend consistency
-        g = (student.get('gender') or '').lower()
-        if g in ('boy', 'boys', 'male'):
-            student['gender'] = 'M'
-        elif g in ('girl', 'girls', 'female'):
-            student['gender'] = 'F'
-        student['alert_level'] = get_alert_level(student['id'])
-        student['consecutive_absences'] = get_consecutive_absences(student['id'])
-        students.append(student)
-    
-    conn.close()
+
+    if student_ids is not None:
+        subquery, id_params = _student_scope(student_ids)
+        query += f" AND id IN ({subquery})"
+        params.extend(id_params)
+
+    visible, visible_params = _visibility(scope)
+    query += f" AND {visible} ORDER BY id"
+    params.extend(visible_params)
+    return query, params
+
+
+def get_students(servant: Optional[str] = None, grade: Optional[int] = None, gender: Optional[str] = None,
+                 scope: Optional[StudentScope] = None, student_ids: Optional[Iterable[int]] = None) -> List[Dict]:
+    """Get students with optional filters (and only `student_ids` if given), limited to those `scope` allows."""
+    query, params = _students_query(servant, grade, gender, scope, student_ids)
+    with db_connection(sqlite3.Row) as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+
+        students = []
+        for row in cursor.fetchall():
+            student = dict(row)
+            # Normalize gender to M/F for frontend consistency
+            g = (student.get('gender') or '').lower()
+            if g in ('boy', 'boys', 'male'):
+                student['gender'] = 'M'
+            elif g in ('girl', 'girls', 'female'):
+                student['gender'] = 'F'
+            students.append(student)
+    
+    _attach_alerts(students)
     return students
 
 def get_servants() -> List[str]:
     """Get list of unique servants from both students and servants tables."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    with db_connection() as conn:
+        cursor = conn.cursor()
     
-    # Get servants from students table
-    cursor.execute("SELECT DISTINCT servant FROM students WHERE servant != ''")
-    student_servants = set(row[0] for row in cursor.fetchall())
+        # Get servants from students table
+        cursor.execute("SELECT DISTINCT servant FROM students WHERE servant != ''")
+        student_servants = set(row[0] for row in cursor.fetchall())
     
-    # Get servants from servants table (may not exist)
-    try:
+        # Get servants from servants table
         cursor.execute("SELECT name FROM servants")
         standalone_servants = set(row[0] for row in cursor.fetchall())
-    except:
-        standalone_servants = set()
     
-    # Combine and sort
-    all_servants = sorted(student_servants | standalone_servants)
+        # Combine and sort
+        all_servants = sorted(student_servants | standalone_servants)
     
-    conn.close()
     return all_servants
 
 def add_servant(name: str, phone: str = ''):
     """Add a new servant to the servants table."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # Create table if it doesn't exist
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS servants (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL UNIQUE,
-            phone TEXT
-        )
-    ''')
+    with db_connection() as conn:
+        cursor = conn.cursor()
     
-    cursor.execute('''
-        INSERT OR IGNORE INTO servants (name, phone)
-        VALUES (?, ?)
-    ''', (name, phone))
+        cursor.execute('''
+            INSERT OR IGNORE INTO servants (name, phone)
+            VALUES (?, ?)
+        ''', (name, phone))
+        if cursor.rowcount:
+            bump_data_version(conn, 'servants')
     
-    conn.commit()
-    conn.close()
+
+SERVANT_GRADES = "SELECT DISTINCT grade FROM students WHERE servant = ? AND grade IS NOT NULL ORDER BY grade"
+
 
 def get_filters(servant: str) -> Dict:
     """Get available grades and genders for a specific servant."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    with db_connection() as conn:
+        cursor = conn.cursor()
     
-    cursor.execute("SELECT DISTINCT grade FROM students WHERE servant = ? AND grade IS NOT NULL ORDER BY grade", (servant,))
-    grades = [row[0] for row in cursor.fetchall()]
+        cursor.execute(SERVANT_GRADES, (servant,))
+        grades = [row[0] for row in cursor.fetchall()]
     
-    cursor.execute("SELECT DISTINCT gender FROM students WHERE servant = ? AND gender != '' ORDER BY gender", (servant,))
-    genders = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT DISTINCT gender FROM students WHERE servant = ? AND gender != '' ORDER BY gender", (servant,))
+        genders = [row[0] for row in cursor.fetchall()]
     
-    conn.close()
     return {'grades': grades, 'genders': genders}
 
-def save_attendance(student_id: int, date: str, status: str):
-    """Save or update attendance record."""
-    conn = sqlite3.connect(DB_FILE)
-    
-    conn.execute('''
-        INSERT OR REPLACE INTO attendance (student_id, date, status)
-        VALUES (?, ?, ?)
-    ''', (student_id, date, status))
-    
-    conn.commit()
-    conn.close()
+ATTENDANCE_UPSERT = '''
+    INSERT INTO attendance
+    (student_id, date, status, liturgy, tonia, confession, bible_prayer, questions)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(student_id, date) DO UPDATE SET
+        status = excluded.status,
+        liturgy = excluded.liturgy,
+        tonia = excluded.tonia,
+        confession = excluded.confession,
+        bible_prayer = excluded.bible_prayer,
+        questions = excluded.questions
+'''
+
+
+def save_attendance(student_id: int, date: str, status: str, liturgy: int = 0, tonia: int = 0,
+                    confession: int = 0, bible_prayer: int = 0, questions: int = 0):
+    """Save or update attendance record, its student's streaks and the daily rollup in one transaction."""
+    liturgy = 1 if int(liturgy or 0) else 0
+    with db_connection() as conn:
+        old = conn.execute('SELECT status FROM attendance WHERE student_id = ? AND date = ?',
+                           (student_id, date)).fetchone()
+        conn.execute(ATTENDANCE_UPSERT,
+                     (student_id, date, status, liturgy, tonia, confession, bible_prayer, questions))
+        update_student_streak(student_id, date, status, liturgy)
+        update_attendance_rollup(date, [(student_id, old[0] if old else None, status)])
+        bump_data_version(conn, 'attendance')
+
+
+def save_attendance_batch(date: str, records: List[Dict]) -> List[Dict]:
+    """Upsert a whole class submission, update streaks and award points in one transaction.
+
+    Each record needs student_id and status; liturgy, tonia, confession, bible_prayer
+    and questions default to 0. liturgy is stored as 0 or 1. Returns one result per record, in order.
+    """
+    rows = []
+    for record in records:
+        rows.append((
+            int(record['student_id']), date, record['status'],
+            1 if int(record.get('liturgy') or 0) else 0, int(record.get('tonia') or 0),
+            int(record.get('confession') or 0), int(record.get('bible_prayer') or 0),
+            int(record.get('questions') or 0),
+        ))
+    with db_connection() as conn:
+        previous = dict(conn.execute(
+            'SELECT student_id, status FROM attendance WHERE date = ? AND student_id IN (SELECT value FROM json_each(?))',
+            (date, json.dumps([row[0] for row in rows]))).fetchall())
+        conn.executemany(ATTENDANCE_UPSERT, rows)
+        changes = []
+        for student_id, _, status, liturgy, *_ in rows:
+            update_student_streak(student_id, date, status, liturgy)
+            changes.append((student_id, previous.get(student_id), status))
+            previous[student_id] = status
+        update_attendance_rollup(date, changes)
+        if rows:
+            bump_data_version(conn, 'attendance')
+        points = evaluate_points(date, [
+            (student_id, 1 if status == 'present' else 0, liturgy, tonia, confession, bible_prayer, questions)
+            for student_id, _, status, liturgy, tonia, confession, bible_prayer, questions in rows
+        ])
+    return [{'student_id': row[0], 'status': row[2], 'points_earned': earned}
+            for row, earned in zip(rows, points)]
 
 def get_attendance_history(student_id: int) -> List[Dict]:
     """Get attendance history for a student."""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    with db_connection(sqlite3.Row) as conn:
+        cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT date, status FROM attendance 
-        WHERE student_id = ? 
-        ORDER BY date DESC
-        LIMIT 20
-    ''', (student_id,))
+        cursor.execute('''
+            SELECT date, status FROM attendance 
+            WHERE student_id = ? 
+            ORDER BY date DESC
+            LIMIT 20
+        ''', (student_id,))
     
-    history = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+        history = [dict(row) for row in cursor.fetchall()]
     return history
 
 def add_student(name: str, grade: int, gender: str, servant: str, **kwargs) -> int:
     """Add a new student."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    dob, birth_month_day = normalize_dob(kwargs.get('dob', ''))
+    with db_connection() as conn:
+        cursor = conn.cursor()
     
-    cursor.execute('''
-        INSERT INTO students 
-        (name, grade, gender, servant, phone, parent_phone, dob, address, comments, pictures, last_call)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        name, grade, gender, servant,
-        kwargs.get('phone', ''),
-        kwargs.get('parent_phone', ''),
-        kwargs.get('dob', ''),
-        kwargs.get('address', ''),
-        kwargs.get('comments', ''),
-        kwargs.get('pictures', ''),
-        kwargs.get('last_call', '')
-    ))
+        cursor.execute('''
+            INSERT INTO students 
+            (name, grade, gender, servant, phone, parent_phone, dob, birth_month_day, address, comments, pictures, last_call)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            name, grade, gender, servant,
+            kwargs.get('phone', ''),
+            kwargs.get('parent_phone', ''),
+            dob, birth_month_day,
+            kwargs.get('address', ''),
+            kwargs.get('comments', ''),
+            kwargs.get('pictures', ''),
+            kwargs.get('last_call', '')
+        ))
     
-    student_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+        student_id = cursor.lastrowid
+        bump_data_version(conn, 'students')
     
     return student_id
 
@@ -1028,95 +1977,92 @@ def find_or_create_student_from_record(record: Dict, servant_username: str = '')
     parent_phone = str(record.get('parent_phone') or '').strip()
     class_name = grade_to_class_name(grade_value)
 
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, grade, gender FROM students WHERE lower(name) = lower(?)", (name,))
-    for row in cursor.fetchall():
-        same_grade = normalize_grade_value(row['grade']) == normalize_grade_value(grade_value)
-        same_gender = not gender or normalize_gender_value(row['gender']) == gender
-        if same_grade and same_gender:
-            conn.close()
-            return row['id']
-
-    cursor.execute('''
-        INSERT INTO students
-        (name, grade, gender, servant, phone, parent_phone, class_name)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (name, grade_value, gender, servant, phone, parent_phone, class_name))
-    student_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    with db_connection(sqlite3.Row) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, grade, gender FROM students WHERE lower(name) = lower(?)", (name,))
+        for row in cursor.fetchall():
+            same_grade = normalize_grade_value(row['grade']) == normalize_grade_value(grade_value)
+            same_gender = not gender or normalize_gender_value(row['gender']) == gender
+            if same_grade and same_gender:
+                return row['id']
+
+        cursor.execute('''
+            INSERT INTO students
+            (name, grade, gender, servant, phone, parent_phone, class_name)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (name, grade_value, gender, servant, phone, parent_phone, class_name))
+        student_id = cursor.lastrowid
+        bump_data_version(conn, 'students')
     return student_id
 
 
 def update_student(student_id: int, **kwargs):
     """Update student information."""
-    conn = sqlite3.connect(DB_FILE)
+    if 'dob' in kwargs:
+        kwargs['dob'], birth_month_day = normalize_dob(kwargs['dob'])
+    with db_connection() as conn:
+    
+        fields = []
+        values = []
+    
+        for key, value in kwargs.items():
+            if key in ['name', 'grade', 'gender', 'servant', 'phone', 'parent_phone', 'dob', 'address', 'comments', 'pictures', 'last_call']:
+                fields.append(f"{key} = ?")
+                values.append(value)
+        if 'dob' in kwargs:
+            fields.append('birth_month_day = ?')
+            values.append(birth_month_day)
+    
+        if fields:
+            query = f"UPDATE students SET {', '.join(fields)} WHERE id = ?"
+            values.append(student_id)
+            regroup = any(key in kwargs for key in ('grade', 'gender', 'servant'))
+            if regroup:
+                shift_attendance_rollup([student_id], -1)
+            conn.execute(query, values)
+            if regroup:
+                shift_attendance_rollup([student_id], 1)
+            bump_data_version(conn, 'students')
     
-    fields = []
-    values = []
-    
-    for key, value in kwargs.items():
-        if key in ['name', 'grade', 'gender', 'servant', 'phone', 'parent_phone', 'dob', 'address', 'comments', 'pictures', 'last_call']:
-            fields.append(f"{key} = ?")
-            values.append(value)
-    
-    if fields:
-        query = f"UPDATE students SET {', '.join(fields)} WHERE id = ?"
-        values.append(student_id)
-        conn.execute(query, values)
-        conn.commit()
-    
-    conn.close()
 
 def delete_student(student_id: int):
     """Delete a student and their attendance records."""
-    conn = sqlite3.connect(DB_FILE)
+    with db_connection() as conn:
     
-    conn.execute("DELETE FROM attendance WHERE student_id = ?", (student_id,))
-    conn.execute("DELETE FROM students WHERE id = ?", (student_id,))
+        shift_attendance_rollup([student_id], -1)
+        conn.execute("DELETE FROM attendance WHERE student_id = ?", (student_id,))
+        conn.execute("DELETE FROM student_streaks WHERE student_id = ?", (student_id,))
+        conn.execute("DELETE FROM students WHERE id = ?", (student_id,))
+        bump_data_version(conn, 'students', 'attendance')
     
-    conn.commit()
-    conn.close()
+
+RECENT_ATTENDANCE_RATE = '''
+    SELECT SUM(present) as present, SUM(present + absent) as total
+    FROM attendance_daily
+    WHERE date >= ?
+'''
+
 
 def get_analytics() -> Dict:
     """Get analytics data for dashboard."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    with db_connection() as conn:
+        cursor = conn.cursor()
     
-    # Total students
-    cursor.execute("SELECT COUNT(*) FROM students")
-    total_students = cursor.fetchone()[0]
+        # Total students
+        cursor.execute("SELECT COUNT(*) FROM students")
+        total_students = cursor.fetchone()[0]
     
-    # Get all students for alert counting
-    cursor.execute("SELECT id FROM students")
-    student_ids = [row[0] for row in cursor.fetchall()]
+        # Alert counts for every student in one pass
+        levels = [level for _, level in get_absence_alerts().values()]
+        yellow_alerts = levels.count('yellow')
+        red_alerts = levels.count('red')
     
-    yellow_alerts = 0
-    red_alerts = 0
+        # Get recent attendance rate (last 4 weeks)
+        four_weeks_ago = (datetime.now() - timedelta(days=28)).strftime('%Y-%m-%d')
+        cursor.execute(RECENT_ATTENDANCE_RATE, (four_weeks_ago,))
     
-    for student_id in student_ids:
-        alert = get_alert_level(student_id)
-        if alert == 'yellow':
-            yellow_alerts += 1
-        elif alert == 'red':
-            red_alerts += 1
-    
-    # Get recent attendance rate (last 4 weeks)
-    four_weeks_ago = (datetime.now() - timedelta(days=28)).strftime('%Y-%m-%d')
-    cursor.execute('''
-        SELECT 
-            SUM(CASE WHEN status = 'present' THEN 1 ELSE 0 END) as present,
-            COUNT(*) as total
-        FROM attendance
-        WHERE date >= ?
-    ''', (four_weeks_ago,))
-    
-    result = cursor.fetchone()
-    attendance_rate = (result[0] / result[1] * 100) if result[1] > 0 else 0
-    
-    conn.close()
+        result = cursor.fetchone()
+        attendance_rate = (result[0] / result[1] * 100) if result[1] else 0
     
     return {
         'total_students': total_students,
@@ -1125,458 +2071,1063 @@ def get_analytics() -> Dict:
         'attendance_rate': round(attendance_rate, 1)
     }
 
-def export_to_excel(output_path: str):
-    """Export current data to Excel."""
-    conn = sqlite3.connect(DB_FILE)
-    
-    # Get students data
-    students_df = pd.read_sql_query("SELECT * FROM students", conn)
-    
-    # Get recent attendance data
-    attendance_df = pd.read_sql_query('''
-        SELECT s.name, a.date, a.status 
-        FROM attendance a
-        JOIN students s ON a.student_id = s.id
-        ORDER BY a.date DESC, s.name
-    ''', conn)
-    
-    conn.close()
-    
-    # Write to Excel with multiple sheets
-    with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-        students_df.to_excel(writer, sheet_name='Students', index=False)
-        attendance_df.to_excel(writer, sheet_name='Attendance Records', index=False)
+EXPORT_FETCH_ROWS = 1000
+
+
+def student_export_columns() -> List[str]:
+    """Columns of the students table, in table order (without the derived birthday key)."""
+    with db_connection() as conn:
+        return [row[1] for row in conn.execute('PRAGMA table_info(students)') if row[1] != 'birth_month_day']
+
+
+def export_to_excel(output, date_from: str = None, date_to: str = None, class_name: str = None,
+                    columns: Optional[List[str]] = None, progress: Optional[Callable[[int], None]] = None) -> Dict:
+    """Export students and attendance records to an .xlsx path or binary file object.
+
+    Rows are streamed from cursors into a write-only workbook, so memory stays flat no
+    matter how much history is exported. class_name limits both sheets to a servant or
+    class (as get_students does), date_from/date_to limit the attendance records and
+    columns picks the Students sheet's columns (all by default). Returns the rows
+    written per sheet; progress, if given, is called with the running total.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+
+    available = student_export_columns()
+    columns = list(columns) if columns else available
+    unknown = [column for column in columns if column not in available]
+    if unknown:
+        raise ValueError(f"Unknown student columns: {', '.join(unknown)}")
+
+    scope, params = _servant_scope(class_name)
+    date_sql, date_params = '', []
+    if date_from:
+        date_sql += ' AND a.date >= ?'
+        date_params.append(date_from)
+    if date_to:
+        date_sql += ' AND a.date <= ?'
+        date_params.append(date_to)
+    sheets = [
+        ('Students', columns, f"SELECT {', '.join(columns)} FROM students WHERE {scope}", params),
+        ('Attendance Records', ['name', 'date', 'status'], f'''
+            SELECT s.name, a.date, a.status
+            FROM attendance a
+            JOIN students s ON a.student_id = s.id
+            WHERE {scope}{date_sql}
+            ORDER BY a.date DESC, s.name
+        ''', params + date_params),
+    ]
+
+    workbook = Workbook(write_only=True)
+    header_font = Font(bold=True)
+    counts, written = {}, 0
+    with db_connection() as conn:
+        for title, headers, sql, sql_params in sheets:
+            sheet = workbook.create_sheet(title)
+            header = []
+            for name in headers:
+                cell = WriteOnlyCell(sheet, value=name)
+                cell.font = header_font
+                header.append(cell)
+            sheet.append(header)
+            cursor = conn.execute(sql, sql_params)
+            counts[title] = 0
+            while True:
+                rows = cursor.fetchmany(EXPORT_FETCH_ROWS)
+                if not rows:
+                    break
+                for row in rows:
+                    sheet.append(row)
+                counts[title] += len(rows)
+                written += len(rows)
+                if progress:
+                    progress(written)
+    workbook.save(output)
+    return {'students': counts['Students'], 'attendance': counts['Attendance Records']}
+
 
 def add_note(student_id: int, note_text: str, created_by: str = '') -> int:
     """Add a note to a student."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    with db_connection() as conn:
+        cursor = conn.cursor()
     
-    # Ensure notes table exists
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS notes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            student_id INTEGER NOT NULL,
-            note_text TEXT NOT NULL,
-            created_at TEXT NOT NULL,
-            created_by TEXT,
-            FOREIGN KEY (student_id) REFERENCES students(id)
-        )
-    ''')
+        created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     
-    created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        cursor.execute('''
+            INSERT INTO notes (student_id, note_text, created_at, created_by)
+            VALUES (?, ?, ?, ?)
+        ''', (student_id, note_text, created_at, created_by))
     
-    cursor.execute('''
-        INSERT INTO notes (student_id, note_text, created_at, created_by)
-        VALUES (?, ?, ?, ?)
-    ''', (student_id, note_text, created_at, created_by))
-    
-    note_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+        note_id = cursor.lastrowid
+        bump_data_version(conn, 'notes')
     
     return note_id
 
+STUDENT_NOTES = 'SELECT * FROM notes WHERE student_id = ? ORDER BY created_at DESC'
+
+
 def get_notes(student_id: int) -> List[Dict]:
     """Get all notes for a student."""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    # Ensure notes table exists
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS notes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            student_id INTEGER NOT NULL,
-            note_text TEXT NOT NULL,
-            created_at TEXT NOT NULL,
-            created_by TEXT,
-            FOREIGN KEY (student_id) REFERENCES students(id)
-        )
-    ''')
+    with db_connection(sqlite3.Row) as conn:
+        cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT * FROM notes 
-        WHERE student_id = ? 
-        ORDER BY created_at DESC
-    ''', (student_id,))
+        cursor.execute(STUDENT_NOTES, (student_id,))
     
-    notes = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+        notes = [dict(row) for row in cursor.fetchall()]
     return notes
 
 def get_student_details(student_id: int) -> Optional[Dict]:
     """Get full student details including attendance history and notes."""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    # Get student info
-    cursor.execute("SELECT * FROM students WHERE id = ?", (student_id,))
-    row = cursor.fetchone()
-    
-    if not row:
-        conn.close()
-        return None
+    with db_connection(sqlite3.Row) as conn:
+        cursor = conn.cursor()
     
-    student = dict(row)
-    student['alert_level'] = get_alert_level(student_id)
-    student['consecutive_absences'] = get_consecutive_absences(student_id)
-    
-    # Get attendance history
-    cursor.execute('''
-        SELECT date, status FROM attendance 
-        WHERE student_id = ? 
-        ORDER BY date DESC
-        LIMIT 20
-    ''', (student_id,))
-    student['attendance_history'] = [dict(r) for r in cursor.fetchall()]
+        # Get student info
+        cursor.execute("SELECT * FROM students WHERE id = ?", (student_id,))
+        row = cursor.fetchone()
     
-    # Get last attendance date
-    cursor.execute('''
-        SELECT date, status FROM attendance 
-        WHERE student_id = ? 
-        ORDER BY date DESC
-        LIMIT 1
-    ''', (student_id,))
-    last_att = cursor.fetchone()
-    student['last_attendance'] = dict(last_att) if last_att else None
+        if not row:
+            return None
     
-    conn.close()
+        student = dict(row)
+        absences, student['alert_level'] = get_absence_alerts([student_id]).get(student_id, (0, 'none'))
+        student['consecutive_absences'] = absences
+    
+        # Get attendance history
+        cursor.execute('''
+            SELECT date, status FROM attendance 
+            WHERE student_id = ? 
+            ORDER BY date DESC
+            LIMIT 20
+        ''', (student_id,))
+        student['attendance_history'] = [dict(r) for r in cursor.fetchall()]
+    
+        # Get last attendance date
+        cursor.execute('''
+            SELECT date, status FROM attendance 
+            WHERE student_id = ? 
+            ORDER BY date DESC
+            LIMIT 1
+        ''', (student_id,))
+        last_att = cursor.fetchone()
+        student['last_attendance'] = dict(last_att) if last_att else None
     
     # Get notes
     student['notes'] = get_notes(student_id)
     
     return student
 
-def get_students_by_servant(servant: str) -> List[Dict]:
-    """Get all students assigned to a specific servant."""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT * FROM students WHERE servant = ? ORDER BY name", (servant,))
+def get_students_by_servant(servant: str, scope: Optional[StudentScope] = None) -> List[Dict]:
+    """Get all students assigned to a specific servant (that `scope` allows)."""
+    visible, visible_params = _visibility(scope)
+    with db_connection(sqlite3.Row) as conn:
+        cursor = conn.cursor()
     
-    students = []
-    for row in cursor.fetchall():
-        student = dict(row)
-        # Normalize gender to M/F for frontend consistency
-        g = (student.get('gender') or '').lower()
-        if g in ('boy', 'boys', 'male'):
-            student['gender'] = 'M'
-        elif g in ('girl', 'girls', 'female'):
-            student['gender'] = 'F'
-        student['alert_level'] = get_alert_level(student['id'])
-        student['consecutive_absences'] = get_consecutive_absences(student['id'])
-        students.append(student)
+        cursor.execute(f"SELECT * FROM students WHERE servant = ? AND {visible} ORDER BY name", [servant] + visible_params)
     
-    conn.close()
+        students = []
+        for row in cursor.fetchall():
+            student = dict(row)
+            # Normalize gender to M/F for frontend consistency
+            g = (student.get('gender') or '').lower()
+            if g in ('boy', 'boys', 'male'):
+                student['gender'] = 'M'
+            elif g in ('girl', 'girls', 'female'):
+                student['gender'] = 'F'
+            students.append(student)
+    
+    _attach_alerts(students)
     return students
 
+
+# ==================== STUDENT SYNC ====================
+
+# student_changes journals the id of every student whose /api/students row may have
+# changed (filled by triggers, see _migration_student_changes). Sync clients keep the
+# last seq they applied and ask for the students changed after it.
+
+STUDENT_CHANGES_RETENTION_DAYS = 30
+
+
+def get_student_changes(since: Optional[int]) -> Tuple[int, Optional[List[int]]]:
+    """(latest seq, ids of students changed after `since`).
+
+    The ids are None when `since` is None or no longer covered by the journal (pruned,
+    or from another database), in which case the client needs a full roster.
+    """
+    with db_connection() as conn:
+        latest = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'student_changes'").fetchone()
+        latest = latest[0] if latest else 0
+        oldest = conn.execute('SELECT MIN(seq) FROM student_changes').fetchone()[0]
+        if since is None or since > latest or since < (oldest - 1 if oldest is not None else latest):
+            return latest, None
+        ids = [row[0] for row in conn.execute(
+            'SELECT DISTINCT student_id FROM student_changes WHERE seq > ? ORDER BY student_id', (since,))]
+    return latest, ids
+
+
+def prune_student_changes(days: int = STUDENT_CHANGES_RETENTION_DAYS) -> int:
+    """Drop journal entries older than `days`; clients behind them fall back to a full sync."""
+    with db_connection() as conn:
+        return conn.execute("DELETE FROM student_changes WHERE changed_at < datetime('now', ?)",
+                            (f'-{int(days)} days',)).rowcount
+
+
+# ==================== EXCEL IMPORT ====================
+
+# 'All Kids' sheet header -> students column. Headers are matched after trimming.
+STUDENT_SHEET_COLUMNS = {
+    'Name': 'name',
+    'Grade': 'grade',
+    'Gen': 'gender',
+    'Servant': 'servant',
+    'Phone number': 'phone',
+    'Parent Phone': 'parent_phone',
+    'DOB': 'dob',
+    'Address': 'address',
+    'Comments': 'comments',
+    'Pictures': 'pictures',
+    'Last Call/Visitation': 'last_call',
+    'Class': 'class_name',
+}
+STUDENT_IMPORT_FIELDS = ['name', 'grade', 'gender', 'servant', 'phone', 'parent_phone', 'dob',
+                         'address', 'comments', 'pictures', 'last_call', 'class_name', 'birth_month_day']
+GENDER_CODES = {'m': 'M', 'male': 'M', 'boy': 'M', 'boys': 'M', 'b': 'M',
+                'f': 'F', 'female': 'F', 'girl': 'F', 'girls': 'F', 'g': 'F'}
+IMPORT_CHUNK_ROWS = 2000
+
+
+def iter_sheet_frames(excel_path: str, sheet_name: str, chunk_rows: int = IMPORT_CHUNK_ROWS):
+    """Yield a worksheet as DataFrames of up to chunk_rows rows.
+
+    .xlsx files are streamed with openpyxl's read-only mode so memory stays flat;
+    anything openpyxl cannot open falls back to a single pandas read.
+    """
+    try:
+        from openpyxl import load_workbook
+        workbook = load_workbook(excel_path, read_only=True, data_only=True)
+    except Exception:
+        yield pd.read_excel(excel_path, sheet_name=sheet_name)
+        return
+    try:
+        rows = workbook[sheet_name].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [c if c is not None else f'Unnamed: {i}' for i, c in enumerate(header)]
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_rows:
+                yield pd.DataFrame(chunk, columns=columns)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=columns)
+    finally:
+        workbook.close()
+
+
+def excel_text(series: pd.Series) -> pd.Series:
+    """Cells as trimmed text: blanks become '', whole numbers lose a trailing '.0'."""
+    text = series.astype(str).str.strip().str.replace(r'^(-?\d+)\.0$', r'\1', regex=True)
+    return text.where(series.notna() & ~text.isin(['nan', 'NaT', 'None']), '')
+
+
+def normalize_student_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Map an 'All Kids' chunk onto students columns and normalize them column-wise."""
+    df = df.rename(columns=lambda c: STUDENT_SHEET_COLUMNS.get(str(c).strip(), c))
+    out = pd.DataFrame(index=df.index)
+    for field in STUDENT_IMPORT_FIELDS:
+        out[field] = excel_text(df[field]) if field in df.columns else ''
+
+    grade_values = {text: normalize_grade_value(text) for text in out['grade'].unique()}
+    out['grade'] = pd.Series([grade_values[text] for text in out['grade']], index=out.index, dtype=object)
+    out['gender'] = out['gender'].str.lower().map(GENDER_CODES).fillna(out['gender'])
+    dobs = {text: normalize_dob(text) for text in out['dob'].unique()}
+    out['birth_month_day'] = pd.Series([dobs[text][1] for text in out['dob']], index=out.index, dtype=object)
+    out['dob'] = pd.Series([dobs[text][0] for text in out['dob']], index=out.index, dtype=object)
+    class_names = {grade: grade_to_class_name(grade) for grade in grade_values.values()}
+    derived = pd.Series([class_names[grade] for grade in out['grade']], index=out.index, dtype=object)
+    out['class_name'] = out['class_name'].where(out['class_name'] != '', derived)
+    out['name_key'] = out['name'].str.lower()
+    return out
+
+
+def import_students_excel(excel_path: str, sheet_name: str = 'All Kids',
+                          progress: Optional[Callable[[int], None]] = None) -> Dict:
+    """Upsert the students sheet in one transaction.
+
+    Rows match existing students by case-insensitive name (every student with that name
+    is updated); the rest are inserted. Returns added, updated and skipped counts, where
+    skipped rows have no name or repeat a name seen earlier in the file (the later row wins).
+    progress, if given, is called with the number of sheet rows read after each chunk.
+    """
+    added = updated = skipped = rows_read = 0
+    seen = set()
+    with db_connection() as conn:
+        existing = pd.read_sql_query('SELECT id, lower(trim(name)) AS name_key FROM students', conn)
+        for frame in iter_sheet_frames(excel_path, sheet_name):
+            if 'Name' not in [str(c).strip() for c in frame.columns]:
+                raise ValueError(f"Sheet '{sheet_name}' has no Name column")
+            rows = normalize_student_frame(frame)
+            named = rows[rows['name'] != '']
+            deduped = named.drop_duplicates('name_key', keep='last')
+            repeats = deduped['name_key'].isin(seen)
+            skipped += (len(rows) - len(named)) + (len(named) - len(deduped)) + int(repeats.sum())
+            seen.update(deduped['name_key'])
+
+            matched = deduped.merge(existing, on='name_key', how='left')
+            found = matched[matched['id'].notna()]
+            new = matched[matched['id'].isna()].drop_duplicates('name_key')
+            updated += int((~repeats).sum()) - len(new)
+            added += len(new)
+
+            found_ids = [int(student_id) for student_id in found['id']]
+            shift_attendance_rollup(found_ids, -1)
+            conn.executemany(
+                f"UPDATE students SET {', '.join(f'{field} = ?' for field in STUDENT_IMPORT_FIELDS[1:])} WHERE id = ?",
+                [tuple(values) + (student_id,) for values, student_id in
+                 zip(found[STUDENT_IMPORT_FIELDS[1:]].itertuples(index=False, name=None), found_ids)])
+            shift_attendance_rollup(found_ids, 1)
+            last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM students').fetchone()[0]
+            conn.executemany(
+                f"INSERT INTO students ({', '.join(STUDENT_IMPORT_FIELDS)}) "
+                f"VALUES ({', '.join('?' for _ in STUDENT_IMPORT_FIELDS)})",
+                new[STUDENT_IMPORT_FIELDS].itertuples(index=False, name=None))
+            inserted = pd.read_sql_query('SELECT id, lower(trim(name)) AS name_key FROM students WHERE id > ?',
+                                         conn, params=(last_id,))
+            existing = pd.concat([existing, inserted], ignore_index=True)
+            rows_read += len(frame)
+            if progress:
+                progress(rows_read)
+        if added or updated:
+            bump_data_version(conn, 'students')
+    return {'added': added, 'updated': updated, 'skipped': skipped}
+
+
+def import_from_excel(excel_path: str):
+    """Import student data from Excel file."""
+    return import_students_excel(excel_path)
+
+
 def import_from_excel_upload(excel_path: str) -> Dict:
     """Import student data from an uploaded Excel file."""
-    conn = sqlite3.connect(DB_FILE)
-    
     try:
-        # Read the "All Kids" sheet
-        df = pd.read_excel(excel_path, sheet_name='All Kids')
-        
-        # Clean up the data
-        df = df.dropna(subset=['Name'])  # Remove rows without names
-        
-        added = 0
-        updated = 0
-        
-        # Prepare data for insertion
-        for _, row in df.iterrows():
-            name = str(row.get('Name', ''))
-            
-            # Check if student exists
-            cursor = conn.cursor()
-            cursor.execute("SELECT id FROM students WHERE name = ?", (name,))
-            existing = cursor.fetchone()
-            
-            if existing:
-                # Update existing
-                conn.execute('''
-                    UPDATE students SET
-                    grade = ?, gender = ?, servant = ?, phone = ?, parent_phone = ?,
-                    dob = ?, address = ?, comments = ?, pictures = ?, last_call = ?
-                    WHERE name = ?
-                ''', (
-                    int(row['Grade']) if pd.notna(row.get('Grade')) else None,
-                    str(row.get('Gen', '')),
-                    str(row.get('Servant', '')),
-                    str(row.get('Phone number', '')) if pd.notna(row.get('Phone number')) else '',
-                    str(row.get('Parent Phone', '')) if pd.notna(row.get('Parent Phone')) else '',
-                    str(row.get('DOB', '')) if pd.notna(row.get('DOB')) else '',
-                    str(row.get('Address ', '')) if pd.notna(row.get('Address ')) else '',
-                    str(row.get('Comments', '')) if pd.notna(row.get('Comments')) else '',
-                    str(row.get('Pictures', '')) if pd.notna(row.get('Pictures')) else '',
-                    str(row.get('Last Call/Visitation ', '')) if pd.notna(row.get('Last Call/Visitation ')) else '',
-                    name
-                ))
-                updated += 1
-            else:
-                # Insert new
-                conn.execute('''
-                    INSERT INTO students 
-                    (name, grade, gender, servant, phone, parent_phone, dob, address, comments, pictures, last_call)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    name,
-                    int(row['Grade']) if pd.notna(row.get('Grade')) else None,
-                    str(row.get('Gen', '')),
-                    str(row.get('Servant', '')),
-                    str(row.get('Phone number', '')) if pd.notna(row.get('Phone number')) else '',
-                    str(row.get('Parent Phone', '')) if pd.notna(row.get('Parent Phone')) else '',
-                    str(row.get('DOB', '')) if pd.notna(row.get('DOB')) else '',
-                    str(row.get('Address ', '')) if pd.notna(row.get('Address ')) else '',
-                    str(row.get('Comments', '')) if pd.notna(row.get('Comments')) else '',
-                    str(row.get('Pictures', '')) if pd.notna(row.get('Pictures')) else '',
-                    str(row.get('Last Call/Visitation ', '')) if pd.notna(row.get('Last Call/Visitation ')) else ''
-                ))
-                added += 1
-        
-        conn.commit()
-        conn.close()
-        
-        return {'success': True, 'added': added, 'updated': updated}
+        return {'success': True, **import_students_excel(excel_path)}
     except Exception as e:
-        conn.close()
         return {'success': False, 'error': str(e)}
 
 
+# Attendance sheet cell -> status. Blank cells mean no register was taken that day.
+ATTENDANCE_MARKS = {
+    'p': 'present', 'present': 'present', 'y': 'present', 'yes': 'present', 'x': 'present',
+    '1': 'present', 'true': 'present', '✓': 'present', '✔': 'present',
+    'a': 'absent', 'absent': 'absent', 'n': 'absent', 'no': 'absent', '0': 'absent', 'false': 'absent',
+}
+ATTENDANCE_IMPORT_BATCH = 5000
+
+
+def header_date(column) -> Optional[str]:
+    """ISO date for a date column header (a datetime cell or a date-only string), else None."""
+    if isinstance(column, datetime):
+        return column.strftime('%Y-%m-%d')
+    for fmt in ('%Y-%m-%d', '%m/%d/%Y', '%m/%d/%y', '%Y-%m-%d %H:%M:%S'):
+        try:
+            return datetime.strptime(str(column).strip(), fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    return None
+
+
+def attendance_sheet_names(excel_path: str) -> List[str]:
+    """Sheets in the workbook that hold a wide attendance register."""
+    workbook = pd.ExcelFile(excel_path)
+    try:
+        return [name for name in workbook.sheet_names if 'attendance' in name.lower()]
+    finally:
+        workbook.close()
+
+
+def import_attendance_history(excel_path: str, sheet_names: Optional[List[str]] = None,
+                              create_missing: bool = True,
+                              progress: Optional[Callable[[int], None]] = None) -> Dict:
+    """Load the wide attendance sheets (one column per Sunday) into attendance.
+
+    Each chunk is melted into (name, date, status) rows and matched to students by
+    case-insensitive name; unknown names become new students from the sheet's own
+    columns unless create_missing is False. Existing attendance rows are never
+    overwritten, so re-running the import is a no-op. Rows are written in
+    transactions of ATTENDANCE_IMPORT_BATCH so a long import never holds the write
+    lock for long; an interrupted import is finished by running it again. Streaks
+    are rebuilt for every student touched. Headers earlier than the column before
+    them are reported in out_of_order_dates, since they are usually typos in the
+    register. progress, if given, is called with the sheet rows read so far.
+    """
+    sheet_names = sheet_names if sheet_names is not None else attendance_sheet_names(excel_path)
+    result = {'sheets': sheet_names, 'records': 0, 'existing': 0, 'students_added': 0,
+              'unmatched': [], 'unknown_marks': 0, 'out_of_order_dates': []}
+    dates, touched = set(), set()
+    rows_read = 0
+    with db_connection() as conn:
+        existing = pd.read_sql_query(
+            'SELECT lower(trim(name)) AS name_key, MIN(id) AS student_id FROM students GROUP BY name_key', conn)
+    for sheet_name in sheet_names:
+        for frame in iter_sheet_frames(excel_path, sheet_name):
+            rows_read += len(frame)
+            date_columns = {column: header_date(column) for column in frame.columns}
+            date_columns = {column: iso for column, iso in date_columns.items() if iso}
+            if not date_columns:
+                continue
+            ordered = list(date_columns.values())
+            for previous, iso in zip(ordered, ordered[1:]):
+                if iso < previous and (sheet_name, iso) not in result['out_of_order_dates']:
+                    result['out_of_order_dates'].append((sheet_name, iso))
+
+            students = normalize_student_frame(frame.drop(columns=list(date_columns)))
+            students = students[students['name'] != '']
+            missing = students[~students['name_key'].isin(existing['name_key'])].drop_duplicates('name_key')
+            if len(missing) and create_missing:
+                with db_connection() as conn:
+                    last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM students').fetchone()[0]
+                    conn.executemany(
+                        f"INSERT INTO students ({', '.join(STUDENT_IMPORT_FIELDS)}) "
+                        f"VALUES ({', '.join('?' for _ in STUDENT_IMPORT_FIELDS)})",
+                        missing[STUDENT_IMPORT_FIELDS].itertuples(index=False, name=None))
+                    existing = pd.concat([existing, pd.read_sql_query(
+                        'SELECT lower(trim(name)) AS name_key, id AS student_id FROM students WHERE id > ?',
+                        conn, params=(last_id,))], ignore_index=True)
+                    bump_data_version(conn, 'students')
+                result['students_added'] += len(missing)
+            elif len(missing):
+                result['unmatched'].extend(n for n in missing['name'] if n not in result['unmatched'])
+
+            marks = frame.loc[students.index, list(date_columns)].rename(columns=date_columns)
+            marks['name_key'] = students['name_key']
+            long = marks.melt(id_vars='name_key', var_name='date', value_name='mark')
+            long['mark'] = excel_text(long['mark']).str.lower()
+            long = long[long['mark'] != '']
+            long['status'] = long['mark'].map(ATTENDANCE_MARKS)
+            result['unknown_marks'] += int(long['status'].isna().sum())
+            long = long[long['status'].notna()].merge(existing, on='name_key', how='inner')
+            long = long.drop_duplicates(['student_id', 'date'])
+
+            rows = [(int(sid), date, status) for sid, date, status in
+                    long[['student_id', 'date', 'status']].itertuples(index=False, name=None)]
+            for start in range(0, len(rows), ATTENDANCE_IMPORT_BATCH):
+                with db_connection() as conn:
+                    before = conn.total_changes
+                    conn.executemany(
+                        'INSERT INTO attendance (student_id, date, status) VALUES (?, ?, ?) '
+                        'ON CONFLICT(student_id, date) DO NOTHING',
+                        rows[start:start + ATTENDANCE_IMPORT_BATCH])
+                    inserted = conn.total_changes - before
+                    if inserted:
+                        bump_data_version(conn, 'attendance')
+                    result['records'] += inserted
+            result['existing'] += len(rows)
+            dates.update(long['date'])
+            touched.update(int(sid) for sid in long['student_id'].unique())
+            if progress:
+                progress(rows_read)
+    if touched:
+        rebuild_student_streaks(touched)
+    if dates:
+        # Recount every matched date, not only when this run inserted rows: a rerun after
+        # an interrupted import inserts nothing, but its committed batches were never counted.
+        rebuild_attendance_rollup(dates)
+    result['existing'] -= result['records']
+    result['dates'] = len(dates)
+    result['first_date'] = min(dates) if dates else None
+    result['last_date'] = max(dates) if dates else None
+    return result
+
+
 # ==================== POINTS ENGINE ====================
 
-def calculate_and_award_points(student_id: int, date: str, is_present: int, liturgy: int,
-                                tonia: int, confession: int, bible_prayer: int, questions: int) -> int:
-    """Calculate points earned for this attendance record. Returns total points earned."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    total_points = 0
-    reasons = []
-
-    if tonia:
-        total_points += 1
-        reasons.append('+1 Music/Tonia')
-
-    if questions and questions > 0:
-        total_points += int(questions)
-        reasons.append(f'+{questions} Questions')
-
-    if confession:
-        month_start = date[:7] + '-01'
-        cursor.execute('''SELECT SUM(points_change) FROM points_history
-            WHERE student_id=? AND reason LIKE '%Confession%' AND date >= ? AND date <= ?''',
-            (student_id, month_start, date))
-        already = cursor.fetchone()[0] or 0
-        if already == 0:
-            total_points += 10
-            reasons.append('+10 Confession')
+# Award rules written by the points engine. Each award is its own points_history
+# row carrying rule_code and a period_key; uq_points_history_rule allows one row
+# per (student, rule, period), which makes re-scoring a record idempotent.
+AWARD_LABELS = {
+    'TONIA': 'Music/Tonia',
+    'QUESTIONS': 'Questions',
+    'CONFESSION': 'Confession',
+    'SS_STREAK_4': 'Sunday School 4-week streak',
+    'SS_STREAK_3': 'Sunday School 3-week streak',
+    'LITURGY_STREAK_4': 'Liturgy 4-week streak',
+    'LITURGY_STREAK_3': 'Liturgy 3-week streak',
+    'BIBLE_WEEKLY': 'Bible/Prayer weekly',
+}
+
+# Points per award (per question for QUESTIONS). After changing a value, run
+# replay_points.py to recompute history and balances from attendance.
+POINT_VALUES = {
+    'TONIA': 1,
+    'QUESTIONS': 1,
+    'CONFESSION': 10,
+    'SS_STREAK_4': 15,
+    'SS_STREAK_3': 10,
+    'LITURGY_STREAK_4': 15,
+    'LITURGY_STREAK_3': 10,
+    'BIBLE_WEEKLY': 15,
+}
+
+
+def award_period_key(rule_code: str, date: str) -> str:
+    """Period an award counts against: the month for confession, the week (Monday) for
+    Bible/Prayer, otherwise the attendance date itself."""
+    if rule_code == 'CONFESSION':
+        return date[:7]
+    if rule_code == 'BIBLE_WEEKLY':
+        d = datetime.strptime(date, '%Y-%m-%d')
+        return (d - timedelta(days=d.weekday())).strftime('%Y-%m-%d')
+    return date
+
+
+def parse_award_reason(reason: str, date: str) -> Optional[List[Tuple[str, int, str]]]:
+    """Split an engine-written reason such as '+1 Music/Tonia, +10 Confession' into
+    (rule_code, points, period_key) parts. Returns None for free-text reasons."""
+    codes = {label: code for code, label in AWARD_LABELS.items()}
+    parts = []
+    for part in (reason or '').split(', '):
+        points, _, label = part.partition(' ')
+        if label not in codes or not points.startswith('+') or not points[1:].isdigit():
+            return None
+        try:
+            period_key = award_period_key(codes[label], date)
+        except (TypeError, ValueError):
+            return None
+        parts.append((codes[label], int(points[1:]), period_key))
+    return parts
+
+
+AWARD_LOOKUP = '''
+    SELECT student_id, rule_code, MAX(period_key) FROM points_history
+    WHERE student_id IN (SELECT value FROM json_each(?))
+      AND rule_code IN ('SS_STREAK_4', 'SS_STREAK_3', 'LITURGY_STREAK_4', 'LITURGY_STREAK_3')
+    GROUP BY student_id, rule_code
+    UNION ALL
+    SELECT student_id, rule_code, period_key FROM points_history
+    WHERE student_id IN (SELECT value FROM json_each(?))
+      AND (rule_code, period_key) IN (VALUES ('TONIA', ?), ('QUESTIONS', ?), ('CONFESSION', ?), ('BIBLE_WEEKLY', ?))
+'''
+
+RECENT_STREAK_DATES = '''
+    SELECT student_id, kind, COUNT(*), MIN(date) FROM (
+        SELECT student_id, date, 'SS' AS kind,
+               ROW_NUMBER() OVER (PARTITION BY student_id ORDER BY date DESC) AS rn
+        FROM attendance
+        WHERE student_id IN (SELECT value FROM json_each(?)) AND date < ? AND status = 'present'
+        UNION ALL
+        SELECT student_id, date, 'LITURGY' AS kind,
+               ROW_NUMBER() OVER (PARTITION BY student_id ORDER BY date DESC) AS rn
+        FROM attendance
+        WHERE student_id IN (SELECT value FROM json_each(?)) AND date < ? AND liturgy = 1
+    )
+    WHERE rn <= 3
+    GROUP BY student_id, kind
+'''
+
+BIBLE_WEEK_DAYS = ('SELECT student_id, days_read FROM bible_tracking '
+                   'WHERE week_start_date = ? AND student_id IN (SELECT value FROM json_each(?))')
+
+
+def _streak_rule(kind: str, recent: Optional[Tuple[int, str]], awarded: Dict):
+    """Pick the 4-week or 3-week streak award, given the count and oldest of the last three
+    earlier dates. A streak award is skipped if one was given on or after that oldest date."""
+    count, cutoff = recent or (0, None)
+    streak = 1 + count
+    if streak >= 4:
+        code = f'{kind}_STREAK_4'
+    elif streak == 3:
+        code = f'{kind}_STREAK_3'
+    else:
+        return None
+    last = awarded.get(code)
+    return (code, POINT_VALUES[code]) if last is None or last < cutoff else None
+
+
+def _score_record(record: Tuple, periods: Dict[str, str], awarded: Dict[str, str],
+                  recent_present: Optional[Tuple[int, str]], recent_liturgy: Optional[Tuple[int, str]],
+                  bible_days: int) -> List[Tuple[str, int]]:
+    """Apply the point rules to one attendance record. Returns [(rule_code, points)].
+
+    awarded maps rule_code to the student's latest period_key for that rule, recent_* is the
+    (count, oldest date) of the last three earlier present / liturgy dates, and bible_days is
+    the week's Bible/Prayer day count including this record.
+    """
+    _, is_present, liturgy, tonia, confession, bible_prayer, questions = record
+    earned = []
+
+    if tonia and awarded.get('TONIA') != periods['TONIA']:
+        earned.append(('TONIA', POINT_VALUES['TONIA']))
+
+    if questions and questions > 0 and awarded.get('QUESTIONS') != periods['QUESTIONS']:
+        earned.append(('QUESTIONS', int(questions) * POINT_VALUES['QUESTIONS']))
+
+    if confession and awarded.get('CONFESSION') != periods['CONFESSION']:
+        earned.append(('CONFESSION', POINT_VALUES['CONFESSION']))
 
     if is_present:
-        cursor.execute('''SELECT date FROM attendance
-            WHERE student_id=? AND date < ? AND status='present'
-            ORDER BY date DESC LIMIT 3''', (student_id, date))
-        recent = cursor.fetchall()
-        streak = 1 + len(recent)
-        if streak >= 4:
-            cutoff = recent[-1][0] if recent else date
-            cursor.execute('''SELECT COUNT(*) FROM points_history
-                WHERE student_id=? AND reason LIKE '%Sunday School 4-week%' AND date >= ?''', (student_id, cutoff))
-            if (cursor.fetchone()[0] or 0) == 0:
-                total_points += 15
-                reasons.append('+15 Sunday School 4-week streak')
-        elif streak == 3:
-            cutoff = recent[-1][0] if recent else date
-            cursor.execute('''SELECT COUNT(*) FROM points_history
-                WHERE student_id=? AND reason LIKE '%Sunday School 3-week%' AND date >= ?''', (student_id, cutoff))
-            if (cursor.fetchone()[0] or 0) == 0:
-                total_points += 10
-                reasons.append('+10 Sunday School 3-week streak')
+        rule = _streak_rule('SS', recent_present, awarded)
+        if rule:
+            earned.append(rule)
 
     if liturgy:
-        cursor.execute('''SELECT date FROM attendance
-            WHERE student_id=? AND date < ? AND liturgy=1
-            ORDER BY date DESC LIMIT 3''', (student_id, date))
-        recent_l = cursor.fetchall()
-        l_streak = 1 + len(recent_l)
-        if l_streak >= 4:
-            cutoff = recent_l[-1][0] if recent_l else date
-            cursor.execute('''SELECT COUNT(*) FROM points_history
-                WHERE student_id=? AND reason LIKE '%Liturgy 4-week%' AND date >= ?''', (student_id, cutoff))
-            if (cursor.fetchone()[0] or 0) == 0:
-                total_points += 15
-                reasons.append('+15 Liturgy 4-week streak')
-        elif l_streak == 3:
-            cutoff = recent_l[-1][0] if recent_l else date
-            cursor.execute('''SELECT COUNT(*) FROM points_history
-                WHERE student_id=? AND reason LIKE '%Liturgy 3-week%' AND date >= ?''', (student_id, cutoff))
-            if (cursor.fetchone()[0] or 0) == 0:
-                total_points += 10
-                reasons.append('+10 Liturgy 3-week streak')
-
-    if bible_prayer:
-        d = datetime.strptime(date, '%Y-%m-%d')
-        week_start = (d - timedelta(days=d.weekday())).strftime('%Y-%m-%d')
-        cursor.execute('SELECT days_read FROM bible_tracking WHERE student_id=? AND week_start_date=?',
-                       (student_id, week_start))
-        row = cursor.fetchone()
-        days = (row[0] if row else 0) + 1
-        if row:
-            cursor.execute('UPDATE bible_tracking SET days_read=? WHERE student_id=? AND week_start_date=?',
-                           (days, student_id, week_start))
-        else:
-            cursor.execute('INSERT INTO bible_tracking (student_id, week_start_date, days_read) VALUES (?,?,?)',
-                           (student_id, week_start, days))
-        if days >= 7:
-            cursor.execute('''SELECT COUNT(*) FROM points_history
-                WHERE student_id=? AND reason LIKE '%Bible/Prayer weekly%' AND date >= ?''',
-                (student_id, week_start))
-            if (cursor.fetchone()[0] or 0) == 0:
-                total_points += 15
-                reasons.append('+15 Bible/Prayer weekly')
-
-    if total_points > 0:
-        reason_str = ', '.join(reasons)
-        cursor.execute('INSERT INTO points_history (student_id, points_change, reason, date) VALUES (?,?,?,?)',
-                       (student_id, total_points, reason_str, date))
-        cursor.execute('UPDATE students SET points = COALESCE(points,0) + ? WHERE id=?',
-                       (total_points, student_id))
+        rule = _streak_rule('LITURGY', recent_liturgy, awarded)
+        if rule:
+            earned.append(rule)
+
+    if bible_prayer and bible_days >= 7 and awarded.get('BIBLE_WEEKLY') != periods['BIBLE_WEEKLY']:
+        earned.append(('BIBLE_WEEKLY', POINT_VALUES['BIBLE_WEEKLY']))
+
+    # A rule worth 0 points is switched off and leaves no history row.
+    return [(code, points) for code, points in earned if points > 0]
 
-    conn.commit()
-    conn.close()
-    return total_points
+
+def _evaluate_points_round(conn, date: str, records: List[Tuple]) -> List[int]:
+    """Evaluate records for distinct students on one date with a fixed number of queries."""
+    ids = json.dumps([r[0] for r in records])
+    periods = {code: award_period_key(code, date) for code in AWARD_LABELS}
+
+    awarded = {}
+    for sid, code, period in conn.execute(AWARD_LOOKUP, (
+            ids, ids, periods['TONIA'], periods['QUESTIONS'], periods['CONFESSION'], periods['BIBLE_WEEKLY'])):
+        awarded.setdefault(sid, {})[code] = period
+    recent = {(sid, kind): (count, oldest)
+              for sid, kind, count, oldest in conn.execute(RECENT_STREAK_DATES, (ids, date, ids, date))}
+    bible_ids = json.dumps([r[0] for r in records if r[5]])
+    bible_days = dict(conn.execute(BIBLE_WEEK_DAYS, (periods['BIBLE_WEEKLY'], bible_ids)))
+
+    results, awards, totals, bible_updates, bible_inserts = [], [], [], [], []
+    for record in records:
+        student_id, bible_prayer = record[0], record[5]
+        days = 0
+        if bible_prayer:
+            days = (bible_days.get(student_id) or 0) + 1
+            if student_id in bible_days:
+                bible_updates.append((days, student_id, periods['BIBLE_WEEKLY']))
+            else:
+                bible_inserts.append((student_id, periods['BIBLE_WEEKLY'], days))
+
+        earned = _score_record(record, periods, awarded.get(student_id, {}),
+                               recent.get((student_id, 'SS')), recent.get((student_id, 'LITURGY')), days)
+        for code, points in earned:
+            awards.append((student_id, points, f'+{points} {AWARD_LABELS[code]}', date, code, periods[code]))
+        total_points = sum(points for _, points in earned)
+        if total_points > 0:
+            totals.append((total_points, student_id))
+        results.append(total_points)
+
+    conn.executemany('UPDATE bible_tracking SET days_read=? WHERE student_id=? AND week_start_date=?',
+                     bible_updates)
+    conn.executemany('INSERT INTO bible_tracking (student_id, week_start_date, days_read) VALUES (?,?,?)',
+                     bible_inserts)
+    conn.executemany('''INSERT INTO points_history (student_id, points_change, reason, date, rule_code, period_key)
+                        VALUES (?,?,?,?,?,?)''', awards)
+    conn.executemany('UPDATE students SET points = COALESCE(points,0) + ? WHERE id=?', totals)
+    if totals:
+        bump_data_version(conn, 'points')
+    if bible_updates or bible_inserts:
+        bump_data_version(conn, 'bible_tracking')
+    return results
+
+
+def evaluate_points(date: str, records: List[Tuple]) -> List[int]:
+    """Award points for many attendance records on one date.
+
+    Each record is (student_id, is_present, liturgy, tonia, confession, bible_prayer, questions).
+    A student appearing twice is evaluated again in a later round so it sees the first award,
+    exactly as consecutive calls would. Returns the points earned per record, in order.
+    """
+    results = [0] * len(records)
+    pending = list(enumerate(records))
+    with db_connection() as conn:
+        while pending:
+            batch, later, seen = [], [], set()
+            for index, record in pending:
+                (later if record[0] in seen else batch).append((index, record))
+                seen.add(record[0])
+            points = _evaluate_points_round(conn, date, [record for _, record in batch])
+            for (index, _), earned in zip(batch, points):
+                results[index] = earned
+            pending = later
+    return results
+
+
+def calculate_and_award_points(student_id: int, date: str, is_present: int, liturgy: int,
+                                tonia: int, confession: int, bible_prayer: int, questions: int) -> int:
+    """Calculate points earned for this attendance record. Returns total points earned."""
+    return evaluate_points(date, [(student_id, is_present, liturgy, tonia, confession, bible_prayer, questions)])[0]
+
+
+def award_points_for_dates(date_from: str, date_to: Optional[str] = None,
+                           student_ids: Optional[Iterable[int]] = None) -> Dict:
+    """Evaluate every saved attendance record between two dates, one date at a time in order.
+
+    Awards are deduplicated by rule and period, but every run adds another Bible/Prayer day
+    to bible_tracking, so only run this over dates whose records have not been evaluated yet
+    (for example after a historical import).
+    """
+    scope_sql, scope_params = _student_scope(student_ids)
+    with db_connection() as conn:
+        rows = conn.execute(f'''
+            SELECT date, student_id, CASE WHEN status = 'present' THEN 1 ELSE 0 END,
+                   COALESCE(liturgy, 0), COALESCE(tonia, 0), COALESCE(confession, 0),
+                   COALESCE(bible_prayer, 0), COALESCE(questions, 0)
+            FROM attendance
+            WHERE date >= ? AND date <= ? AND student_id IN ({scope_sql})
+            ORDER BY date, id
+        ''', (date_from, date_to or date_from) + scope_params).fetchall()
+        by_date = {}
+        for date, *record in rows:
+            by_date.setdefault(date, []).append(tuple(record))
+        total = 0
+        for date, records in by_date.items():
+            total += sum(evaluate_points(date, records))
+    return {'dates': len(by_date), 'records': len(rows), 'points': total}
+
+
+def replay_points(apply: bool = False) -> Dict:
+    """Recompute every rule-coded award from the attendance history and diff it against
+    points_history and students.points.
+
+    Attendance is replayed per student in date order entirely in memory, applying the same
+    rules as evaluate_points with the current POINT_VALUES. Bible/Prayer days are counted
+    from attendance only; bible_tracking is not changed. Manual and redemption entries (no
+    rule_code) are kept, and expected balances are their sum plus the replayed awards.
+    With apply=True the award rows and balances are rewritten in one transaction.
+    """
+    with db_connection() as conn:
+        rows = conn.execute('''
+            SELECT a.student_id, a.date, CASE WHEN a.status = 'present' THEN 1 ELSE 0 END,
+                   COALESCE(a.liturgy, 0), COALESCE(a.tonia, 0), COALESCE(a.confession, 0),
+                   COALESCE(a.bible_prayer, 0), COALESCE(a.questions, 0)
+            FROM attendance a JOIN students s ON s.id = a.student_id
+            ORDER BY a.student_id, a.date
+        ''').fetchall()
+
+        expected = {}
+        period_cache = {}
+        current_student = None
+        for student_id, date, *flags in rows:
+            if student_id != current_student:
+                current_student = student_id
+                awarded, present_dates, liturgy_dates, bible_weeks = {}, [], [], {}
+            periods = period_cache.get(date)
+            if periods is None:
+                periods = period_cache[date] = {code: award_period_key(code, date) for code in AWARD_LABELS}
+            is_present, liturgy, bible_prayer = flags[0], flags[1], flags[4]
+            days = 0
+            if bible_prayer:
+                days = bible_weeks[periods['BIBLE_WEEKLY']] = bible_weeks.get(periods['BIBLE_WEEKLY'], 0) + 1
+            recent_present = (len(present_dates[-3:]), present_dates[-3:][0]) if present_dates else None
+            recent_liturgy = (len(liturgy_dates[-3:]), liturgy_dates[-3:][0]) if liturgy_dates else None
+            for code, points in _score_record((student_id, *flags), periods, awarded,
+                                              recent_present, recent_liturgy, days):
+                expected[(student_id, code, periods[code])] = (points, date)
+                awarded[code] = periods[code]
+            if is_present:
+                present_dates.append(date)
+            if liturgy:
+                liturgy_dates.append(date)
+
+        current = {}
+        manual_totals = {}
+        for row_id, student_id, points, date, code, period_key in conn.execute(
+                'SELECT id, student_id, points_change, date, rule_code, period_key FROM points_history'):
+            if code is None:
+                manual_totals[student_id] = manual_totals.get(student_id, 0) + (points or 0)
+            else:
+                current[(student_id, code, period_key)] = (row_id, points, date)
+
+        added = [key for key in expected if key not in current]
+        removed = [key for key in current if key not in expected]
+        changed = [key for key in expected if key in current and current[key][1:] != expected[key]]
+
+        expected_totals = dict(manual_totals)
+        for (student_id, _, _), (points, _) in expected.items():
+            expected_totals[student_id] = expected_totals.get(student_id, 0) + points
+        balances = []
+        for student_id, points in conn.execute('SELECT id, COALESCE(points, 0) FROM students ORDER BY id'):
+            target = expected_totals.get(student_id, 0)
+            if target != points:
+                balances.append({'student_id': student_id, 'current': points,
+                                 'expected': target, 'delta': target - points})
+
+        if apply:
+            conn.executemany('DELETE FROM points_history WHERE id = ?', [(current[key][0],) for key in removed])
+            conn.executemany(
+                'UPDATE points_history SET points_change = ?, reason = ?, date = ? WHERE id = ?',
+                [(expected[key][0], f'+{expected[key][0]} {AWARD_LABELS[key[1]]}', expected[key][1], current[key][0])
+                 for key in changed])
+            conn.executemany(
+                'INSERT INTO points_history (student_id, points_change, reason, date, rule_code, period_key) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(key[0], expected[key][0], f'+{expected[key][0]} {AWARD_LABELS[key[1]]}', expected[key][1], key[1], key[2])
+                 for key in added])
+            conn.executemany('UPDATE students SET points = ? WHERE id = ?',
+                             [(b['expected'], b['student_id']) for b in balances])
+            bump_data_version(conn, 'points')
+
+    def describe(key):
+        return {'student_id': key[0], 'rule_code': key[1], 'period_key': key[2],
+                'current': current[key][1] if key in current else 0,
+                'expected': expected[key][0] if key in expected else 0}
+
+    return {
+        'records': len(rows),
+        'added': [describe(key) for key in added],
+        'removed': [describe(key) for key in removed],
+        'changed': [describe(key) for key in changed],
+        'balances': balances,
+        'applied': apply,
+    }
+
+STUDENT_POINTS_HISTORY = 'SELECT * FROM points_history WHERE student_id=? ORDER BY date DESC LIMIT 50'
 
 
 def get_student_points(student_id: int) -> Dict:
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute('SELECT points FROM students WHERE id=?', (student_id,))
-    row = cursor.fetchone()
-    total = row['points'] if row else 0
-    cursor.execute('SELECT * FROM points_history WHERE student_id=? ORDER BY date DESC LIMIT 50', (student_id,))
-    history = [dict(r) for r in cursor.fetchall()]
-    conn.close()
+    with db_connection(sqlite3.Row) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT points FROM students WHERE id=?', (student_id,))
+        row = cursor.fetchone()
+        total = row['points'] if row else 0
+        cursor.execute(STUDENT_POINTS_HISTORY, (student_id,))
+        history = [dict(r) for r in cursor.fetchall()]
     return {'total_points': total, 'history': history}
 
 
-def get_all_students_points() -> List[Dict]:
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, name, servant, class_name, grade, gender, phone, parent_phone, COALESCE(points,0) as points FROM students ORDER BY points DESC')
-    rows = [dict(r) for r in cursor.fetchall()]
-    conn.close()
+def get_all_students_points(scope: Optional[StudentScope] = None) -> List[Dict]:
+    visible, params = _visibility(scope)
+    with db_connection(sqlite3.Row) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT id, name, servant, class_name, grade, gender, phone, parent_phone, COALESCE(points,0) as points FROM students WHERE {visible} ORDER BY points DESC, id', params)
+        rows = [dict(r) for r in cursor.fetchall()]
     return rows
 
 
+# Class a student is ranked and totalled under, matching the rewards screen:
+# class name, else the class for their grade, else their servant.
+LEADERBOARD_CLASS = ("COALESCE(NULLIF(class_name, ''), NULLIF(grade_class_name(grade), ''), "
+                     "NULLIF(servant, ''), 'Unassigned')")
+LEADERBOARD_CACHE_SIZE = 64
+_leaderboard_cache = {}
+_leaderboard_lock = threading.Lock()
+
+
+def _leaderboard_queries(servant_filter: str = None, class_name: str = None, limit: Optional[int] = None,
+                         offset: int = 0, per_class: bool = False,
+                         scope: Optional[StudentScope] = None) -> Tuple[str, list, str, list]:
+    """(page SQL, params, per-class totals SQL, params) of get_points_leaderboard."""
+    where, params = _servant_scope(servant_filter)
+    if class_name:
+        where += f' AND {LEADERBOARD_CLASS} = ?'
+        params.append(class_name)
+    scoped = f'''
+        SELECT id, name, servant, class_name, grade, gender, phone, parent_phone,
+               COALESCE(points, 0) AS points, {LEADERBOARD_CLASS} AS class_key
+        FROM students WHERE {where}
+    '''
+    ranked = f'''
+        SELECT *, RANK() OVER (ORDER BY points DESC) AS rank,
+               RANK() OVER (PARTITION BY class_key ORDER BY points DESC) AS class_rank
+        FROM ({scoped})
+    '''
+    visible, visible_params = _visibility(scope)
+    if per_class:
+        query = f'SELECT * FROM ({ranked}) WHERE {visible} AND class_rank > ?'
+        page = visible_params + [offset]
+        if limit is not None:
+            query += ' AND class_rank <= ?'
+            page.append(offset + limit)
+        query += ' ORDER BY class_key, class_rank, name'
+    else:
+        query = f'SELECT * FROM ({ranked}) WHERE {visible} ORDER BY rank, name LIMIT ? OFFSET ?'
+        page = visible_params + [-1 if limit is None else limit, offset]
+
+    classes = (f'SELECT class_key, COUNT(*), SUM(points) FROM ({scoped}) WHERE {visible} '
+               'GROUP BY class_key ORDER BY SUM(points) DESC')
+    return query, params + page, classes, params + visible_params
+
+
+def get_points_leaderboard(servant_filter: str = None, class_name: str = None, limit: Optional[int] = None,
+                           offset: int = 0, per_class: bool = False, scope: Optional[StudentScope] = None) -> Dict:
+    """Students ranked by points with RANK() overall and within their class.
+
+    servant_filter scopes students like get_students; class_name keeps one class.
+    Without per_class, returns rows limit/offset of the overall ranking; with it, the
+    same slice of every class's ranking (top-K per class). Totals cover the whole scope.
+    A user `scope` keeps only the students it allows, still ranked among everyone.
+    Results are cached until the points or students data version changes; treat them
+    as read-only.
+    """
+    cache_key = (get_data_versions('points', 'students'), DB_FILE,
+                 servant_filter, class_name, limit, offset, per_class, scope.key if scope else None)
+    with _leaderboard_lock:
+        cached = _leaderboard_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    query, params, classes_query, classes_params = _leaderboard_queries(servant_filter, class_name, limit,
+                                                                        offset, per_class, scope)
+    with db_connection(sqlite3.Row) as conn:
+        students = [dict(r) for r in conn.execute(query, params)]
+        classes = [{'class_name': key, 'students': count, 'points': points}
+                   for key, count, points in conn.execute(classes_query, classes_params)]
+    result = {
+        'students': students,
+        'classes': classes,
+        'total_students': sum(c['students'] for c in classes),
+        'total_points': sum(c['points'] for c in classes),
+        'limit': limit,
+        'offset': offset,
+    }
+    with _leaderboard_lock:
+        if len(_leaderboard_cache) >= LEADERBOARD_CACHE_SIZE:
+            _leaderboard_cache.clear()
+        _leaderboard_cache[cache_key] = result
+    return result
+
 def add_manual_points(student_id: int, points: int, reason: str, date: str) -> bool:
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO points_history (student_id, points_change, reason, date) VALUES (?,?,?,?)',
-                   (student_id, points, reason, date))
-    cursor.execute('UPDATE students SET points = COALESCE(points,0) + ? WHERE id=?', (points, student_id))
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('INSERT INTO points_history (student_id, points_change, reason, date) VALUES (?,?,?,?)',
+                       (student_id, points, reason, date))
+        cursor.execute('UPDATE students SET points = COALESCE(points,0) + ? WHERE id=?', (points, student_id))
+        bump_data_version(conn, 'points')
     return True
 
 
-def clear_points_for_redemption(servant_filter: str = None) -> int:
-    """Zero current points. History is KEPT. Returns number of students cleared."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+def clear_points_for_redemption(servant_filter: str = None) -> Dict:
+    """Zero current points. History is KEPT.
+
+    One INSERT ... SELECT writes a redemption row per student and one UPDATE zeroes them.
+    Returns the students cleared, points redeemed and the same totals per class.
+    """
+    scope, params = _servant_scope(servant_filter)
+    scope += ' AND COALESCE(points,0) > 0'
     today = datetime.now().strftime('%Y-%m-%d')
-    if servant_filter:
-        class_grades = class_grade_values(servant_filter)
-        query = 'SELECT id, points FROM students WHERE (servant=? OR class_name=?'
-        params = [servant_filter, servant_filter]
-        if class_grades:
-            placeholders = ','.join(['?' for _ in class_grades])
-            query += f' OR grade IN ({placeholders})'
-            params.extend(class_grades)
-        query += ') AND COALESCE(points,0) > 0'
-        cursor.execute(query, params)
-    else:
-        cursor.execute('SELECT id, points FROM students WHERE COALESCE(points,0) > 0')
-    rows = cursor.fetchall()
-    count = 0
-    for sid, pts in rows:
-        cursor.execute('INSERT INTO points_history (student_id, points_change, reason, date) VALUES (?,?,?,?)',
-                       (sid, -pts, 'Points Redeemed (Cleared)', today))
-        cursor.execute('UPDATE students SET points=0 WHERE id=?', (sid,))
-        count += 1
-    conn.commit()
-    conn.close()
-    return count
+    with db_connection() as conn:
+        totals = conn.execute(f'''SELECT class_name, grade, COUNT(*), SUM(points) FROM students
+                                 WHERE {scope} GROUP BY class_name, grade''', params).fetchall()
+        conn.execute(f'''INSERT INTO points_history (student_id, points_change, reason, date)
+                         SELECT id, -points, 'Points Redeemed (Cleared)', ? FROM students WHERE {scope}''',
+                     [today] + params)
+        conn.execute(f'UPDATE students SET points = 0 WHERE {scope}', params)
+        bump_data_version(conn, 'points')
+
+    classes = {}
+    for class_name, grade, students, points in totals:
+        key = class_name or grade_to_class_name(grade) or 'Unassigned'
+        bucket = classes.setdefault(key, {'class_name': key, 'students': 0, 'points': 0})
+        bucket['students'] += students
+        bucket['points'] += points
+    return {
+        'cleared_count': sum(c['students'] for c in classes.values()),
+        'points_redeemed': sum(c['points'] for c in classes.values()),
+        'classes': sorted(classes.values(), key=lambda c: (grade_sort_key(c['class_name']), c['class_name'])),
+    }
 
 
 # ==================== ANNOUNCEMENTS ====================
 
 def add_announcement(title: str, body: str, created_by: str, attachment_path: str = '') -> int:
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO announcements (title, body, attachment_path, created_by) VALUES (?,?,?,?)',
-                   (title, body, attachment_path, created_by))
-    aid = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('INSERT INTO announcements (title, body, attachment_path, created_by) VALUES (?,?,?,?)',
+                       (title, body, attachment_path, created_by))
+        aid = cursor.lastrowid
+        bump_data_version(conn, 'announcements')
     return aid
 
 
 def get_announcements() -> List[Dict]:
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM announcements ORDER BY created_at DESC')
-    rows = [dict(r) for r in cursor.fetchall()]
-    conn.close()
+    with db_connection(sqlite3.Row) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM announcements ORDER BY created_at DESC')
+        rows = [dict(r) for r in cursor.fetchall()]
     return rows
 
 
 def delete_announcement(ann_id: int) -> bool:
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM announcements WHERE id=?', (ann_id,))
-    deleted = cursor.rowcount > 0
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM announcements WHERE id=?', (ann_id,))
+        deleted = cursor.rowcount > 0
+        if deleted:
+            bump_data_version(conn, 'announcements')
     return deleted
 
 
 # ==================== BIRTHDAYS ====================
 
-def get_upcoming_birthdays(days_ahead: int = 30) -> List[Dict]:
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name, dob, servant, class_name, grade, gender, phone, parent_phone FROM students WHERE dob IS NOT NULL AND dob != ''")
-    students = cursor.fetchall()
-    conn.close()
-    today = datetime.now()
+DOB_FORMATS = ('%Y-%m-%d', '%m/%d/%Y', '%d/%m/%Y')
+
+
+def parse_dob(value) -> Optional[_date]:
+    """Date of birth from ISO, m/d/Y or d/m/Y text (ambiguous dates read as m/d/Y), or None."""
+    text = str(value or '').strip()[:10]
+    for fmt in DOB_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def normalize_dob(value) -> Tuple[Optional[str], Optional[str]]:
+    """(dob, birth_month_day) to store: the ISO date and its 'MM-DD' key, or the value
+    as given and None when it is not a date."""
+    parsed = parse_dob(value)
+    if parsed is None:
+        return value, None
+    return parsed.isoformat(), parsed.strftime('%m-%d')
+
+
+def next_birthday(month_day: str, today: _date) -> _date:
+    """First birthday on or after today; Feb 29 birthdays fall on Feb 28 in other years."""
+    month, day = int(month_day[:2]), int(month_day[3:])
+    for year in (today.year, today.year + 1):
+        try:
+            birthday = _date(year, month, day)
+        except ValueError:
+            birthday = _date(year, 2, 28)
+        if birthday >= today:
+            return birthday
+    return birthday
+
+
+def _birthdays_query(days_ahead: int, today: _date, scope: Optional[StudentScope] = None) -> Tuple[str, list]:
+    """SQL + params of get_upcoming_birthdays for the window starting today."""
+    visible, params = _visibility(scope)
+    query = f'''SELECT id, name, dob, birth_month_day, servant, class_name, grade, gender, phone, parent_phone
+                FROM students WHERE birth_month_day IS NOT NULL AND {visible}'''
+    if days_ahead < 364:
+        # The window wraps past Dec 31 when it ends on an earlier month-day than it starts.
+        # One extra day keeps Feb 29 birthdays that land on Feb 28; days_until trims it.
+        start = today.strftime('%m-%d')
+        end = (today + timedelta(days=days_ahead + 1)).strftime('%m-%d')
+        query += f" AND (birth_month_day >= ? {'AND' if start <= end else 'OR'} birth_month_day <= ?)"
+        params += [start, end]
+    return query + ' ORDER BY id', params
+
+
+def get_upcoming_birthdays(days_ahead: int = 30, scope: Optional[StudentScope] = None) -> List[Dict]:
+    """Students (that `scope` allows) with a birthday in the next days_ahead days, today included,
+    soonest first."""
+    if days_ahead < 0:
+        return []
+    today = datetime.now().date()
+    query, params = _birthdays_query(days_ahead, today, scope)
+    with db_connection(sqlite3.Row) as conn:
+        students = conn.execute(query, params).fetchall()
     result = []
     for s in students:
-        dob_str = s['dob']
-        if not dob_str:
-            continue
-        dob = None
-        for fmt in ('%Y-%m-%d', '%m/%d/%Y', '%d/%m/%Y', '%Y-%m-%d %H:%M:%S'):
-            try:
-                dob = datetime.strptime(str(dob_str)[:10], fmt)
-                break
-            except:
-                continue
-        if not dob:
-            continue
-        next_bday = dob.replace(year=today.year)
-        if next_bday.date() < today.date():
-            next_bday = next_bday.replace(year=today.year + 1)
-        delta = (next_bday.date() - today.date()).days
-        if 0 <= delta <= days_ahead:
+        next_bday = next_birthday(s['birth_month_day'], today)
+        delta = (next_bday - today).days
+        if delta <= days_ahead:
             result.append({
-                'id': s['id'], 'name': s['name'], 'dob': str(dob_str),
+                'id': s['id'], 'name': s['name'], 'dob': s['dob'],
                 'servant': s['servant'], 'class_name': s['class_name'], 'grade': s['grade'],
                 'gender': s['gender'], 'phone': s['phone'], 'parent_phone': s['parent_phone'],
                 'days_until': delta, 'birthday_date': next_bday.strftime('%B %d')
@@ -1585,112 +3136,106 @@ def get_upcoming_birthdays(days_ahead: int = 30) -> List[Dict]:
     return result
 
 
+def get_unparsed_dobs() -> List[Dict]:
+    """Students whose DOB is filled in but is not a date, so they never show up in birthdays."""
+    with db_connection(sqlite3.Row) as conn:
+        rows = conn.execute('''SELECT id, name, dob FROM students
+                               WHERE birth_month_day IS NULL AND trim(COALESCE(dob, '')) != ''
+                               ORDER BY id''').fetchall()
+    return [dict(row) for row in rows]
+
+
 # ==================== EFTIKAD ====================
 
 def submit_eftikad(servant_username: str, student_id: int, date: str,
                    whatsapp_sent: int = 0, called: int = 0, visited: int = 0, notes: str = '') -> int:
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('''CREATE TABLE IF NOT EXISTS eftikad (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        servant_username TEXT NOT NULL,
-        student_id INTEGER NOT NULL,
-        date TEXT NOT NULL,
-        whatsapp_sent INTEGER DEFAULT 0,
-        called INTEGER DEFAULT 0,
-        visited INTEGER DEFAULT 0,
-        notes TEXT DEFAULT '',
-        created_at TEXT NOT NULL
-    )''')
-    created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    cursor.execute('''INSERT INTO eftikad (servant_username, student_id, date, whatsapp_sent, called, visited, notes, created_at)
-        VALUES (?,?,?,?,?,?,?,?)''', (servant_username, student_id, date, whatsapp_sent, called, visited, notes, created_at))
-    eid = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        cursor.execute('''INSERT INTO eftikad (servant_username, student_id, date, whatsapp_sent, called, visited, notes, created_at)
+            VALUES (?,?,?,?,?,?,?,?)''', (servant_username, student_id, date, whatsapp_sent, called, visited, notes, created_at))
+        eid = cursor.lastrowid
+        bump_data_version(conn, 'eftikad')
     return eid
 
 
-def get_eftikad(servant_filter: str = None, date_from: str = None, date_to: str = None) -> List[Dict]:
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    try:
-        query = '''SELECT e.*, s.name as student_name, s.phone, s.parent_phone, s.grade, s.gender, s.class_name, s.servant
-            FROM eftikad e LEFT JOIN students s ON e.student_id = s.id WHERE 1=1'''
-        params = []
-        if servant_filter:
-            query += ' AND e.servant_username=?'
-            params.append(servant_filter)
-        if date_from:
-            query += ' AND e.date >= ?'
-            params.append(date_from)
-        if date_to:
-            query += ' AND e.date <= ?'
-            params.append(date_to)
-        query += ' ORDER BY e.created_at DESC'
+def _eftikad_query(servant_filter: str = None, date_from: str = None, date_to: str = None,
+                  scope: Optional[StudentScope] = None) -> Tuple[str, list]:
+    """SQL + params of get_eftikad."""
+    visible, params = _visibility(scope, 's')
+    query = f'''SELECT e.*, s.name as student_name, s.phone, s.parent_phone, s.grade, s.gender, s.class_name, s.servant
+        FROM eftikad e LEFT JOIN students s ON e.student_id = s.id WHERE {visible}'''
+    if servant_filter:
+        query += ' AND e.servant_username=?'
+        params.append(servant_filter)
+    if date_from:
+        query += ' AND e.date >= ?'
+        params.append(date_from)
+    if date_to:
+        query += ' AND e.date <= ?'
+        params.append(date_to)
+    return query + ' ORDER BY e.created_at DESC', params
+
+
+def get_eftikad(servant_filter: str = None, date_from: str = None, date_to: str = None,
+                scope: Optional[StudentScope] = None) -> List[Dict]:
+    query, params = _eftikad_query(servant_filter, date_from, date_to, scope)
+    with db_connection(sqlite3.Row) as conn:
+        cursor = conn.cursor()
         cursor.execute(query, params)
         rows = [dict(r) for r in cursor.fetchall()]
-    except:
-        rows = []
-    conn.close()
     return rows
 
 
 # ==================== BIBLE TRACKING ====================
 
 def get_bible_tracking(student_id: int, weeks: int = 8) -> List[Dict]:
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM bible_tracking WHERE student_id=? ORDER BY week_start_date DESC LIMIT ?',
-                   (student_id, weeks))
-    rows = [dict(r) for r in cursor.fetchall()]
-    conn.close()
+    with db_connection(sqlite3.Row) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM bible_tracking WHERE student_id=? ORDER BY week_start_date DESC LIMIT ?',
+                       (student_id, weeks))
+        rows = [dict(r) for r in cursor.fetchall()]
     return rows
 
 
 def update_bible_tracking(student_id: int, week_start_date: str, days_read: int) -> bool:
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT id FROM bible_tracking WHERE student_id=? AND week_start_date=?',
-                   (student_id, week_start_date))
-    if cursor.fetchone():
-        cursor.execute('UPDATE bible_tracking SET days_read=? WHERE student_id=? AND week_start_date=?',
-                       (days_read, student_id, week_start_date))
-    else:
-        cursor.execute('INSERT INTO bible_tracking (student_id, week_start_date, days_read) VALUES (?,?,?)',
-                       (student_id, week_start_date, days_read))
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT id FROM bible_tracking WHERE student_id=? AND week_start_date=?',
+                       (student_id, week_start_date))
+        if cursor.fetchone():
+            cursor.execute('UPDATE bible_tracking SET days_read=? WHERE student_id=? AND week_start_date=?',
+                           (days_read, student_id, week_start_date))
+        else:
+            cursor.execute('INSERT INTO bible_tracking (student_id, week_start_date, days_read) VALUES (?,?,?)',
+                           (student_id, week_start_date, days_read))
+        bump_data_version(conn, 'bible_tracking')
     return True
 
 
 def get_bible_tracking_all(servant_filter: str = None) -> List[Dict]:
     """Get bible tracking summary for all students (optionally filtered by servant)."""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    query = '''SELECT s.id, s.name, s.servant, s.grade,
-        s.class_name, COALESCE(bt.days_read, 0) as days_read, bt.week_start_date
-        FROM students s LEFT JOIN bible_tracking bt
-        ON s.id = bt.student_id AND bt.week_start_date = (
-            SELECT MAX(week_start_date) FROM bible_tracking WHERE student_id = s.id
-        ) WHERE 1=1'''
-    params = []
-    if servant_filter:
-        query += ' AND (s.servant=? OR s.class_name=?'
-        params.extend([servant_filter, servant_filter])
-        class_grades = class_grade_values(servant_filter)
-        if class_grades:
-            placeholders = ','.join(['?' for _ in class_grades])
-            query += f' OR s.grade IN ({placeholders})'
-            params.extend(class_grades)
-        query += ')'
-    query += ' ORDER BY s.name'
-    cursor.execute(query, params)
-    rows = [dict(r) for r in cursor.fetchall()]
-    conn.close()
+    with db_connection(sqlite3.Row) as conn:
+        cursor = conn.cursor()
+        query = '''SELECT s.id, s.name, s.servant, s.grade,
+            s.class_name, COALESCE(bt.days_read, 0) as days_read, bt.week_start_date
+            FROM students s LEFT JOIN bible_tracking bt
+            ON s.id = bt.student_id AND bt.week_start_date = (
+                SELECT MAX(week_start_date) FROM bible_tracking WHERE student_id = s.id
+            ) WHERE 1=1'''
+        params = []
+        if servant_filter:
+            query += ' AND (s.servant=? OR s.class_name=?'
+            params.extend([servant_filter, servant_filter])
+            class_grades = class_grade_values(servant_filter)
+            if class_grades:
+                placeholders = ','.join(['?' for _ in class_grades])
+                query += f' OR s.grade IN ({placeholders})'
+                params.extend(class_grades)
+            query += ')'
+        query += ' ORDER BY s.name'
+        cursor.execute(query, params)
+        rows = [dict(r) for r in cursor.fetchall()]
     return rows
 
 
@@ -1698,59 +3243,57 @@ def get_bible_tracking_all(servant_filter: str = None) -> List[Dict]:
 
 def get_class_attendance_stats(servant_filter: str = None, year: str = None, grades=None, sections=None,
                                date_from: str = None, date_to: str = None) -> List[Dict]:
-    """Monthly attendance % per grade for charts."""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    query = '''SELECT s.grade, strftime('%Y-%m', a.date) as month,
-        COUNT(*) as total,
-        SUM(CASE WHEN a.status='present' THEN 1 ELSE 0 END) as present_count
-        FROM attendance a JOIN students s ON a.student_id = s.id
-        WHERE 1=1'''
-    params = []
-    if servant_filter:
-        query += ' AND (s.servant=? OR s.class_name=?'
-        params.extend([servant_filter, servant_filter])
-        class_grades = class_grade_values(servant_filter)
-        if class_grades:
-            placeholders = ','.join(['?' for _ in class_grades])
-            query += f' OR s.grade IN ({placeholders})'
-            params.extend(class_grades)
-        query += ')'
-    normalized_grades = []
-    if grades:
-        raw_grades = grades.replace(';', ',').split(',') if isinstance(grades, str) else list(grades)
-        for grade in raw_grades:
-            value = normalize_grade_value(grade)
-            if value is not None and value not in normalized_grades:
-                normalized_grades.append(value)
-    if normalized_grades:
-        placeholders = ','.join(['?' for _ in normalized_grades])
-        query += f' AND s.grade IN ({placeholders})'
-        params.extend(normalized_grades)
-    normalized_sections = normalize_assigned_sections(sections).split(',') if sections else []
-    gender_variants = []
-    for section in normalized_sections:
-        if section == 'Boy':
-            gender_variants.extend(['M', 'Boy', 'Boys', 'Male', 'male', 'boy'])
-        elif section == 'Girl':
-            gender_variants.extend(['F', 'Girl', 'Girls', 'Female', 'female', 'girl'])
-    gender_variants = list(dict.fromkeys(gender_variants))
-    if gender_variants:
-        placeholders = ','.join(['?' for _ in gender_variants])
-        query += f' AND s.gender IN ({placeholders})'
-        params.extend(gender_variants)
-    if year:
-        query += " AND strftime('%Y', a.date)=?"
-        params.append(year)
-    if date_from:
-        query += " AND a.date >= ?"
-        params.append(date_from)
-    if date_to:
-        query += " AND a.date <= ?"
-        params.append(date_to)
-    query += " GROUP BY s.grade, month ORDER BY month DESC, s.grade LIMIT 120"
-    cursor.execute(query, params)
-    rows = [dict(r) for r in cursor.fetchall()]
-    conn.close()
+    """Monthly attendance % per grade for charts, read from the daily rollup."""
+    with db_connection(sqlite3.Row) as conn:
+        cursor = conn.cursor()
+        query = '''SELECT grade, strftime('%Y-%m', date) as month,
+            SUM(present + absent) as total,
+            SUM(present) as present_count
+            FROM attendance_daily
+            WHERE 1=1'''
+        params = []
+        if servant_filter:
+            query += ' AND (servant=? OR class_name=?'
+            params.extend([servant_filter, servant_filter])
+            class_grades = class_grade_values(servant_filter)
+            if class_grades:
+                placeholders = ','.join(['?' for _ in class_grades])
+                query += f' OR grade IN ({placeholders})'
+                params.extend(class_grades)
+            query += ')'
+        normalized_grades = []
+        if grades:
+            raw_grades = grades.replace(';', ',').split(',') if isinstance(grades, str) else list(grades)
+            for grade in raw_grades:
+                value = normalize_grade_value(grade)
+                if value is not None and value not in normalized_grades:
+                    normalized_grades.append(value)
+        if normalized_grades:
+            placeholders = ','.join(['?' for _ in normalized_grades])
+            query += f' AND grade IN ({placeholders})'
+            params.extend(normalized_grades)
+        normalized_sections = normalize_assigned_sections(sections).split(',') if sections else []
+        gender_variants = []
+        for section in normalized_sections:
+            if section == 'Boy':
+                gender_variants.extend(['M', 'Boy', 'Boys', 'Male', 'male', 'boy'])
+            elif section == 'Girl':
+                gender_variants.extend(['F', 'Girl', 'Girls', 'Female', 'female', 'girl'])
+        gender_variants = list(dict.fromkeys(gender_variants))
+        if gender_variants:
+            placeholders = ','.join(['?' for _ in gender_variants])
+            query += f' AND gender IN ({placeholders})'
+            params.extend(gender_variants)
+        if year:
+            query += " AND strftime('%Y', date)=?"
+            params.append(year)
+        if date_from:
+            query += " AND date >= ?"
+            params.append(date_from)
+        if date_to:
+            query += " AND date <= ?"
+            params.append(date_to)
+        query += " GROUP BY grade, month ORDER BY month DESC, grade LIMIT 120"
+        cursor.execute(query, params)
+        rows = [dict(r) for r in cursor.fetchall()]
     return rows
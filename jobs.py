@@ -0,0 +1,186 @@
+"""
+Background jobs for work too slow for a request thread.
+
+Imports, exports and report workbooks are queued as rows in the jobs table and
+run by a small fixed pool of worker threads, so they neither tie up waitress
+threads nor hit proxy timeouts. Because the queue lives in the database, jobs
+that were queued or running when the process stopped are picked up again by
+start(). Handlers must therefore be safe to re-run (the importers are).
+
+A handler is registered with @handler('kind') and called with a Job. It reports
+progress through job.progress(), writes any output file under job.path(), and
+returns a JSON-able result dict. Put the output file name in result['filename']
+to make it downloadable.
+"""
+import os
+import queue
+import shutil
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+import database as db
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_MAX_ATTEMPTS = 3
+JOB_RETENTION_DAYS = 7
+PROGRESS_INTERVAL = 0.5  # seconds between progress writes
+
+HANDLERS = {}
+
+_queue = queue.Queue()
+_workers = []
+_start_lock = threading.Lock()
+WORKER_ID = f'{socket.gethostname()}:{os.getpid()}'
+
+
+def handler(kind, min_role='sub_admin', files=()):
+    """Register fn(job) -> result dict as the handler for a job kind.
+
+    min_role is the least role allowed to submit it; files names the uploads it needs.
+    """
+    def register(fn):
+        HANDLERS[kind] = {'fn': fn, 'min_role': min_role, 'files': tuple(files)}
+        return fn
+    return register
+
+
+def job_dir(job_id):
+    """Directory holding a job's input and output files."""
+    root = os.environ.get('JOB_DIR') or os.path.join(os.path.dirname(os.path.abspath(db.DB_FILE)), 'jobs')
+    return os.path.join(root, str(job_id))
+
+
+class Job:
+    """What a handler sees of the job it is running."""
+
+    def __init__(self, row):
+        self.id = row['id']
+        self.kind = row['kind']
+        self.params = row['params']
+        self.created_by = row['created_by']
+        self._last_progress = 0.0
+
+    def path(self, name):
+        """Path of a file in this job's directory."""
+        return os.path.join(job_dir(self.id), name)
+
+    def progress(self, done, total=None, message=None):
+        """Record progress, at most every PROGRESS_INTERVAL seconds unless the work is complete."""
+        now = time.monotonic()
+        if now - self._last_progress < PROGRESS_INTERVAL and (total is None or done < total):
+            return
+        self._last_progress = now
+        db.update_job_progress(self.id, done, total, message)
+
+
+def submit(kind, params=None, created_by=None, files=None):
+    """Queue a job and return its id.
+
+    files maps names to werkzeug FileStorage uploads; each is saved in the job's
+    directory and its path passed to the handler as params[name].
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f'Unknown job kind: {kind}')
+    params = dict(params or {})
+    job_id = db.create_job(kind, params, created_by)
+    if files:
+        os.makedirs(job_dir(job_id), exist_ok=True)
+        for name, upload in files.items():
+            path = os.path.join(job_dir(job_id), f'input_{name}{os.path.splitext(upload.filename)[1]}')
+            upload.save(path)
+            params[name] = path
+        # Written before the job is dispatched, so no worker sees it without its inputs.
+        db.set_job_params(job_id, params)
+    start()
+    _queue.put(job_id)
+    return job_id
+
+
+def _run(job_id):
+    row = db.claim_job(job_id, WORKER_ID)
+    if not row:
+        return
+    if row['kind'] not in HANDLERS:
+        db.fail_job(job_id, f"Unknown job kind: {row['kind']}")
+        return
+    job = Job(row)
+    os.makedirs(job_dir(job_id), exist_ok=True)
+    try:
+        result = HANDLERS[job.kind]['fn'](job) or {}
+        filename = result.get('filename')
+        db.finish_job(job_id, result, job.path(filename) if filename else None)
+    except Exception as e:
+        traceback.print_exc()
+        db.fail_job(job_id, str(e))
+    for name in os.listdir(job_dir(job_id)):
+        if name.startswith('input_'):
+            os.remove(job.path(name))
+
+
+def _worker():
+    while True:
+        job_id = _queue.get()
+        try:
+            _run(job_id)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            db.release_connection()
+            _queue.task_done()
+
+
+def start():
+    """Start the worker pool once per process, then recover()."""
+    with _start_lock:
+        if _workers:
+            return
+        for n in range(max(1, JOB_WORKERS)):
+            thread = threading.Thread(target=_worker, name=f'job-worker-{n + 1}', daemon=True)
+            thread.start()
+            _workers.append(thread)
+    recover()
+
+
+def recover():
+    """Drop expired jobs and queue every job that is waiting or was orphaned by a dead process."""
+    prune()
+    for job_id in db.requeue_interrupted_jobs(JOB_MAX_ATTEMPTS, _is_orphaned):
+        _queue.put(job_id)
+
+
+def _is_orphaned(worker):
+    """True unless `worker` is another process on this host that is still alive.
+
+    A job claimed under our own id was left by an earlier process that had the same
+    pid (common in containers), since this one has not run anything yet.
+    """
+    host, _, pid = worker.rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit() or int(pid) == os.getpid():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass
+    return False
+
+
+def prune(days=JOB_RETENTION_DAYS):
+    """Delete finished jobs older than `days` along with their files."""
+    cutoff = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+    for job_id in db.delete_finished_jobs(cutoff):
+        shutil.rmtree(job_dir(job_id), ignore_errors=True)
+
+
+def wait(timeout=None):
+    """Block until the queue is drained (used by scripts and checks)."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while _queue.unfinished_tasks:
+        if deadline is not None and time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
@@ -0,0 +1,22 @@
+"""
+Apply pending schema migrations to attendance.db and report the schema version.
+Safe to run any time: migrations already recorded in schema_version are skipped.
+"""
+import sys
+sys.path.insert(0, '.')
+import database as db
+
+print("Running database migrations...")
+applied = db.init_db()
+names = {version: name for version, name, _ in db.MIGRATIONS}
+if applied:
+    for version in applied:
+        print(f"  applied {version:03d} {names[version]}")
+else:
+    print("  nothing to apply")
+print(f"Schema version: {db.get_schema_version()}")
+
+users = db.get_all_users()
+print(f"\nCurrent users in database ({len(users)}):")
+for u in users:
+    print(f"  id={u['id']}  username={u['username']}  role={u['role']}")
@@ -0,0 +1,28 @@
+"""
+Recompute points awards from the attendance history with the current rules
+(database.POINT_VALUES) and show how points_history and balances would change.
+
+Usage:  python replay_points.py [--apply]
+"""
+import sys
+import time
+
+import database as db
+
+apply = '--apply' in sys.argv[1:]
+db.init_db()
+started = time.perf_counter()
+result = db.replay_points(apply=apply)
+elapsed = time.perf_counter() - started
+
+print(f"Replayed {result['records']} attendance records in {elapsed:.2f}s")
+for kind in ('added', 'removed', 'changed'):
+    print(f"  awards {kind}: {len(result[kind])}")
+    for award in result[kind][:10]:
+        print(f"    student {award['student_id']:>5} {award['rule_code']:<17} {award['period_key']:<10} "
+              f"{award['current']:>4} -> {award['expected']}")
+print(f"  balances changed: {len(result['balances'])}")
+for balance in result['balances'][:20]:
+    print(f"    student {balance['student_id']:>5} {balance['current']:>6} -> {balance['expected']:<6} ({balance['delta']:+d})")
+if result['added'] or result['removed'] or result['changed'] or result['balances']:
+    print('Applied.' if apply else 'Nothing written; run with --apply to rewrite awards and balances.')
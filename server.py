@@ -5,6 +5,7 @@ Optimized for cloud deployment (Render, Railway, etc.)
 
 from waitress import serve
 from app import app
+import database as db
 import logging
 import os
 
@@ -27,6 +28,10 @@ if __name__ == '__main__':
     logger.info(f"Host: {HOST}")
     logger.info(f"Port: {PORT}")
     logger.info(f"Threads: {THREADS}")
+    tuning = db.describe_tuning()
+    logger.info(f"Database: {db.DB_FILE} (profile: {tuning['profile']})")
+    for key, value in tuning['effective'].items():
+        logger.info(f"  {key}: {value}")
     logger.info("=" * 50)
     
     # Serve the application
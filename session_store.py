@@ -0,0 +1,95 @@
+"""
+Server-side sessions kept in the sessions table.
+
+Flask's default session signs the whole session dict into the cookie, and a
+permanent session is re-sent on every response. With SESSION_BACKEND=sqlite the
+cookie holds only a random session id. The data lives in the database behind
+database.load_session's in-memory cache, so a request normally costs no query.
+The cookie is only sent when the session is created, changes, or has its expiry
+pushed forward (at most once every SESSION_REFRESH_INTERVAL).
+
+Clearing a session (login, logout) drops its row and gives the next login a new
+id. Expired rows are swept every SESSION_SWEEP_INTERVAL.
+"""
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask.sessions import SecureCookieSession, SessionInterface
+
+import database as db
+
+SESSION_REFRESH_INTERVAL = timedelta(days=1)
+SESSION_SWEEP_INTERVAL = 3600  # seconds
+
+
+class ServerSideSession(SecureCookieSession):
+    """Session dict that remembers the row it was loaded from."""
+
+    def __init__(self, initial=None, sid=None, expires_at=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.stale_sid = None
+
+    def clear(self):
+        # A cleared session never reuses its id, so a login cannot inherit one fixed beforehand.
+        if self.sid:
+            self.stale_sid, self.sid = self.sid, None
+        super().clear()
+
+
+class SQLiteSessionInterface(SessionInterface):
+    """Flask session interface storing sessions with database.save_session."""
+
+    def __init__(self):
+        self._last_sweep = 0.0
+        self._sweep_lock = threading.Lock()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            stored = db.load_session(sid)
+            if stored:
+                data, expires_at = stored
+                return ServerSideSession(data, sid=sid, expires_at=expires_at)
+        return ServerSideSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if session.stale_sid:
+            db.delete_session(session.stale_sid)
+        if not session:
+            if session.stale_sid:
+                response.delete_cookie(name, domain=domain, path=path, secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app), httponly=self.get_cookie_httponly(app))
+            return
+
+        # Rows outlive a browser-session cookie too; the server-side expiry is always the full lifetime.
+        lifetime = app.permanent_session_lifetime
+        now = datetime.now()
+        refresh = session.expires_at is not None and session.expires_at - lifetime + SESSION_REFRESH_INTERVAL <= now
+        if session.sid and not session.modified and not refresh:
+            return
+
+        session.sid = session.sid or secrets.token_urlsafe(32)
+        session.expires_at = now + lifetime
+        db.save_session(session.sid, dict(session), session.expires_at)
+        response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                            secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+        self._sweep()
+
+    def _sweep(self):
+        now = time.monotonic()
+        with self._sweep_lock:
+            if now - self._last_sweep < SESSION_SWEEP_INTERVAL:
+                return
+            self._last_sweep = now
+        db.delete_expired_sessions()
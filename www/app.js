@@ -4,6 +4,8 @@
 const DB_NAME = 'AttendanceDB';
 const DB_VERSION = 6;
 const ALL_GRADES = ['Pre K3', 'Pre K4', 'KG', '1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12'];
+const POINTS_LEADERBOARD_SIZE = 100;
+const JOB_POLL_MS = 1000;
 
 class AttendanceApp {
     constructor() {
@@ -568,11 +570,6 @@ class AttendanceApp {
         });
     }
 
-    cacheBustUrl(url) {
-        const separator = url.includes('?') ? '&' : '?';
-        return `${url}${separator}_=${Date.now()}`;
-    }
-
     normalizeServerStudent(student) {
         const parsedId = parseInt(student.id, 10);
         return {
@@ -601,17 +598,57 @@ class AttendanceApp {
         });
     }
 
+    async applyStudentChanges(students, deletedIds) {
+        return new Promise((resolve, reject) => {
+            const transaction = this.db.transaction(['students'], 'readwrite');
+            const store = transaction.objectStore('students');
+            deletedIds.forEach(id => store.delete(id));
+            students.forEach(student => store.put(this.normalizeServerStudent(student)));
+            transaction.oncomplete = () => resolve();
+            transaction.onerror = () => reject(transaction.error);
+        });
+    }
+
+    async studentsSyncCursor() {
+        // Changes only apply on top of a roster this phone already has. A full download
+        // at least once a day also drops students that were only edited on the phone.
+        const cursor = localStorage.getItem('studentsSyncCursor');
+        const lastFullSync = Date.parse(localStorage.getItem('lastStudentsFullSync') || '');
+        if (!cursor || !(Date.now() - lastFullSync < 24 * 60 * 60 * 1000)) return null;
+        const count = await new Promise((resolve, reject) => {
+            const request = this.db.transaction(['students'], 'readonly').objectStore('students').count();
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => reject(request.error);
+        });
+        return count ? cursor : null;
+    }
+
     async syncStudentsFromServer({ silent = false } = {}) {
         if (!this.username) return false;
         try {
-            const response = await fetch(this.cacheBustUrl('/api/students'), { cache: 'no-store' });
+            const cursor = await this.studentsSyncCursor();
+            const url = cursor ? `/api/sync/students?since=${encodeURIComponent(cursor)}` : '/api/sync/students';
+            // Revalidate instead of bypassing the cache: an unchanged roster comes back as a 304
+            // and the browser reuses the body (and cursor) it already has for this URL.
+            const response = await fetch(url, { cache: 'no-cache' });
             if (!response.ok) throw new Error(`Students sync failed (${response.status})`);
             const data = await response.json();
-            if (!Array.isArray(data.students)) throw new Error('Invalid students response');
+            if (!Array.isArray(data.students) || !Array.isArray(data.deleted)) throw new Error('Invalid students response');
 
-            await this.replaceAllStudents(data.students);
+            if (data.full) {
+                await this.replaceAllStudents(data.students);
+                localStorage.setItem('lastStudentsFullSync', new Date().toISOString());
+            } else {
+                await this.applyStudentChanges(data.students, data.deleted);
+            }
+            localStorage.setItem('studentsSyncCursor', data.cursor);
             localStorage.setItem('lastStudentsSync', new Date().toISOString());
-            if (!silent) this.showToast(`Synced ${data.students.length} students from server`, 'success');
+            if (!silent) {
+                const message = data.full
+                    ? `Synced ${data.students.length} students from server`
+                    : `Synced ${data.students.length + data.deleted.length} student changes from server`;
+                this.showToast(message, 'success');
+            }
             return true;
         } catch (error) {
             console.warn('Student sync failed; using phone data', error);
@@ -1456,7 +1493,7 @@ class AttendanceApp {
         }
     }
 
-    downloadAdminReports() {
+    async downloadAdminReports() {
         const dateFrom = document.getElementById('main-report-date-from').value;
         const dateTo = document.getElementById('main-report-date-to').value;
         const gradeVal = document.getElementById('main-report-grade')?.value || '';
@@ -1466,8 +1503,31 @@ class AttendanceApp {
         if (dateTo) params.set('to', dateTo);
         if (gradeVal) params.set('grade', gradeVal);
         if (typeVal) params.set('type', typeVal);
-        window.open(`/api/admin/servant-reports/download?${params.toString()}`, '_blank');
-        this.showToast('Downloading Excel...', 'info');
+        this.showToast('Preparing Excel...', 'info');
+        try {
+            const job = await this.runJob('servant_reports', Object.fromEntries(params));
+            window.location.href = job.download_url;
+        } catch (e) {
+            this.showToast(e.message || 'Error preparing Excel', 'error');
+        }
+    }
+
+    // Queue a server-side job and resolve with it once it has finished.
+    async runJob(kind, params = {}) {
+        const res = await fetch(`/api/jobs/${kind}`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(params)
+        });
+        const data = await res.json();
+        if (!res.ok) throw new Error(data.error || 'Could not start job');
+        let job = data.job;
+        while (job.status === 'queued' || job.status === 'running') {
+            await new Promise(resolve => setTimeout(resolve, JOB_POLL_MS));
+            job = await (await fetch(`/api/jobs/${job.id}`)).json();
+        }
+        if (job.status !== 'done') throw new Error(job.error || 'Job failed');
+        return job;
     }
 
     // =============================================================
@@ -3290,40 +3350,51 @@ class AttendanceApp {
 
     async loadPoints() {
         const servant = document.getElementById('points-servant-filter').value;
+        if (this.canSeeAllClasses()) {
+            // Ranked and totalled on the server; only the top rows are sent.
+            const params = new URLSearchParams({ limit: String(POINTS_LEADERBOARD_SIZE) });
+            if (servant && servant !== 'all') params.set('servant', servant);
+            const res = await fetch(`/api/points/leaderboard?${params}`);
+            const data = await res.json();
+            const students = (data.students || []).map(student => ({ ...student, _serverPointsId: student.id }));
+            this.renderPoints(students, data.total_points || 0, data.total_students || 0, data.classes || []);
+            return;
+        }
         const url = servant && servant !== 'all' ? `/api/points/all?servant=${encodeURIComponent(servant)}` : '/api/points/all';
         const res = await fetch(url);
         const data = await res.json();
-        const serverStudents = this.canSeeAllClasses() ? (data.students || []) : await this.filterStudentsForCurrentRole(data.students || []);
-        let students = serverStudents;
-        if (!this.canSeeAllClasses()) {
-            const merged = new Map();
-            serverStudents.forEach(student => {
-                merged.set(this.studentIdentityKey(student), { ...student, _serverPointsId: student.id });
-            });
-            const localStudents = await this.filterStudentsForCurrentRole(await this.getAllStudents());
-            localStudents.forEach(student => {
-                const key = this.studentIdentityKey(student);
-                if (!merged.has(key)) {
-                    merged.set(key, { ...student, points: 0, _serverPointsId: null });
-                }
-            });
-            students = [...merged.values()].sort((a, b) => (b.points || 0) - (a.points || 0));
-        }
+        const serverStudents = await this.filterStudentsForCurrentRole(data.students || []);
+        const merged = new Map();
+        serverStudents.forEach(student => {
+            merged.set(this.studentIdentityKey(student), { ...student, _serverPointsId: student.id });
+        });
+        const localStudents = await this.filterStudentsForCurrentRole(await this.getAllStudents());
+        localStudents.forEach(student => {
+            const key = this.studentIdentityKey(student);
+            if (!merged.has(key)) {
+                merged.set(key, { ...student, points: 0, _serverPointsId: null });
+            }
+        });
+        const students = [...merged.values()].sort((a, b) => (b.points || 0) - (a.points || 0));
+        const totalPts = students.reduce((s, st) => s + (st.points || 0), 0);
+        this.renderPoints(students, totalPts, students.length, this.groupPointsByClass(students));
+    }
+
+    renderPoints(students, totalPts, studentCount, classes) {
         this._pointsRows = {};
         students.forEach(student => {
             this._pointsRows[this.studentIdentityKey(student)] = student;
         });
 
-        const totalPts = students.reduce((s, st) => s + (st.points || 0), 0);
         document.getElementById('points-total-display').textContent = totalPts;
-        document.getElementById('points-students-count').textContent = students.length;
-        const average = students.length ? Math.round(totalPts / students.length) : 0;
+        document.getElementById('points-students-count').textContent = studentCount;
+        const average = studentCount ? Math.round(totalPts / studentCount) : 0;
         const topStudent = students.length ? students.reduce((top, st) => ((st.points || 0) > (top.points || 0) ? st : top), students[0]) : null;
         const averageEl = document.getElementById('points-average-display');
         const topEl = document.getElementById('points-top-student');
         if (averageEl) averageEl.textContent = average;
         if (topEl) topEl.textContent = topStudent ? `${topStudent.name} (${topStudent.points || 0})` : '--';
-        this.renderPointsClassBreakdown(students);
+        this.renderPointsClassBreakdown(classes);
 
         const container = document.getElementById('points-list');
         if (students.length === 0) {
@@ -3335,7 +3406,7 @@ class AttendanceApp {
             return `
             <div onclick="app.showStudentPoints('${key}', '${this.jsString(s.name)}')"
                 style="display:flex;align-items:center;gap:12px;background:var(--surface-container-high);border-radius:14px;padding:12px 14px;margin-bottom:8px;cursor:pointer;transition:transform 0.15s;">
-                <div style="width:32px;height:32px;border-radius:50%;background:${i===0?'#FFD700':i===1?'#C0C0C0':i===2?'#CD7F32':'var(--surface-variant)'};display:flex;align-items:center;justify-content:center;font-weight:800;font-size:0.85rem;color:${i<3?'#000':'var(--on-surface-variant)'};">${i+1}</div>
+                <div style="width:32px;height:32px;border-radius:50%;background:${i===0?'#FFD700':i===1?'#C0C0C0':i===2?'#CD7F32':'var(--surface-variant)'};display:flex;align-items:center;justify-content:center;font-weight:800;font-size:0.85rem;color:${i<3?'#000':'var(--on-surface-variant)'};">${s.rank || i+1}</div>
                 <div style="flex:1;">
                     <div style="font-weight:600;font-size:0.95rem;">${s.name}</div>
                     <div style="font-size:0.75rem;color:var(--on-surface-variant);">${s.servant || ''} ${s.grade ? '· Grade '+s.grade : ''}</div>
@@ -3347,32 +3418,34 @@ class AttendanceApp {
         }).join('');
     }
 
-    renderPointsClassBreakdown(students) {
-        const container = document.getElementById('points-class-breakdown');
-        if (!container) return;
-
+    groupPointsByClass(students) {
         const groups = new Map();
         students.forEach(student => {
             const className = student.class_name || this.gradeToClassName(student.grade) || student.servant || 'Unassigned';
             if (!groups.has(className)) {
-                groups.set(className, { students: 0, points: 0 });
+                groups.set(className, { class_name: className, students: 0, points: 0 });
             }
             const group = groups.get(className);
             group.students += 1;
             group.points += student.points || 0;
         });
+        return [...groups.values()].sort((a, b) => b.points - a.points);
+    }
+
+    renderPointsClassBreakdown(classes) {
+        const container = document.getElementById('points-class-breakdown');
+        if (!container) return;
 
-        if (groups.size === 0) {
+        if (classes.length === 0) {
             container.innerHTML = '<div style="padding:12px;border-radius:12px;background:var(--surface-container-high);color:var(--on-surface-variant);text-align:center;">No class points yet</div>';
             return;
         }
 
-        container.innerHTML = [...groups.entries()]
-            .sort((a, b) => b[1].points - a[1].points)
-            .map(([name, group]) => `
+        container.innerHTML = classes
+            .map(group => `
                 <div style="display:flex;align-items:center;gap:10px;background:var(--surface-container-high);border-radius:12px;padding:10px 12px;">
                     <div style="flex:1;">
-                        <div style="font-weight:800;font-size:0.9rem;">${name}</div>
+                        <div style="font-weight:800;font-size:0.9rem;">${group.class_name}</div>
                         <div style="font-size:0.74rem;color:var(--on-surface-variant);">${group.students} students</div>
                     </div>
                     <div style="font-size:1.1rem;font-weight:900;color:var(--primary);">${group.points}</div>